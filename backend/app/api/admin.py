@@ -1,12 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
-from ..models.schemas import AdminUserResponse, UserQuotaUpdate
+from ..models.schemas import AdminUserResponse, UserQuotaUpdate, JobResponse
 from ..models.user import User
 from ..core.database import get_db
 from ..core.auth import get_current_user
 from ..services.user_service import get_all_users, update_user_quota
+from ..services.storage_migration_service import get_migration_status, run_storage_migration
+from ..services.gc_service import get_gc_status, schedule_gc
+from ..services.storage_scan_service import get_scan_status, schedule_storage_scan
+from ..services.quota_service import schedule_stats_rebuild
+from ..services.search_service import schedule_search_index_rebuild
 
 router = APIRouter(prefix="/api/v1/admin")
 
@@ -55,3 +60,87 @@ async def update_user_disk_quota(
             detail=f"User with ID {user_id} not found"
         )
     return updated_user
+
+@router.get("/storage-migration")
+async def storage_migration_status(
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Прогресс переноса старых файлов в шардированное хранилище.
+    Только для администраторов.
+    """
+    return get_migration_status(db)
+
+@router.post("/storage-migration", status_code=status.HTTP_202_ACCEPTED)
+async def start_storage_migration(
+    background_tasks: BackgroundTasks,
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Запустить перенос старых файлов в фоне (если он еще не запущен).
+    Только для администраторов.
+    """
+    background_tasks.add_task(run_storage_migration)
+    return get_migration_status(db)
+
+@router.get("/gc")
+async def storage_gc_status(
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Прогресс сборки мусора и последней проверки хранилища.
+    Только для администраторов.
+    """
+    return {"gc": get_gc_status(db), "scan": get_scan_status()}
+
+@router.post("/gc", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def start_storage_gc(
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Удалить файлы из корзины старше срока хранения и освободить
+    содержимое, на которое больше никто не ссылается.
+    Только для администраторов.
+    """
+    return schedule_gc(db, owner_id=admin_user.telegram_id)
+
+@router.post("/gc/scan", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def start_storage_scan(
+    cleanup: bool = Query(False),
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Сверить файлы на дисках с базой: найти файлы-сироты и записи без данных.
+    С cleanup=true сироты удаляются, а потерянные копии восстанавливаются.
+    Только для администраторов.
+    """
+    return schedule_storage_scan(db, cleanup=cleanup, owner_id=admin_user.telegram_id)
+
+@router.post("/stats/rebuild", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def start_stats_rebuild(
+    owner_id: Optional[str] = Query(None),
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Пересчитать счетчики файлов и папок и размеры папок по файлам в базе:
+    для пользователя с указанным telegram_id или для всех пользователей.
+    Только для администраторов.
+    """
+    return schedule_stats_rebuild(db, owner_id=owner_id, requested_by=admin_user.telegram_id)
+
+@router.post("/search/rebuild", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def start_search_index_rebuild(
+    admin_user: User = Depends(get_admin_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Перестроить поисковый индекс имен файлов и папок, например после VACUUM.
+    Только для администраторов.
+    """
+    return schedule_search_index_rebuild(db, requested_by=admin_user.telegram_id)
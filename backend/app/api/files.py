@@ -1,5 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, status, Response, Body
-from fastapi.responses import FileResponse as FastAPIFileResponse
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, status, Response, Body, Query, Request
 from sqlalchemy.orm import Session
 import os
 import uuid
@@ -7,17 +6,31 @@ from datetime import datetime, timedelta
 from typing import Optional, List, Dict
 import shutil
 
-from ..models.schemas import FileCreate, FileResponse as FileSchemaResponse, FileUpdate
+from ..models.schemas import (
+    FileCreate, FileResponse as FileSchemaResponse, FileUpdate,
+    SignedUrlCreate, SignedUrlResponse, SignedUrlRevoke
+)
 from ..models.user import User
 from ..models.file import File as FileModel
 from ..core.database import get_db
 from ..core.auth import get_current_user, get_current_user_optional
 from ..core.config import settings
+from ..core.file_responses import file_download_response, cached_file_response
 from ..services.file_service import (
     create_file, get_files_by_owner, get_file_by_id, 
-    delete_file, update_file, get_file_content, is_owner_of_file,
+    delete_file, update_file, get_file_content, file_download_options, is_owner_of_file,
     toggle_file_visibility
 )
+from ..services.signed_url_service import (
+    create_signed_url, verify_signature, parse_byte_range, revoke_signed_urls
+)
+from ..services.thumbnail_service import (
+    get_thumbnail, thumbnail_key, thumbnail_sizes, THUMBNAIL_MEDIA_TYPE
+)
+from ..services.upload_service import store_upload_stream, release_upload_reservation
+from ..services.folder_service import get_folder_by_id, get_files_in_subtree
+from ..services.user_service import available_bytes
+from .uploads import get_upload_reservation_optional, insufficient_space, check_folder
 
 router = APIRouter(prefix="/api/v1/files")
 
@@ -26,6 +39,7 @@ async def upload_file(
     file: UploadFile = File(...),
     folder_id: Optional[str] = Form(None),
     is_public: bool = Form(False),
+    db_reservation = Depends(get_upload_reservation_optional),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -65,41 +79,33 @@ async def upload_file(
             detail=f"File size exceeds the maximum allowed size of {settings.MAX_FILE_SIZE_MB} MB"
         )
     
-    # Check user quota
-    if current_user.used_space + file_size_mb > current_user.quota:
-        raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail=f"Insufficient storage space. Available: {current_user.quota - current_user.used_space:.2f} MB"
-        )
-    
-    # Generate unique file storage path
-    storage_dir = os.path.join(settings.UPLOAD_DIR, "private_files" if not is_public else "public_files")
-    os.makedirs(storage_dir, exist_ok=True)
-    
-    file_uuid = str(uuid.uuid4())
-    storage_filename = f"{current_user.telegram_id}_{file_uuid}_{file.filename}"
-    storage_path = os.path.join(storage_dir, storage_filename)
+    if db_reservation:
+        # Место уже зарезервировано pre-flight запросом
+        if file_size_bytes > db_reservation.size_bytes:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="File size exceeds the reserved size"
+            )
+        processed_folder_id = db_reservation.folder_id
+        is_public = db_reservation.is_public
+    else:
+        # Check user quota
+        available = available_bytes(current_user)
+        if file_size_bytes > available:
+            raise insufficient_space(available)
     
     # Сохраняем файл в хранилище с использованием потоковой записи
     # Для больших файлов используем чтение и запись по частям
-    with open(storage_path, "wb") as buffer:
+    async def read_chunks():
         # Сбрасываем позицию чтения файла в начало
         await file.seek(0)
-        # Читаем и записываем файл по частям (10 МБ за раз)
+        # Читаем файл по частям (10 МБ за раз)
         chunk_size = 10 * 1024 * 1024  # 10 МБ
         while True:
             chunk = await file.read(chunk_size)
             if not chunk:
                 break
-            buffer.write(chunk)
-    
-    # Generate public URL if file is public
-    public_url = None
-    if is_public:
-        public_url = f"{settings.PUBLIC_URL}/public/{storage_filename}"
-    
-    # Generate UUID for the file ID
-    file_id = str(uuid.uuid4())
+            yield chunk
     
     # Create file record in database
     file_data = FileCreate(
@@ -107,26 +113,118 @@ async def upload_file(
         folder_id=processed_folder_id,
         is_public=is_public
     )
-    return create_file(
-        db=db, 
-        file=file_data, 
-        owner_id=current_user.telegram_id, 
-        storage_path=storage_path,
-        size_mb=file_size_mb,
+    db_file = await store_upload_stream(
+        db=db,
+        chunks=read_chunks(),
+        file=file_data,
+        owner_id=current_user.telegram_id,
+        max_bytes=settings.MAX_FILE_SIZE_MB * 1024 * 1024,
+        public_url_base=settings.PUBLIC_URL,
         mime_type=file.content_type,
-        public_url=public_url,
-        file_id=file_id
+        size_hint=file_size_bytes,
+        # Без токена место удерживается на время загрузки
+        reserved_bytes=None if db_reservation else file_size_bytes
     )
+    
+    if db_reservation:
+        release_upload_reservation(db, db_reservation)
+    
+    return db_file
+
+@router.post("/stream", response_model=FileSchemaResponse)
+async def upload_file_stream(
+    request: Request,
+    filename: Optional[str] = Query(None),
+    folder_id: Optional[int] = Query(None),
+    is_public: bool = Query(False),
+    db_reservation = Depends(get_upload_reservation_optional),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Upload a file sent as the raw request body (no multipart encoding).
+    The body is written directly to storage while it arrives, and the size
+    limit and quota are enforced per chunk instead of after the whole upload.
+    
+    With an X-Upload-Token header the upload uses the space, folder and
+    visibility reserved by POST /api/v1/uploads/reservations.
+    """
+    max_file_bytes = settings.MAX_FILE_SIZE_MB * 1024 * 1024
+    
+    if db_reservation:
+        filename = filename or db_reservation.filename
+        folder_id = db_reservation.folder_id
+        is_public = db_reservation.is_public
+        max_bytes = min(db_reservation.size_bytes, max_file_bytes)
+        limit_error = HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="File size exceeds the reserved size"
+        )
+    else:
+        available = max(available_bytes(current_user), 0)
+        if max_file_bytes <= available:
+            max_bytes = max_file_bytes
+            limit_error = HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"File size exceeds the maximum allowed size of {settings.MAX_FILE_SIZE_MB} MB"
+            )
+        else:
+            max_bytes = available
+            limit_error = insufficient_space(available)
+    
+    if not filename:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="filename is required")
+    
+    # Если размер известен заранее, отклоняем запрос до чтения тела
+    content_length = request.headers.get("content-length")
+    declared_size = None
+    if content_length is not None:
+        if not content_length.isdigit():
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid Content-Length header")
+        declared_size = int(content_length)
+        if declared_size > max_bytes:
+            raise limit_error
+    
+    try:
+        db_file = await store_upload_stream(
+            db=db,
+            chunks=request.stream(),
+            file=FileCreate(filename=filename, folder_id=folder_id, is_public=is_public),
+            owner_id=current_user.telegram_id,
+            max_bytes=max_bytes,
+            public_url_base=settings.PUBLIC_URL,
+            mime_type=request.headers.get("content-type"),
+            size_hint=declared_size or 0,
+            # Без длины (chunked) место резервируется по мере поступления данных
+            reserved_bytes=None if db_reservation else declared_size or 0
+        )
+    except ValueError:
+        raise limit_error
+    
+    if db_reservation:
+        release_upload_reservation(db, db_reservation)
+    
+    return db_file
 
 @router.get("", response_model=List[FileSchemaResponse])
 async def list_files(
     folder_id: Optional[int] = None,
+    recursive: bool = False,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
-    List files owned by the current user, optionally filtered by folder
+    List files owned by the current user, optionally filtered by folder.
+    With recursive the files of all subfolders are included as well.
     """
+    if recursive and folder_id is not None:
+        folder = get_folder_by_id(db, folder_id)
+        if not folder or folder.is_deleted:
+            raise HTTPException(status_code=404, detail="Folder not found")
+        if folder.owner_id != current_user.telegram_id:
+            raise HTTPException(status_code=403, detail="Not authorized to access this folder")
+        return get_files_in_subtree(db, folder)
+    
     return get_files_by_owner(db, current_user.telegram_id, folder_id)
 
 @router.get("/{file_id}", response_model=FileSchemaResponse)
@@ -148,9 +246,10 @@ async def get_file(
     return file
 
 # Основной endpoint для скачивания файлов - работает и с публичными, и с приватными файлами
-@router.get("/{file_id}/download")
+@router.api_route("/{file_id}/download", methods=["GET", "HEAD"])
 async def download_file(
     file_id: str,
+    request: Request,
     db: Session = Depends(get_db),
     current_user: Optional[User] = Depends(get_current_user_optional)
 ):
@@ -158,6 +257,9 @@ async def download_file(
     Download file content with authentication. All files require authentication.
     Private files also require owner permissions.
     
+    Supports HEAD, byte ranges (Range / If-Range) and conditional requests
+    (If-None-Match / If-Modified-Since).
+    
     This endpoint is designed to be used with client-side JavaScript for handling downloads:
     
     ```javascript
@@ -196,25 +298,24 @@ async def download_file(
     if not file.is_public and file.owner_id != current_user.telegram_id:
         raise HTTPException(status_code=403, detail="Not authorized to download this file")
     
-    file_path = os.path.join(settings.UPLOAD_DIR, file.storage_path)
-    if not os.path.exists(file_path):
+    file_path = await get_file_content(db, file)
+    if not file_path:
         raise HTTPException(status_code=404, detail="File not found on server")
     
-    return FastAPIFileResponse(
-        path=file_path,
-        filename=file.filename,
-        media_type=file.mime_type or "application/octet-stream"
+    return await file_download_response(
+        request, file_path, file.filename, file.mime_type, **file_download_options(file)
     )
 
 # Новый маршрут для публичных файлов (не требует аутентификации)
-@router.get("/public/{file_id}/download")
+@router.api_route("/public/{file_id}/download", methods=["GET", "HEAD"])
 async def download_public_file(
     file_id: str,
+    request: Request,
     db: Session = Depends(get_db)
 ):
     """
     Download public file content. Only public files can be accessed with this endpoint.
-    No authentication required.
+    No authentication required. Supports HEAD, byte ranges and conditional requests.
     """
     file = get_file_by_id(db, file_id)
     if not file:
@@ -224,16 +325,135 @@ async def download_public_file(
     if not file.is_public:
         raise HTTPException(status_code=403, detail="This file is not public")
     
-    file_path = os.path.join(settings.UPLOAD_DIR, file.storage_path)
-    if not os.path.exists(file_path):
+    file_path = await get_file_content(db, file)
+    if not file_path:
         raise HTTPException(status_code=404, detail="File not found on server")
     
-    return FastAPIFileResponse(
-        path=file_path,
-        filename=file.filename,
-        media_type=file.mime_type or "application/octet-stream"
+    return await file_download_response(
+        request, file_path, file.filename, file.mime_type, **file_download_options(file)
     )
 
+@router.get("/{file_id}/thumbnail")
+async def get_file_thumbnail(
+    file_id: str,
+    request: Request,
+    size: int = Query(256, description="Longest side in pixels, one of THUMBNAIL_SIZES"),
+    db: Session = Depends(get_db),
+    current_user: Optional[User] = Depends(get_current_user_optional)
+):
+    """
+    Get a WebP thumbnail of an image file. Thumbnails of public files need no
+    authentication. Images uploaded before thumbnails existed are rendered on
+    the first request.
+    """
+    if size not in thumbnail_sizes():
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported thumbnail size. Available: {', '.join(map(str, thumbnail_sizes()))}"
+        )
+    
+    file = get_file_by_id(db, file_id)
+    if not file or file.is_deleted:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    # Миниатюры приватных файлов доступны только владельцу
+    if not file.is_public:
+        if current_user is None:
+            raise HTTPException(status_code=401, detail="Authentication required")
+        if file.owner_id != current_user.telegram_id:
+            raise HTTPException(status_code=403, detail="Not authorized to view this file")
+    
+    thumbnail_path = await get_thumbnail(db, file, size)
+    if not thumbnail_path:
+        raise HTTPException(status_code=404, detail="No thumbnail available for this file")
+    
+    return cached_file_response(
+        request, thumbnail_path, THUMBNAIL_MEDIA_TYPE,
+        etag=f'"{thumbnail_key(file)}-{size}"',
+        max_age=settings.THUMBNAIL_MAX_AGE_SECONDS,
+        public=file.is_public
+    )
+
+# Скачивание по подписанной ссылке: подпись и срок проверяются без обращения к пользователям
+@router.api_route("/{file_id}/signed", methods=["GET", "HEAD"])
+async def download_signed_file(
+    file_id: str,
+    request: Request,
+    expires: int = Query(...),
+    gen: int = Query(...),
+    signature: str = Query(...),
+    byte_range: str = Query("", alias="bytes"),
+    db: Session = Depends(get_db)
+):
+    """
+    Download a file through a signed URL issued by POST /{file_id}/signed-url.
+    No authentication required. Supports HEAD, byte ranges and conditional requests
+    within the byte range the URL was signed for.
+    """
+    if not verify_signature(file_id, expires, gen, byte_range, signature):
+        raise HTTPException(status_code=403, detail="Invalid or expired link")
+    try:
+        window = parse_byte_range(byte_range)
+    except ValueError:
+        raise HTTPException(status_code=403, detail="Invalid or expired link")
+    
+    file = get_file_by_id(db, file_id)
+    if not file or file.is_deleted:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    # Ссылки прошлых поколений отозваны владельцем
+    if gen != (file.link_generation or 0):
+        raise HTTPException(status_code=403, detail="Link has been revoked")
+    
+    file_path = await get_file_content(db, file)
+    if not file_path:
+        raise HTTPException(status_code=404, detail="File not found on server")
+    
+    options = file_download_options(file)
+    if options["etag"] and window:
+        options["etag"] = f'"{file.blob_hash}:{byte_range}"'
+    return await file_download_response(
+        request, file_path, file.filename, file.mime_type, window=window, **options
+    )
+
+@router.post("/{file_id}/signed-url", response_model=SignedUrlResponse)
+async def create_file_signed_url(
+    file_id: str,
+    signed_url: SignedUrlCreate = Body(SignedUrlCreate()),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Create an expiring download URL that works without a token,
+    optionally limited to a byte range of the file
+    """
+    file = get_file_by_id(db, file_id)
+    if not file or file.is_deleted:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    if file.owner_id != current_user.telegram_id:
+        raise HTTPException(status_code=403, detail="Not authorized to share this file")
+    
+    try:
+        url, expires = create_signed_url(
+            file, settings.PUBLIC_URL, signed_url.expires_in, signed_url.start, signed_url.end
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return SignedUrlResponse(url=url, expires_at=datetime.utcfromtimestamp(expires))
+
+@router.post("/signed-urls/revoke")
+async def revoke_file_signed_urls(
+    revoke: SignedUrlRevoke = Body(SignedUrlRevoke()),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Revoke all signed URLs issued so far for the user's files, or only for the given files
+    """
+    revoked = revoke_signed_urls(db, current_user.telegram_id, revoke.file_ids)
+    return {"revoked_files": revoked}
+
 @router.delete("/{file_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def remove_file(
     file_id: str,
@@ -278,7 +498,7 @@ async def change_file_visibility(
         raise HTTPException(status_code=400, detail="is_public field is required")
     
     public_url_base = settings.PUBLIC_URL
-    updated_file = toggle_file_visibility(db, file_id, is_public, public_url_base)
+    updated_file = await toggle_file_visibility(db, file_id, is_public, public_url_base)
     
     return updated_file
 
@@ -300,7 +520,11 @@ async def update_file_metadata(
     if not is_owner_of_file(db, file_id, current_user.telegram_id):
         raise HTTPException(status_code=403, detail="Not authorized to update this file")
     
-    updated_file = update_file(db, file_id, file_update, settings.PUBLIC_URL)
+    # Moved files count towards the sizes of the target folders
+    if file_update.folder_id != file.folder_id:
+        check_folder(db, current_user, file_update.folder_id)
+    
+    updated_file = await update_file(db, file_id, file_update, settings.PUBLIC_URL)
     return updated_file
 
 @router.get("/{file_id}/public-url")
@@ -327,9 +551,14 @@ async def get_file_url(
     else:
         download_url = f"{settings.PUBLIC_URL}{settings.API_V1_STR}/files/{file_id}/download"
     
+    # Подписанная ссылка работает и без токена, до истечения срока
+    signed_url, signed_url_expires = create_signed_url(file, settings.PUBLIC_URL)
+    
     # Дополнительная информация для фронтенда
     response = {
         "file_url": download_url,
+        "signed_url": signed_url,
+        "signed_url_expires_at": datetime.utcfromtimestamp(signed_url_expires).isoformat(),
         "filename": file.filename,
         "is_public": file.is_public,
         "js_download_code": """
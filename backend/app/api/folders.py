@@ -1,16 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Response
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Response
 from sqlalchemy.orm import Session
 from typing import List, Optional
 
-from ..models.schemas import FolderCreate, FolderResponse, FolderUpdate, FolderTree
+from ..models.schemas import FolderCreate, FolderResponse, FolderUpdate, FolderTree, DirectoryListing
 from ..models.user import User
 from ..core.database import get_db
 from ..core.auth import get_current_user
 from ..services.folder_service import (
     create_folder, get_folders_by_owner, get_folder_by_id, 
     update_folder, delete_folder, is_owner_of_folder,
-    get_folder_tree
+    get_folder_tree, is_in_subtree
 )
+from ..services.listing_service import list_directory
 
 router = APIRouter(prefix="/api/v1/folders")
 
@@ -26,7 +27,7 @@ async def create_new_folder(
     # If parent_id is provided, verify it exists and belongs to the user
     if folder.parent_id:
         parent_folder = get_folder_by_id(db, folder.parent_id)
-        if not parent_folder:
+        if not parent_folder or parent_folder.is_deleted:
             raise HTTPException(status_code=404, detail="Parent folder not found")
             
         if parent_folder.owner_id != current_user.telegram_id:
@@ -47,13 +48,55 @@ async def list_folders(
 
 @router.get("/tree", response_model=List[FolderTree])
 async def get_folder_structure(
+    parent_id: Optional[int] = None,
+    depth: Optional[int] = Query(None, ge=1),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
-    Get the complete folder tree structure for the user
+    Get the folder tree structure for the user: the complete tree by default,
+    or only `depth` levels of it. With parent_id the subtree below that folder
+    is returned, so large trees can be expanded lazily.
     """
-    return get_folder_tree(db, current_user.telegram_id)
+    if parent_id is not None:
+        parent_folder = get_folder_by_id(db, parent_id)
+        if not parent_folder or parent_folder.is_deleted:
+            raise HTTPException(status_code=404, detail="Folder not found")
+        if parent_folder.owner_id != current_user.telegram_id:
+            raise HTTPException(status_code=403, detail="Not authorized to access this folder")
+    
+    return get_folder_tree(db, current_user.telegram_id, parent_id, depth)
+
+@router.get("/contents", response_model=DirectoryListing)
+async def list_directory_contents(
+    folder_id: Optional[int] = None,
+    sort: str = Query("name", pattern="^(name|size|date)$"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    mime_type: Optional[List[str]] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    List a folder (the root without folder_id): subfolders first, then files,
+    sorted by name, size or date. Pages of at most `limit` entries; pass
+    next_cursor of a page as `cursor` to get the next one. mime_type filters
+    the files, e.g. image/png or image/*, and leaves out the subfolders.
+    """
+    if folder_id is not None:
+        folder = get_folder_by_id(db, folder_id)
+        if not folder or folder.is_deleted:
+            raise HTTPException(status_code=404, detail="Folder not found")
+        if folder.owner_id != current_user.telegram_id:
+            raise HTTPException(status_code=403, detail="Not authorized to access this folder")
+    
+    try:
+        return list_directory(
+            db, current_user.telegram_id, folder_id, sort, order == "desc", mime_type, limit, cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/{folder_id}", response_model=FolderResponse)
 async def get_folder(
@@ -93,16 +136,16 @@ async def update_folder_info(
     
     # If changing parent, verify the new parent exists and belongs to the user
     if folder_update.parent_id and folder_update.parent_id != folder.parent_id:
-        # Check for circular dependency (cannot set a folder as its own descendant)
-        if folder_id == folder_update.parent_id:
-            raise HTTPException(status_code=400, detail="Cannot set a folder as its own parent")
-        
         parent_folder = get_folder_by_id(db, folder_update.parent_id)
-        if not parent_folder:
+        if not parent_folder or parent_folder.is_deleted:
             raise HTTPException(status_code=404, detail="Parent folder not found")
             
         if parent_folder.owner_id != current_user.telegram_id:
             raise HTTPException(status_code=403, detail="Not authorized to use this parent folder")
+        
+        # Check for circular dependency (cannot set a folder as its own descendant)
+        if is_in_subtree(folder, parent_folder):
+            raise HTTPException(status_code=400, detail="Cannot move a folder into itself or one of its subfolders")
     
     return update_folder(db, folder_id, folder_update)
 
@@ -113,7 +156,7 @@ async def remove_folder(
     db: Session = Depends(get_db)
 ):
     """
-    Delete a folder (mark as deleted)
+    Delete a folder with its subfolders and files (mark as deleted)
     """
     folder = get_folder_by_id(db, folder_id)
     if not folder:
@@ -123,5 +166,6 @@ async def remove_folder(
     if not is_owner_of_folder(db, folder_id, current_user.telegram_id):
         raise HTTPException(status_code=403, detail="Not authorized to delete this folder")
     
-    delete_folder(db, folder_id, current_user.telegram_id)
+    if not delete_folder(db, folder_id, current_user.telegram_id):
+        raise HTTPException(status_code=404, detail="Folder not found")
     return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from ..models.schemas import JobResponse
+from ..models.user import User
+from ..core.database import get_db
+from ..core.auth import get_current_user
+from ..services.job_service import get_job
+
+router = APIRouter(prefix="/api/v1/jobs")
+
+@router.get("/{job_id}", response_model=JobResponse)
+async def get_job_status(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Get the status of a background job started by the current user:
+    queued, running, succeeded or failed (after exhausting its retries)
+    """
+    job = get_job(db, job_id)
+    if not job or job.owner_id != current_user.telegram_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.orm import Session
+
+from ..core.database import get_db
+from ..core.config import settings
+from ..core.file_responses import file_download_response
+from ..services.file_service import get_public_file_by_url, get_file_content, file_download_options
+
+router = APIRouter(prefix="/public")
+
+# Старые публичные ссылки вида /public/{имя} раньше отдавались напрямую из
+# каталога public_files. Теперь файл ищется по ссылке в базе, поэтому ссылка
+# перестает работать, как только файл становится приватным.
+@router.api_route("/{public_name}", methods=["GET", "HEAD"])
+async def download_public_link(
+    public_name: str,
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """
+    Download a public file by a public link issued before files were served
+    from /api/v1/files/public/{file_id}/download
+    """
+    file = get_public_file_by_url(db, f"{settings.PUBLIC_URL}/public/{public_name}")
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    file_path = await get_file_content(db, file)
+    if not file_path:
+        raise HTTPException(status_code=404, detail="File not found on server")
+    
+    return await file_download_response(
+        request, file_path, file.filename, file.mime_type, **file_download_options(file)
+    )
@@ -0,0 +1,43 @@
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import List, Optional
+
+from ..models.schemas import SearchResults
+from ..models.user import User
+from ..core.database import get_db
+from ..core.auth import get_current_user
+from ..services.search_service import search
+
+router = APIRouter(prefix="/api/v1/search")
+
+@router.get("", response_model=SearchResults)
+async def search_files_and_folders(
+    q: str = Query(..., min_length=1, max_length=200),
+    prefix: bool = True,
+    mime_type: Optional[List[str]] = Query(None),
+    min_size: Optional[int] = Query(None, ge=0),
+    max_size: Optional[int] = Query(None, ge=0),
+    modified_after: Optional[datetime] = None,
+    modified_before: Optional[datetime] = None,
+    limit: int = Query(50, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Search the names of the user's folders and files: entries whose name
+    contains every word of `q`, or with prefix=true (the default) a word
+    starting with it. Matching folders come first, then files, each best
+    match first. mime_type (e.g. image/png or image/*), min_size and
+    max_size in bytes and modified_after/modified_before filter the files
+    and leave out the folders. Pages of at most `limit` entries; pass
+    next_cursor of a page as `cursor` to get the next one.
+    """
+    try:
+        return search(
+            db, current_user.telegram_id, q, prefix, mime_type, min_size, max_size,
+            modified_after, modified_before, limit, cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,377 @@
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Request, Response, status
+from sqlalchemy.orm import Session
+from typing import Optional
+
+from ..models.schemas import (
+    UploadSessionCreate, UploadSessionResponse, UploadReservationCreate, UploadReservationResponse,
+    MultipartUploadCreate, MultipartUploadResponse, MultipartPartResponse, MultipartComplete,
+    FileResponse as FileSchemaResponse
+)
+from ..models.user import User
+from ..core.database import get_db
+from ..core.auth import get_current_user
+from ..core.config import settings
+from ..services.folder_service import get_folder_by_id
+from ..services.upload_service import (
+    create_upload_session, get_upload_session, write_upload_chunk,
+    complete_upload_session, abort_upload_session, cleanup_expired_sessions,
+    create_upload_reservation, get_upload_reservation,
+    release_upload_reservation, cleanup_expired_reservations
+)
+from ..services.multipart_service import (
+    create_multipart_upload, get_multipart_upload, get_part, get_uploaded_bytes, store_part,
+    complete_multipart_upload, abort_multipart_upload, cleanup_expired_multipart_uploads
+)
+
+from ..services.user_service import available_bytes
+
+router = APIRouter(prefix="/api/v1/uploads")
+
+def get_owned_session(
+    session_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    db_session = get_upload_session(db, session_id)
+    if not db_session:
+        raise HTTPException(status_code=404, detail="Upload session not found or expired")
+    if db_session.owner_id != current_user.telegram_id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this upload session")
+    return db_session
+
+def get_owned_multipart_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    db_upload = get_multipart_upload(db, upload_id)
+    if not db_upload:
+        raise HTTPException(status_code=404, detail="Multipart upload not found or expired")
+    if db_upload.owner_id != current_user.telegram_id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this multipart upload")
+    return db_upload
+
+def get_upload_reservation_optional(
+    x_upload_token: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Resolve the X-Upload-Token header of an upload request into its reservation.
+    Uploads without a token are allowed unless REQUIRE_UPLOAD_RESERVATION is set.
+    """
+    if not x_upload_token:
+        if settings.REQUIRE_UPLOAD_RESERVATION:
+            raise HTTPException(
+                status_code=status.HTTP_428_PRECONDITION_REQUIRED,
+                detail="Upload token required, reserve space with POST /api/v1/uploads/reservations first"
+            )
+        return None
+
+    db_reservation = get_upload_reservation(db, x_upload_token)
+    if not db_reservation or db_reservation.owner_id != current_user.telegram_id:
+        raise HTTPException(status_code=403, detail="Upload token is invalid or expired")
+    return db_reservation
+
+def insufficient_space(available: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Insufficient storage space. Available: {max(available, 0) / (1024 * 1024):.2f} MB"
+    )
+
+def check_quota(user: User, size_bytes: int, held_bytes: int = 0):
+    """Check a file against the size limit and the user's free space, counting
+    held_bytes the upload already holds as free
+    """
+    if size_bytes > settings.MAX_FILE_SIZE_MB * 1024 * 1024:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File size exceeds the maximum allowed size of {settings.MAX_FILE_SIZE_MB} MB"
+        )
+    available = available_bytes(user) + held_bytes
+    if size_bytes > available:
+        raise insufficient_space(available)
+
+def check_folder(db: Session, user: User, folder_id: Optional[int]):
+    if folder_id:
+        folder = get_folder_by_id(db, folder_id)
+        if not folder or folder.is_deleted:
+            raise HTTPException(status_code=404, detail="Folder not found")
+        if folder.owner_id != user.telegram_id:
+            raise HTTPException(status_code=403, detail="Not authorized to use this folder")
+
+@router.post("/reservations", response_model=UploadReservationResponse, status_code=status.HTTP_201_CREATED)
+async def reserve_upload(
+    reservation_data: UploadReservationCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Pre-flight check for an upload. Validates the declared size against the
+    file size limit and the user's remaining quota, then holds that space for
+    UPLOAD_RESERVATION_TTL_MINUTES. The returned token is sent as the
+    X-Upload-Token header of the upload itself.
+    """
+    cleanup_expired_reservations(db)
+    check_quota(current_user, reservation_data.size)
+    check_folder(db, current_user, reservation_data.folder_id)
+
+    return create_upload_reservation(db, reservation_data, current_user.telegram_id)
+
+@router.delete("/reservations/{token}", status_code=status.HTTP_204_NO_CONTENT)
+async def cancel_reservation(
+    token: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Release reserved space that is no longer needed
+    """
+    db_reservation = get_upload_reservation(db, token)
+    if not db_reservation or db_reservation.owner_id != current_user.telegram_id:
+        raise HTTPException(status_code=404, detail="Reservation not found or expired")
+
+    release_upload_reservation(db, db_reservation)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+@router.post("/multipart", response_model=MultipartUploadResponse, status_code=status.HTTP_201_CREATED)
+async def start_multipart_upload(
+    upload_data: MultipartUploadCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Start a multipart upload. The client splits the file into parts, uploads
+    them in parallel with PUT /multipart/{id}/parts/{n} and finishes with /complete.
+    """
+    await cleanup_expired_multipart_uploads(db)
+    check_folder(db, current_user, upload_data.folder_id)
+
+    return create_multipart_upload(db, upload_data, current_user.telegram_id)
+
+@router.get("/multipart/{upload_id}", response_model=MultipartUploadResponse)
+async def get_multipart_status(db_upload = Depends(get_owned_multipart_upload)):
+    """
+    Get a multipart upload with the parts received so far, so an interrupted
+    client only re-sends the missing parts
+    """
+    return db_upload
+
+@router.put("/multipart/{upload_id}/parts/{part_number}", response_model=MultipartPartResponse)
+async def upload_part(
+    request: Request,
+    part_number: int,
+    db_upload = Depends(get_owned_multipart_upload),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Upload one part as the raw request body. Parts may arrive in any order and
+    concurrently; uploading a part number again replaces that part.
+    """
+    if not 1 <= part_number <= settings.MULTIPART_MAX_PARTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Part number must be between 1 and {settings.MULTIPART_MAX_PARTS}"
+        )
+
+    # Parts already received count against the file size limit and hold their quota;
+    # a part uploaded again gives back the space of the one it replaces
+    other_parts = get_uploaded_bytes(db, db_upload.id, exclude_part=part_number)
+    db_part = get_part(db, db_upload.id, part_number)
+    available = max(available_bytes(current_user) + (db_part.size_bytes if db_part else 0), 0)
+    max_file_bytes = max(settings.MAX_FILE_SIZE_MB * 1024 * 1024 - other_parts, 0)
+    if max_file_bytes <= available:
+        max_bytes = max_file_bytes
+        limit_error = HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File size exceeds the maximum allowed size of {settings.MAX_FILE_SIZE_MB} MB"
+        )
+    else:
+        max_bytes = available
+        limit_error = insufficient_space(available)
+
+    content_length = request.headers.get("content-length")
+    if content_length is not None and not content_length.isdigit():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid Content-Length header")
+    if content_length and int(content_length) > max_bytes:
+        raise limit_error
+
+    try:
+        return await store_part(db, db_upload, part_number, request.stream(), max_bytes)
+    except ValueError:
+        raise limit_error
+
+@router.post("/multipart/{upload_id}/complete", response_model=FileSchemaResponse)
+async def complete_multipart(
+    complete_data: MultipartComplete,
+    db_upload = Depends(get_owned_multipart_upload),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Assemble the listed parts, in ascending part number order, into the final
+    file. Parts that are not listed are discarded. If a part's sha256 is given
+    it must match the stored part.
+    """
+    part_numbers = [part.part_number for part in complete_data.parts]
+    if not part_numbers:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="At least one part is required")
+    if part_numbers != sorted(set(part_numbers)):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Parts must be listed once each in ascending order"
+        )
+
+    parts = []
+    for requested in complete_data.parts:
+        db_part = get_part(db, db_upload.id, requested.part_number)
+        if not db_part:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Part {requested.part_number} has not been uploaded"
+            )
+        if requested.sha256 and requested.sha256.lower() != db_part.sha256:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Part {requested.part_number} does not match its sha256"
+            )
+        parts.append(db_part)
+
+    # Quota may have changed since the parts were uploaded
+    check_quota(current_user, sum(part.size_bytes for part in parts), get_uploaded_bytes(db, db_upload.id))
+
+    try:
+        return await complete_multipart_upload(db, db_upload, parts, settings.PUBLIC_URL)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+@router.delete("/multipart/{upload_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def cancel_multipart(
+    db_upload = Depends(get_owned_multipart_upload),
+    db: Session = Depends(get_db)
+):
+    """
+    Abort the multipart upload and discard its parts
+    """
+    await abort_multipart_upload(db, db_upload)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+@router.post("", response_model=UploadSessionResponse, status_code=status.HTTP_201_CREATED)
+async def start_upload_session(
+    session_data: UploadSessionCreate,
+    db_reservation = Depends(get_upload_reservation_optional),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Start a resumable upload. The file content is then sent with one or more
+    PUT requests at the committed offset and the upload is finished with /complete.
+    """
+    await cleanup_expired_sessions(db)
+
+    if db_reservation:
+        # The reserved space is handed over to the session
+        if session_data.size > db_reservation.size_bytes:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail="Declared size exceeds the reserved size"
+            )
+        session_data.folder_id = db_reservation.folder_id
+        session_data.is_public = db_reservation.is_public
+        check_quota(current_user, session_data.size, db_reservation.size_bytes)
+    else:
+        check_folder(db, current_user, session_data.folder_id)
+        check_quota(current_user, session_data.size)
+
+    return await create_upload_session(db, session_data, current_user.telegram_id, db_reservation)
+
+@router.get("/{session_id}", response_model=UploadSessionResponse)
+async def get_upload_status(
+    response: Response,
+    db_session = Depends(get_owned_session)
+):
+    """
+    Get the upload session state. `offset` is the number of bytes committed so far,
+    the client resumes by sending the remaining bytes starting at this offset.
+    """
+    response.headers["Upload-Offset"] = str(db_session.offset)
+    return db_session
+
+@router.put("/{session_id}", response_model=UploadSessionResponse)
+async def upload_chunk(
+    request: Request,
+    response: Response,
+    offset: int = Query(..., ge=0),
+    db_session = Depends(get_owned_session),
+    db: Session = Depends(get_db)
+):
+    """
+    Upload a byte range of the file as the raw request body, starting at `offset`.
+    The offset must match the committed offset of the session.
+    """
+    if offset != db_session.offset:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Offset mismatch, expected {db_session.offset}",
+            headers={"Upload-Offset": str(db_session.offset)}
+        )
+
+    content_length = request.headers.get("content-length")
+    if content_length is not None and not content_length.isdigit():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid Content-Length header")
+    if content_length and offset + int(content_length) > db_session.total_size:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Chunk exceeds the declared upload size"
+        )
+
+    try:
+        written = await write_upload_chunk(db, db_session, offset, request.stream())
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+
+    if written is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Upload session was modified concurrently",
+            headers={"Upload-Offset": str(db_session.offset)}
+        )
+
+    response.headers["Upload-Offset"] = str(db_session.offset)
+    return db_session
+
+@router.post("/{session_id}/complete", response_model=FileSchemaResponse)
+async def complete_upload(
+    db_session = Depends(get_owned_session),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Finish the upload and create the file record
+    """
+    if db_session.offset != db_session.total_size:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Upload is incomplete: {db_session.offset} of {db_session.total_size} bytes received",
+            headers={"Upload-Offset": str(db_session.offset)}
+        )
+
+    # Quota may have changed since the session was started
+    check_quota(current_user, db_session.total_size, db_session.total_size)
+
+    try:
+        return await complete_upload_session(db, db_session, settings.PUBLIC_URL)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+@router.delete("/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def cancel_upload(
+    db_session = Depends(get_owned_session),
+    db: Session = Depends(get_db)
+):
+    """
+    Abort the upload and discard the received bytes
+    """
+    await abort_upload_session(db, db_session)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,126 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from typing import List
+from urllib.parse import quote
+
+from ..models.schemas import ChunkList, ChunkRef, MissingChunks, FileVersionResponse
+from ..models.user import User
+from ..core.database import get_db
+from ..core.auth import get_current_user
+from ..core.chunking import MAX_CHUNK_SIZE
+from ..services.file_service import get_file_by_id, charged_bytes
+from ..services.version_service import (
+    get_missing_chunks, store_chunk, commit_file_version, pending_chunk_bytes,
+    get_file_versions, get_file_version, iter_version_content
+)
+from .uploads import check_quota
+
+router = APIRouter(prefix="/api/v1/files")
+
+def get_owned_file(
+    file_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    file = get_file_by_id(db, file_id)
+    if not file or file.is_deleted:
+        raise HTTPException(status_code=404, detail="File not found")
+    if file.owner_id != current_user.telegram_id:
+        raise HTTPException(status_code=403, detail="Not authorized to modify this file")
+    return file
+
+@router.post("/{file_id}/versions/missing-chunks", response_model=MissingChunks)
+async def find_missing_chunks(
+    chunk_list: ChunkList,
+    file = Depends(get_owned_file),
+    db: Session = Depends(get_db)
+):
+    """
+    First step of a delta update: the client sends the chunk hashes of the new
+    content (see app/core/chunking.py for the chunking parameters) and gets back
+    the chunks it has to upload: all but those of the user's earlier uploads and
+    versions. The first update of a file uploads every chunk the user hasn't
+    stored before; its current content is chunked into version 1 on commit.
+    """
+    return MissingChunks(missing=get_missing_chunks(db, file.owner_id, [ref.hash.lower() for ref in chunk_list.chunks]))
+
+@router.put("/{file_id}/chunks/{chunk_hash}", response_model=ChunkRef, status_code=status.HTTP_201_CREATED)
+async def upload_chunk(
+    chunk_hash: str,
+    request: Request,
+    file = Depends(get_owned_file),
+    db: Session = Depends(get_db)
+):
+    """
+    Upload one missing chunk as the raw request body. The content must hash to `chunk_hash`.
+    Its size counts against the quota until a version uses it.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length is not None and not content_length.isdigit():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid Content-Length header")
+    if content_length and int(content_length) > MAX_CHUNK_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Chunks can't be larger than {MAX_CHUNK_SIZE} bytes"
+        )
+
+    try:
+        chunk = await store_chunk(db, file.owner_id, chunk_hash, request.stream())
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    return ChunkRef(hash=chunk.hash, size=chunk.size_bytes)
+
+@router.post("/{file_id}/versions", response_model=FileVersionResponse, status_code=status.HTTP_201_CREATED)
+async def create_file_version(
+    chunk_list: ChunkList,
+    file = Depends(get_owned_file),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Create a new version of the file from its ordered chunk list. All chunks
+    must already be stored; the new version becomes the current file content.
+    """
+    # The new version replaces the current content, whose space is given back,
+    # as is the space held by the uploads of its chunks
+    held = charged_bytes(file) + pending_chunk_bytes(db, file.owner_id, [ref.hash.lower() for ref in chunk_list.chunks])
+    check_quota(current_user, sum(ref.size for ref in chunk_list.chunks), held)
+
+    try:
+        return await commit_file_version(db, file, chunk_list.chunks)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+@router.get("/{file_id}/versions", response_model=List[FileVersionResponse])
+async def list_file_versions(
+    file = Depends(get_owned_file),
+    db: Session = Depends(get_db)
+):
+    """
+    List all versions of a file, oldest first
+    """
+    return get_file_versions(db, file.id)
+
+@router.get("/{file_id}/versions/{version_number}/download")
+async def download_file_version(
+    version_number: int,
+    file = Depends(get_owned_file),
+    db: Session = Depends(get_db)
+):
+    """
+    Download a specific version, reassembled from its chunks as a stream
+    """
+    version = get_file_version(db, file.id, version_number)
+    if not version:
+        raise HTTPException(status_code=404, detail="Version not found")
+
+    return StreamingResponse(
+        iter_version_content(version),
+        media_type=file.mime_type or "application/octet-stream",
+        headers={
+            "Content-Length": str(version.size_bytes),
+            "Content-Disposition": f"attachment; filename*=utf-8''{quote(file.filename)}"
+        }
+    )
@@ -16,6 +16,8 @@ from ..core.database import get_db
 
 # OAuth2 setup for token-based authentication
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login")
+# Same scheme without the automatic 401, for endpoints that also serve anonymous requests
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login", auto_error=False)
 
 # JWT token creation and verification
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -59,7 +61,7 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     return user
 
 # Function to optionally get the current user from the token
-def get_current_user_optional(token: Optional[str] = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Optional[User]:
+def get_current_user_optional(token: Optional[str] = Depends(oauth2_scheme_optional), db: Session = Depends(get_db)) -> Optional[User]:
     if not token:
         return None
     try:
@@ -0,0 +1,57 @@
+"""
+Content-defined chunking (gear hash, FastCDC style) for delta file versions.
+
+Chunk boundaries depend only on the bytes around them, so inserting or removing
+data in a file only changes the chunks next to the edit and all other chunks
+keep their hashes. Clients that want to share chunks with versions chunked by
+the server must use the same parameters and gear table.
+"""
+import hashlib
+from typing import BinaryIO, Iterator
+
+MIN_CHUNK_SIZE = 512 * 1024  # 512 KB
+MAX_CHUNK_SIZE = 4 * 1024 * 1024  # 4 MB
+# A boundary is found once the gear hash has its 19 low bits clear,
+# i.e. on average 512 KB after the minimum size (~1 MB chunks)
+BOUNDARY_MASK = (1 << 19) - 1
+
+# Gear table: the first 8 bytes of SHA-256(i) for every byte value i
+GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "big") for i in range(256)]
+
+_HASH_MASK = (1 << 64) - 1
+
+def find_cut_point(data: bytes) -> int:
+    """Length of the first chunk at the start of data"""
+    size = len(data)
+    if size <= MIN_CHUNK_SIZE:
+        return size
+
+    limit = min(size, MAX_CHUNK_SIZE)
+    gear = GEAR
+    h = 0
+    # Bytes before the minimum size can never end a chunk, so they are not hashed
+    for i in range(MIN_CHUNK_SIZE, limit):
+        h = ((h << 1) + gear[data[i]]) & _HASH_MASK
+        if not h & BOUNDARY_MASK:
+            return i + 1
+    return limit
+
+def iter_chunks(source: BinaryIO) -> Iterator[bytes]:
+    """Split a binary stream into content-defined chunks"""
+    buffer = b""
+    while True:
+        if len(buffer) < MAX_CHUNK_SIZE:
+            data = source.read(MAX_CHUNK_SIZE)
+            if data:
+                buffer += data
+                continue
+            # End of stream: whatever is buffered is split the same way
+            while buffer:
+                cut = find_cut_point(buffer)
+                yield buffer[:cut]
+                buffer = buffer[cut:]
+            return
+
+        cut = find_cut_point(buffer)
+        yield buffer[:cut]
+        buffer = buffer[cut:]
@@ -0,0 +1,151 @@
+"""
+Transparent compression of stored content.
+
+Blobs whose content compresses well are stored zstd- or gzip-compressed
+(STORAGE_COMPRESSION). Whether to compress is decided from the MIME type and
+a sample of the content, so already compressed media is never recompressed.
+The stored bytes are a valid HTTP Content-Encoding, so downloads can send
+them as-is to clients that accept it and decode on the fly for the others.
+"""
+import gzip
+import shutil
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+    zstandard = None
+
+from .config import settings
+
+SAMPLE_SIZE = 64 * 1024
+MIN_COMPRESS_SIZE = 4 * 1024  # Smaller files don't save a filesystem block
+COPY_CHUNK_SIZE = 1024 * 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+COMPRESSIBLE_TYPES = {
+    "application/json", "application/x-ndjson", "application/xml", "application/javascript",
+    "application/x-javascript", "application/sql", "application/x-sh", "application/x-yaml",
+    "application/yaml", "application/csv", "application/rtf", "application/x-tex",
+    "application/xhtml+xml", "application/x-subrip", "image/svg+xml", "image/bmp",
+    "application/x-tar", "application/wasm"
+}
+# Unknown content is only compressed if the sample shows it pays off
+UNKNOWN_TYPES = {None, "", "application/octet-stream"}
+
+def storage_encoding() -> Optional[str]:
+    """Encoding for newly stored content, None when compression is off"""
+    encoding = settings.STORAGE_COMPRESSION.lower()
+    if encoding == "zstd" and zstandard is None:
+        return "gzip"
+    if encoding in ("zstd", "gzip"):
+        return encoding
+    return None
+
+def is_compressible(mime_type: Optional[str]) -> bool:
+    if mime_type in UNKNOWN_TYPES:
+        return True
+    mime_type = mime_type.split(";")[0].strip().lower()
+    return mime_type.startswith("text/") or mime_type in COMPRESSIBLE_TYPES or mime_type.endswith(("+json", "+xml"))
+
+def _compress_bytes(data: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, GZIP_LEVEL)
+
+def choose_encoding(path: str, size: int, mime_type: Optional[str]) -> Optional[str]:
+    """Encoding to store a file with, or None to store it as-is.
+    Blocking, run it on the I/O pool.
+    """
+    encoding = storage_encoding()
+    if not encoding or size < MIN_COMPRESS_SIZE or not is_compressible(mime_type):
+        return None
+    with open(path, "rb") as source:
+        sample = source.read(SAMPLE_SIZE)
+    if len(_compress_bytes(sample, encoding)) > len(sample) * settings.STORAGE_COMPRESSION_MAX_RATIO:
+        return None
+    return encoding
+
+def compress_file(source_path: str, target_path: str, encoding: str) -> int:
+    """Write a compressed copy of a file. Returns the compressed size.
+    Blocking, run it on the I/O pool.
+    """
+    with open(source_path, "rb") as source, open(target_path, "wb") as target:
+        if encoding == "zstd":
+            zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(source, target, read_size=COPY_CHUNK_SIZE)
+        else:
+            with gzip.GzipFile(fileobj=target, mode="wb", compresslevel=GZIP_LEVEL, mtime=0) as compressed:
+                shutil.copyfileobj(source, compressed, COPY_CHUNK_SIZE)
+        return target.tell()
+
+class DecodedReader:
+    """Blocking reader of the decompressed content of a stored file.
+    Seeking forward skips decoded bytes; seeking backward starts over.
+    """
+
+    def __init__(self, path: str, encoding: str):
+        self.path = path
+        self.encoding = encoding
+        self._raw = None
+        self._stream = None
+        self._position = 0
+        self._open()
+
+    def _open(self):
+        self.close()
+        self._raw = open(self.path, "rb")
+        if self.encoding == "zstd":
+            self._stream = zstandard.ZstdDecompressor().stream_reader(self._raw, read_across_frames=True)
+        else:
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode="rb")
+        self._position = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._stream.read(size)
+        self._position += len(data)
+        return data
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if whence != 0:
+            raise ValueError("Only absolute seeks are supported")
+        if offset < self._position:
+            self._open()
+        while self._position < offset:
+            if not self.read(min(COPY_CHUNK_SIZE, offset - self._position)):
+                break
+        return self._position
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+        if self._raw is not None:
+            self._raw.close()
+        self._stream = self._raw = None
+
+def open_decoded(path: str, encoding: Optional[str], mode: str = "rb"):
+    """Open stored content for reading its original bytes, whatever it's stored as.
+    Blocking, run it on the I/O pool.
+    """
+    if not encoding:
+        return open(path, mode)
+    return DecodedReader(path, encoding)
+
+def accepts_encoding(header: Optional[str], encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows the given content coding"""
+    if not header:
+        return False
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        if coding.strip().lower() not in (encoding, "*"):
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        return quality > 0
+    return False
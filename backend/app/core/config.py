@@ -13,6 +13,10 @@ class Settings(BaseModel):
     # 60 minutes * 24 hours * 7 days = 7 days
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 60 * 24 * 7))
     UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", "/app/uploads")
+    # Extra storage volumes as "name=/path" pairs separated by commas; UPLOAD_DIR is the "default" volume
+    STORAGE_VOLUMES: str = os.getenv("STORAGE_VOLUMES", "")
+    STORAGE_REPLICATION_FACTOR: int = int(os.getenv("STORAGE_REPLICATION_FACTOR", 1))  # Copies of each file on different volumes
+    STORAGE_VOLUME_MIN_FREE_MB: int = int(os.getenv("STORAGE_VOLUME_MIN_FREE_MB", 512))  # New files never fill a volume beyond this
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./db/nidrive.db")
     DATABASE_PATH: str = os.getenv("DATABASE_PATH", "./db/nidrive.db")
     TELEGRAM_BOT_TOKEN: str = os.getenv("TELEGRAM_BOT_TOKEN", "")
@@ -24,6 +28,77 @@ class Settings(BaseModel):
     
     # File size limits
     MAX_FILE_SIZE_MB: int = int(os.getenv("MAX_FILE_SIZE_MB", 102400))  # Default 100GB per file (102400 MB)
+
+    # Threads for blocking storage I/O (bounds concurrent disk operations per worker)
+    STORAGE_IO_WORKERS: int = int(os.getenv("STORAGE_IO_WORKERS", 8))
+
+    # Compression of stored content: "off", "gzip" or "zstd" (falls back to gzip without the zstandard package)
+    STORAGE_COMPRESSION: str = os.getenv("STORAGE_COMPRESSION", "off")
+    STORAGE_COMPRESSION_MAX_RATIO: float = float(os.getenv("STORAGE_COMPRESSION_MAX_RATIO", 0.8))  # Only compress if a sample shrinks at least this much
+    # Size charged against quotas for compressed files: "physical" (bytes on disk) or "logical" (original size)
+    QUOTA_SIZE_POLICY: str = os.getenv("QUOTA_SIZE_POLICY", "physical")
+
+    # Image thumbnails (needs Pillow), rendered after upload or on first request
+    THUMBNAIL_SIZES: str = os.getenv("THUMBNAIL_SIZES", "128,256,512")  # Longest side in pixels
+    THUMBNAIL_CACHE_DIR: str = os.getenv("THUMBNAIL_CACHE_DIR", "")  # Defaults to UPLOAD_DIR/thumbnails
+    THUMBNAIL_CACHE_MAX_MB: int = int(os.getenv("THUMBNAIL_CACHE_MAX_MB", 2048))  # Least recently used thumbnails are evicted beyond this
+    THUMBNAIL_MAX_SOURCE_MB: int = int(os.getenv("THUMBNAIL_MAX_SOURCE_MB", 100))
+    THUMBNAIL_WORKERS: int = int(os.getenv("THUMBNAIL_WORKERS", 2))
+    THUMBNAIL_MAX_AGE_SECONDS: int = int(os.getenv("THUMBNAIL_MAX_AGE_SECONDS", 7 * 24 * 3600))
+
+    # Persistent background job queue
+    JOB_WORKERS: int = int(os.getenv("JOB_WORKERS", 4))  # Jobs run concurrently per process
+    JOB_MAX_ATTEMPTS: int = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+    JOB_RETRY_BASE_SECONDS: float = float(os.getenv("JOB_RETRY_BASE_SECONDS", 5))  # Doubled after every failed attempt
+    JOB_RETRY_MAX_SECONDS: float = float(os.getenv("JOB_RETRY_MAX_SECONDS", 3600))
+    JOB_LEASE_SECONDS: int = int(os.getenv("JOB_LEASE_SECONDS", 60))  # Jobs of a worker silent this long are run again
+    JOB_POLL_SECONDS: float = float(os.getenv("JOB_POLL_SECONDS", 2.0))
+    JOB_RETENTION_HOURS: int = int(os.getenv("JOB_RETENTION_HOURS", 24 * 7))  # Finished jobs are kept this long for status queries
+
+    # Space reclamation
+    GC_DELETED_FILE_RETENTION_DAYS: int = int(os.getenv("GC_DELETED_FILE_RETENTION_DAYS", 30))  # Deleted files stay restorable this long
+    GC_UNREFERENCED_GRACE_HOURS: int = int(os.getenv("GC_UNREFERENCED_GRACE_HOURS", 24))  # Unreferenced content can still be reused by a re-upload
+    GC_BATCH_SIZE: int = int(os.getenv("GC_BATCH_SIZE", 100))
+    GC_PAUSE_SECONDS: float = float(os.getenv("GC_PAUSE_SECONDS", 1.0))
+    GC_INTERVAL_HOURS: float = float(os.getenv("GC_INTERVAL_HOURS", 6))  # 0 disables the periodic run
+    GC_SCAN_WORKERS: int = int(os.getenv("GC_SCAN_WORKERS", 8))  # Threads listing directories in the orphan scan
+    GC_ORPHAN_MIN_AGE_HOURS: int = int(os.getenv("GC_ORPHAN_MIN_AGE_HOURS", 24))  # Younger files may belong to uploads in progress
+
+    # Delta file versions
+    FILE_VERSION_RETENTION: int = int(os.getenv("FILE_VERSION_RETENTION", 10))  # Older versions of a file are pruned
+    VERSION_CHUNK_TTL_HOURS: int = int(os.getenv("VERSION_CHUNK_TTL_HOURS", 24))  # Uploaded chunks hold quota until used or this old
+
+    # Quota ledger: users whose recorded usage is checked against their files per run
+    QUOTA_RECONCILE_INTERVAL_MINUTES: float = float(os.getenv("QUOTA_RECONCILE_INTERVAL_MINUTES", 10))  # 0 disables reconciliation
+    QUOTA_RECONCILE_BATCH_SIZE: int = int(os.getenv("QUOTA_RECONCILE_BATCH_SIZE", 200))
+
+    # Background move of legacy files into the sharded blob store
+    STORAGE_MIGRATION_ON_STARTUP: bool = os.getenv("STORAGE_MIGRATION_ON_STARTUP", "true").lower() == "true"
+    STORAGE_MIGRATION_BATCH_SIZE: int = int(os.getenv("STORAGE_MIGRATION_BATCH_SIZE", 100))
+    STORAGE_MIGRATION_PAUSE_SECONDS: float = float(os.getenv("STORAGE_MIGRATION_PAUSE_SECONDS", 1.0))
+
+    # How downloads are served: "stream" through the app, or "x-accel" to hand the
+    # file to nginx (X-Accel-Redirect) after the access checks
+    DOWNLOAD_MODE: str = os.getenv("DOWNLOAD_MODE", "stream")
+    ACCEL_REDIRECT_PREFIX: str = os.getenv("ACCEL_REDIRECT_PREFIX", "/_protected")  # Internal nginx location, one sub-path per volume
+
+    # Signed download URLs (HMAC with SECRET_KEY, no login needed)
+    SIGNED_URL_DEFAULT_TTL_SECONDS: int = int(os.getenv("SIGNED_URL_DEFAULT_TTL_SECONDS", 3600))
+    SIGNED_URL_MAX_TTL_SECONDS: int = int(os.getenv("SIGNED_URL_MAX_TTL_SECONDS", 7 * 24 * 3600))
+
+    # Multipart uploads are kept in memory up to this size, then spooled to disk
+    UPLOAD_SPOOL_MAX_SIZE_MB: int = int(os.getenv("UPLOAD_SPOOL_MAX_SIZE_MB", 8))
+
+    # Resumable upload sessions
+    UPLOAD_SESSION_TTL_HOURS: int = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", 24))  # Unfinished sessions expire after a day
+
+    # Parallel multipart uploads
+    MULTIPART_UPLOAD_TTL_HOURS: int = int(os.getenv("MULTIPART_UPLOAD_TTL_HOURS", 24))
+    MULTIPART_MAX_PARTS: int = int(os.getenv("MULTIPART_MAX_PARTS", 10000))
+
+    # Pre-flight upload reservations
+    UPLOAD_RESERVATION_TTL_MINUTES: int = int(os.getenv("UPLOAD_RESERVATION_TTL_MINUTES", 30))
+    REQUIRE_UPLOAD_RESERVATION: bool = os.getenv("REQUIRE_UPLOAD_RESERVATION", "false").lower() == "true"
     
     # Public URL for API access (prefer API_BASE_URL env var)
     PUBLIC_URL: str = os.getenv("API_BASE_URL", os.getenv("WEB_APP_URL", "http://localhost:7070"))
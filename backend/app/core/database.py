@@ -4,6 +4,7 @@ from sqlalchemy.orm import sessionmaker
 from pymongo import MongoClient
 import os
 from .config import settings
+from .migrations import apply_migrations
 
 # SQLAlchemy setup for user data and metadata
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
@@ -19,6 +20,10 @@ Base = declarative_base()
 mongo_client = MongoClient(settings.MONGO_URI)
 mongo_db = mongo_client[settings.MONGO_DB_NAME]
 
+# Function to create or upgrade the schema on startup
+def init_db():
+    apply_migrations(engine, Base.metadata)
+
 # Function to get a DB session
 def get_db():
     db = SessionLocal()
@@ -0,0 +1,277 @@
+"""
+Download responses with HTTP caching and range support.
+
+Implements what FileResponse of older Starlette versions lacks:
+- strong ETags (the content hash recorded at upload) and Last-Modified,
+  answered with 304 for If-None-Match / If-Modified-Since;
+- single and multiple byte ranges (206, multipart/byteranges), guarded by
+  If-Range, so broken downloads resume and media players can seek;
+- HEAD, with the same headers as GET and no body;
+- content stored compressed is sent as-is with Content-Encoding when the
+  client accepts it, and decompressed on the fly otherwise and for range
+  requests, whose ranges refer to the decoded bytes.
+
+With DOWNLOAD_MODE=x-accel the bytes are not read by the app at all: the
+response carries an X-Accel-Redirect to an internal nginx location and nginx
+sends the file (with sendfile, ranges and conditional requests of its own).
+"""
+import os
+import secrets
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+from .compression import accepts_encoding, open_decoded
+from .config import settings
+from .storage import storage
+from . import storage_io
+
+READ_CHUNK_SIZE = 1024 * 1024  # 1 MB
+MAX_RANGES = 16  # More ranges than this in one request are served as the full file
+
+def http_date(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return formatdate(value.timestamp(), usegmt=True)
+
+def _parse_http_date(value: str) -> Optional[datetime]:
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+def _etags(header: str) -> List[str]:
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+def _opaque(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+def _none_match(header: str, etag: str) -> bool:
+    """If-None-Match uses the weak comparison"""
+    return any(tag == "*" or _opaque(tag) == _opaque(etag) for tag in _etags(header))
+
+def _not_modified_since(header: str, last_modified: Optional[datetime]) -> bool:
+    since = _parse_http_date(header)
+    if since is None or last_modified is None:
+        return False
+    return int(last_modified.timestamp()) <= int(since.timestamp())
+
+def _if_range_matches(header: str, etag: str, last_modified: Optional[datetime]) -> bool:
+    """If-Range needs a strong match, otherwise the full file is sent"""
+    header = header.strip()
+    if header.startswith('"') or header.startswith("W/"):
+        return not etag.startswith("W/") and header == etag
+    since = _parse_http_date(header)
+    return since is not None and last_modified is not None and int(last_modified.timestamp()) == int(since.timestamp())
+
+def parse_range(header: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """Parse a Range header into inclusive (start, end) byte ranges.
+    Returns None when the header should be ignored (malformed or too many ranges)
+    and an empty list when no range can be satisfied.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+    parts = spec.split(",")
+    if len(parts) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for part in parts:
+        first, dash, last = part.strip().partition("-")
+        if not dash:
+            return None
+        try:
+            if not first:
+                # Suffix range: the last N bytes
+                length = int(last)
+                if length <= 0:
+                    continue
+                ranges.append((max(size - length, 0), size - 1))
+                continue
+            start = int(first)
+            end = int(last) if last else size - 1
+        except ValueError:
+            return None
+        if last and start > end:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+    return ranges
+
+async def _read_ranges(
+    path: str,
+    ranges: List[Tuple[int, int]],
+    separators: List[bytes] = None,
+    closing: bytes = b"",
+    offset: int = 0,
+    encoding: str = None
+):
+    async with storage_io.AsyncFile(await storage_io.run_io(open_decoded, path, encoding)) as source:
+        for index, (start, end) in enumerate(ranges):
+            if separators:
+                yield separators[index]
+            await source.seek(offset + start)
+            remaining = end - start + 1
+            while remaining:
+                data = await source.read(min(READ_CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+    if closing:
+        yield closing
+
+def cached_file_response(
+    request: Request,
+    path: str,
+    media_type: str,
+    etag: str,
+    max_age: int,
+    public: bool = False
+) -> Response:
+    """Serve a small derived file, such as a thumbnail, with long-lived cache headers"""
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"{'public' if public else 'private'}, max-age={max_age}"
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and _none_match(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+def accel_redirect_uri(path: str) -> Optional[str]:
+    """Internal nginx URI of a stored file: ACCEL_REDIRECT_PREFIX/<volume>/<key>.
+    None for files outside every storage volume, which nginx can't reach.
+    """
+    try:
+        volume = storage.volume_of(path)
+    except ValueError:
+        return None
+    key = os.path.relpath(os.path.abspath(path), os.path.abspath(volume.root))
+    return f"{settings.ACCEL_REDIRECT_PREFIX.rstrip('/')}/{quote(volume.name)}/{quote(key)}"
+
+def _accel_redirect_response(uri: str, filename: str, media_type: str, etag: str = None) -> Response:
+    headers = {
+        "X-Accel-Redirect": uri,
+        "Content-Disposition": f"attachment; filename*=utf-8''{quote(filename)}"
+    }
+    if etag:
+        headers["ETag"] = etag
+    # nginx takes Content-Type and Content-Disposition from this response
+    return Response(headers=headers, media_type=media_type)
+
+async def file_download_response(
+    request: Request,
+    path: str,
+    filename: str,
+    media_type: str = None,
+    etag: str = None,
+    last_modified: datetime = None,
+    window: Optional[Tuple[int, int]] = None,
+    encoding: str = None,
+    size: int = None
+) -> Response:
+    """Serve a stored file for GET and HEAD, honouring conditional and range headers.
+    `etag` is a quoted strong validator; without one a weak ETag is derived
+    from the file size and modification time. In x-accel mode files on a
+    storage volume are handed to nginx instead of being read here.
+    `window` (inclusive start, end) serves only that slice of the file, as if
+    it were the whole resource; the caller passes an ETag specific to it.
+    `encoding` is the compression the file is stored with and `size` then its
+    decompressed size.
+    """
+    media_type = media_type or "application/octet-stream"
+    if settings.DOWNLOAD_MODE == "x-accel" and window is None and not encoding:
+        uri = accel_redirect_uri(path)
+        if uri:
+            return _accel_redirect_response(uri, filename, media_type, etag)
+
+    stat = await storage_io.run_io(os.stat, path)
+    headers = {}
+    decode = None
+    if encoding:
+        # Compressed content has two representations, so caches must key on Accept-Encoding
+        headers["Vary"] = "Accept-Encoding"
+        # Ranges always address the decoded bytes, so a range request gets the identity representation
+        ranged = window is not None or request.headers.get("range") is not None
+        if not ranged and accepts_encoding(request.headers.get("accept-encoding"), encoding):
+            headers["Content-Encoding"] = encoding
+            size = stat.st_size
+            if etag and etag.endswith('"'):
+                etag = f'{etag[:-1]}-{encoding}"'
+        else:
+            decode = encoding
+    else:
+        size = stat.st_size
+    offset = 0
+    if window is not None:
+        offset = min(window[0], size)
+        size = max(min(window[1] + 1, size) - offset, 0)
+    if etag is None:
+        etag = f'W/"{size:x}-{int(stat.st_mtime):x}"'
+    if last_modified is None:
+        last_modified = datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+    elif last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+
+    headers.update({
+        "ETag": etag,
+        "Last-Modified": http_date(last_modified),
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"attachment; filename*=utf-8''{quote(filename)}"
+    })
+
+    # Conditional GET: If-None-Match takes precedence over If-Modified-Since
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if _none_match(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+    elif _not_modified_since(request.headers.get("if-modified-since"), last_modified):
+        return Response(status_code=304, headers=headers)
+
+    ranges = None
+    range_header = request.headers.get("range")
+    if range_header:
+        if_range = request.headers.get("if-range")
+        if if_range is None or _if_range_matches(if_range, etag, last_modified):
+            ranges = parse_range(range_header, size)
+
+    if ranges is None:
+        status_code = 200
+        ranges = [(0, size - 1)] if size else []
+        headers["Content-Length"] = str(size)
+        body = _read_ranges(path, ranges, offset=offset, encoding=decode)
+    elif not ranges:
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+    elif len(ranges) == 1:
+        status_code = 206
+        start, end = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        body = _read_ranges(path, ranges, offset=offset, encoding=decode)
+    else:
+        status_code = 206
+        boundary = secrets.token_hex(16)
+        separators = [
+            f"\r\n--{boundary}\r\nContent-Type: {media_type}\r\nContent-Range: bytes {start}-{end}/{size}\r\n\r\n".encode()
+            for start, end in ranges
+        ]
+        closing = f"\r\n--{boundary}--\r\n".encode()
+        headers["Content-Length"] = str(
+            sum(len(separator) for separator in separators) + sum(end - start + 1 for start, end in ranges) + len(closing)
+        )
+        media_type = f"multipart/byteranges; boundary={boundary}"
+        body = _read_ranges(path, ranges, separators, closing, offset, decode)
+
+    if request.method == "HEAD":
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return StreamingResponse(body, status_code=status_code, headers=headers, media_type=media_type)
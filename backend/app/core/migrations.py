@@ -0,0 +1,158 @@
+"""
+Versioned schema migrations.
+
+The schema_migrations table records which migrations a database has had;
+init_db applies the missing ones in order, each in its own transaction
+together with its entry in the table.
+
+Migration 1 brings a database of any earlier release to the schema that
+was current when versioning started, the way init_db always did: it
+creates missing tables and adds missing columns and indexes. On a new
+database it creates everything from the models, so later migrations must
+tolerate finding their changes already in place; the helpers below do.
+
+To change the schema, change the models and add a migration with the next
+version number that applies the same change to existing databases.
+"""
+from datetime import datetime
+from typing import Callable, List, Tuple
+
+from sqlalchemy import MetaData, inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateIndex
+
+MIGRATIONS: List[Tuple[int, str, Callable]] = []
+
+def migration(version: int, description: str):
+    """Register a function(conn, metadata) as the migration to version"""
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return register
+
+def add_missing_column(conn: Connection, metadata: MetaData, table_name: str, column_name: str):
+    """Add a column of a model to its table unless it exists. The column is
+    added nullable and without default, as ALTER TABLE allows in SQLite.
+    """
+    if column_name in {column["name"] for column in inspect(conn).get_columns(table_name)}:
+        return
+    column = metadata.tables[table_name].columns[column_name]
+    column_type = column.type.compile(conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}"))
+
+def create_index(conn: Connection, metadata: MetaData, table_name: str, index_name: str):
+    """Create an index declared on a model unless it exists"""
+    index = next(index for index in metadata.tables[table_name].indexes if index.name == index_name)
+    # IF NOT EXISTS rather than checkfirst, which misses expression indexes in SQLite
+    conn.execute(CreateIndex(index, if_not_exists=True))
+
+def drop_index(conn: Connection, index_name: str):
+    conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+
+@migration(1, "Baseline: tables, columns and indexes of releases before versioned migrations")
+def _baseline(conn: Connection, metadata: MetaData):
+    metadata.create_all(bind=conn)
+
+    # create_all doesn't alter existing tables, so add columns introduced later
+    for table in metadata.sorted_tables:
+        for column in table.columns:
+            add_missing_column(conn, metadata, table.name, column.name)
+
+        # Indexes of existing tables aren't created by create_all either
+        for index in table.indexes:
+            create_index(conn, metadata, table.name, index.name)
+
+@migration(2, "Partial indexes on live files and folders for listings, trees and subtree lookups")
+def _live_indexes(conn: Connection, metadata: MetaData):
+    # Listing indexes only hold rows that aren't deleted, so the trash doesn't bloat them
+    for name in ("ix_files_listing_name", "ix_files_listing_size", "ix_files_listing_date",
+                 "ix_files_listing_mime", "ix_folders_listing_name", "ix_folders_listing_date"):
+        drop_index(conn, name)
+    for name in ("ix_files_live_name", "ix_files_live_size", "ix_files_live_date",
+                 "ix_files_live_mime", "ix_files_live_folder", "ix_files_trash"):
+        create_index(conn, metadata, "files", name)
+    for name in ("ix_folders_live_name", "ix_folders_live_date", "ix_folders_owner_path"):
+        create_index(conn, metadata, "folders", name)
+    # Subtree queries always filter by owner, which ix_folders_owner_path leads with
+    drop_index(conn, "ix_folders_path")
+
+def _create_search_index(conn: Connection, table_name: str, name_column: str, rowid: str):
+    """FTS5 index over the names of a table, see search_service. It reads the
+    names from the table (external content) and triggers keep it in sync.
+    """
+    index_name = f"{table_name}_fts"
+    # owner_id is indexed too, so a search only reads the user's own entries
+    conn.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {index_name} USING fts5("
+        f"{name_column}, owner_id, content='{table_name}', content_rowid='{rowid}', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    ))
+    old = f"INSERT INTO {index_name} ({index_name}, rowid, {name_column}, owner_id) VALUES ('delete', old.{rowid}, old.{name_column}, old.owner_id);"
+    new = f"INSERT INTO {index_name} (rowid, {name_column}, owner_id) VALUES (new.{rowid}, new.{name_column}, new.owner_id);"
+    conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS {index_name}_insert AFTER INSERT ON {table_name} BEGIN {new} END"))
+    conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS {index_name}_delete AFTER DELETE ON {table_name} BEGIN {old} END"))
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {index_name}_update AFTER UPDATE OF {name_column}, owner_id ON {table_name} "
+        f"BEGIN {old} {new} END"
+    ))
+    conn.execute(text(f"INSERT INTO {index_name} ({index_name}) VALUES ('rebuild')"))
+
+@migration(3, "Full-text search index over file and folder names")
+def _search_index(conn: Connection, metadata: MetaData):
+    # files has no INTEGER PRIMARY KEY, so its index refers to the implicit rowid
+    _create_search_index(conn, "files", "filename", "rowid")
+    _create_search_index(conn, "folders", "name", "id")
+
+@migration(4, "Chunk owners: versions can only be built from chunks the user uploaded or owns")
+def _chunk_owners(conn: Connection, metadata: MetaData):
+    metadata.tables["chunk_owners"].create(bind=conn, checkfirst=True)
+    create_index(conn, metadata, "chunk_owners", "ix_chunk_owners_pending")
+    # Chunks of existing versions belong to the owners of their files
+    conn.execute(text(
+        "INSERT OR IGNORE INTO chunk_owners (chunk_hash, owner_id, reserved_bytes, created_at) "
+        "SELECT DISTINCT file_version_chunks.chunk_hash, files.owner_id, 0, CURRENT_TIMESTAMP "
+        "FROM file_version_chunks "
+        "JOIN file_versions ON file_versions.id = file_version_chunks.version_id "
+        "JOIN files ON files.id = file_versions.file_id"
+    ))
+
+@migration(5, "Content modification time of files, the Last-Modified of their downloads")
+def _content_updated_at(conn: Connection, metadata: MetaData):
+    add_missing_column(conn, metadata, "files", "content_updated_at")
+    # The content dates from the file's latest version, or from its upload
+    conn.execute(text(
+        "UPDATE files SET content_updated_at = COALESCE("
+        "(SELECT MAX(file_versions.created_at) FROM file_versions WHERE file_versions.file_id = files.id), "
+        "created_at) "
+        "WHERE content_updated_at IS NULL"
+    ))
+
+def _ensure_version_table(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, description VARCHAR NOT NULL, applied_at DATETIME NOT NULL)"
+        ))
+
+def applied_versions(engine: Engine) -> List[int]:
+    _ensure_version_table(engine)
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(text("SELECT version FROM schema_migrations ORDER BY version"))]
+
+def pending_migrations(engine: Engine) -> List[Tuple[int, str, Callable]]:
+    applied = set(applied_versions(engine))
+    return [entry for entry in sorted(MIGRATIONS, key=lambda entry: entry[0]) if entry[0] not in applied]
+
+def apply_migrations(engine: Engine, metadata: MetaData) -> List[int]:
+    """Apply every migration the database is missing. Returns the versions applied."""
+    applied = []
+    for version, description, func in pending_migrations(engine):
+        with engine.begin() as conn:
+            func(conn, metadata)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:version, :description, :applied_at)"),
+                {"version": version, "description": description, "applied_at": datetime.utcnow()}
+            )
+        print(f"Applied schema migration {version}: {description}")
+        applied.append(version)
+    return applied
@@ -0,0 +1,131 @@
+"""
+Storage backend for file content.
+
+Content is addressed by a storage key: a path relative to the root of a
+storage volume, such as "blobs/ab/cd/<sha256>". Keys never depend on whether
+a file is public or private, so visibility is purely a database attribute
+and changing it never touches the disk.
+
+Content can be spread over several volumes (disks). UPLOAD_DIR is always the
+"default" volume; STORAGE_VOLUMES adds more as "name=/path" pairs. Every
+stored object records the name of the volume it lives on, and new objects go
+to the volume with the most free space per in-flight I/O operation.
+"""
+import errno
+import os
+import shutil
+from typing import Dict, Iterable, Optional
+
+from .config import settings
+from . import storage_io
+
+DEFAULT_VOLUME = "default"
+
+class StorageFullError(OSError):
+    """No volume has enough free space for a write"""
+
+    def __init__(self, message: str = "No storage volume has enough free space"):
+        super().__init__(errno.ENOSPC, message)
+
+class Volume:
+    def __init__(self, name: str, root: str):
+        self.name = name
+        self.root = root
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def free_bytes(self) -> int:
+        return shutil.disk_usage(self.root).free
+
+    def inflight(self) -> int:
+        """I/O requests in flight on the volume's block device (all processes), 0 if unknown"""
+        try:
+            device = os.stat(self.root).st_dev
+            with open(f"/sys/dev/block/{os.major(device)}:{os.minor(device)}/stat") as stat:
+                return int(stat.read().split()[8])
+        except (OSError, IndexError, ValueError):
+            return 0
+
+class LocalStorage:
+    """Objects stored as plain files on one or more local volumes"""
+
+    def __init__(self, volumes: Dict[str, str]):
+        self.volumes = {name: Volume(name, root) for name, root in volumes.items()}
+
+    def volume(self, name: Optional[str] = None) -> Volume:
+        # Rows written before volumes were introduced have no volume
+        return self.volumes[name or DEFAULT_VOLUME]
+
+    def path(self, key: str, volume: Optional[str] = None) -> str:
+        """Filesystem path of a stored object"""
+        # Rows written before storage keys were introduced hold absolute paths
+        if os.path.isabs(key):
+            return key
+        return self.volume(volume).path(key)
+
+    def volume_of(self, path: str) -> Volume:
+        """The volume a filesystem path belongs to"""
+        path = os.path.abspath(path)
+        matches = [
+            volume for volume in self.volumes.values()
+            if path.startswith(os.path.join(os.path.abspath(volume.root), ""))
+        ]
+        if not matches:
+            raise ValueError(f"{path} is not on a storage volume")
+        return max(matches, key=lambda volume: len(volume.root))
+
+    def _placement(self, size_hint: int, exclude: Iterable[str]):
+        min_free = settings.STORAGE_VOLUME_MIN_FREE_MB * 1024 * 1024
+        best, best_score = None, None
+        for volume in self.volumes.values():
+            if volume.name in exclude:
+                continue
+            os.makedirs(volume.root, exist_ok=True)
+            free = volume.free_bytes()
+            if free - size_hint < min_free:
+                continue
+            score = free / (1 + volume.inflight())
+            if best_score is None or score > best_score:
+                best, best_score = volume, score
+        return best
+
+    async def choose_volume(self, size_hint: int = 0, exclude: Iterable[str] = ()) -> Volume:
+        """Pick the volume for a new object: enough free space for size_hint bytes
+        (plus STORAGE_VOLUME_MIN_FREE_MB), preferring free space and idle disks.
+        Raises StorageFullError if no volume qualifies.
+        """
+        volume = await storage_io.run_io(self._placement, size_hint, tuple(exclude))
+        if volume is None:
+            raise StorageFullError()
+        return volume
+
+    async def exists(self, key: str, volume: Optional[str] = None) -> bool:
+        return await storage_io.exists(self.path(key, volume))
+
+    async def put(self, source_path: str, key: str) -> str:
+        """Move a fully written file into the store under the given key, on the
+        volume the file is already on, so this is a rename. Returns the volume name.
+        """
+        volume = self.volume_of(source_path)
+        target = volume.path(key)
+        await storage_io.makedirs(os.path.dirname(target))
+        await storage_io.replace(source_path, target)
+        return volume.name
+
+    async def delete(self, key: str, volume: Optional[str] = None) -> bool:
+        return await storage_io.remove_if_exists(self.path(key, volume))
+
+    def iter(self, key: str, volume: Optional[str] = None, chunk_size: int = 1024 * 1024):
+        """Read a stored object as an async stream of chunks"""
+        return storage_io.iter_file(self.path(key, volume), chunk_size)
+
+def _configured_volumes() -> Dict[str, str]:
+    volumes = {DEFAULT_VOLUME: settings.UPLOAD_DIR}
+    for entry in settings.STORAGE_VOLUMES.split(","):
+        if entry.strip():
+            name, _, root = entry.strip().partition("=")
+            volumes[name.strip()] = root.strip()
+    return volumes
+
+storage = LocalStorage(_configured_volumes())
@@ -0,0 +1,94 @@
+"""
+Async layer for storage disk I/O.
+
+Blocking filesystem calls (open/write/copy/remove/stat) run on a bounded
+thread pool instead of the event loop, so a multi-GB write or copy doesn't
+stall every other request on the worker. The pool size caps how many storage
+operations hit the disks at once.
+"""
+import asyncio
+import functools
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from .config import settings
+
+_executor = ThreadPoolExecutor(max_workers=settings.STORAGE_IO_WORKERS, thread_name_prefix="storage-io")
+
+async def run_io(func: Callable, *args, **kwargs) -> Any:
+    """Run a blocking storage call on the I/O pool and wait for its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+async def exists(path: str) -> bool:
+    return await run_io(os.path.exists, path)
+
+async def makedirs(path: str):
+    await run_io(os.makedirs, path, exist_ok=True)
+
+async def remove(path: str):
+    await run_io(os.remove, path)
+
+async def remove_if_exists(path: str) -> bool:
+    def _remove():
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+    return await run_io(_remove)
+
+async def replace(src: str, dst: str):
+    await run_io(os.replace, src, dst)
+
+async def move(src: str, dst: str):
+    await run_io(shutil.move, src, dst)
+
+async def copy(src: str, dst: str):
+    await run_io(shutil.copy2, src, dst)
+
+async def touch(path: str):
+    await run_io(lambda: open(path, "wb").close())
+
+class AsyncFile:
+    """File handle whose reads and writes run on the I/O pool"""
+
+    def __init__(self, handle):
+        self._handle = handle
+
+    async def read(self, size: int = -1) -> bytes:
+        return await run_io(self._handle.read, size)
+
+    async def write(self, data: bytes) -> int:
+        return await run_io(self._handle.write, data)
+
+    async def seek(self, offset: int, whence: int = 0) -> int:
+        return await run_io(self._handle.seek, offset, whence)
+
+    async def run(self, func: Callable, *args) -> Any:
+        """Run func(handle, *args) on the I/O pool, e.g. to combine hashing with a write"""
+        return await run_io(func, self._handle, *args)
+
+    async def close(self):
+        await run_io(self._handle.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+async def open_file(path: str, mode: str = "rb", buffering: int = -1) -> AsyncFile:
+    """Open a file on the I/O pool; use as `async with await open_file(...) as f`"""
+    return AsyncFile(await run_io(open, path, mode, buffering))
+
+async def iter_file(path: str, chunk_size: int = 1024 * 1024):
+    """Read a file in chunks without blocking the event loop"""
+    async with await open_file(path, "rb") as source:
+        while True:
+            data = await source.read(chunk_size)
+            if not data:
+                break
+            yield data
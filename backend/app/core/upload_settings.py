@@ -1,10 +1,68 @@
 """
 Настройки для загрузки больших файлов в FastAPI
 """
-from starlette.datastructures import UploadFile as StarletteUploadFile
-from fastapi import UploadFile as FastAPIUploadFile
+from typing import Optional
 
-# Переопределяем максимальный размер файла для загрузки (100 ГБ)
-# 100 ГБ в байтах = 107374182400
-StarletteUploadFile.spool_max_size = 107374182400
-FastAPIUploadFile.spool_max_size = 107374182400
+from starlette.concurrency import run_in_threadpool
+from starlette.formparsers import MultiPartParser
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from .config import settings
+from .database import SessionLocal
+from ..services.upload_service import get_upload_reservation
+
+# Multipart-загрузки буферизуются в памяти только до UPLOAD_SPOOL_MAX_SIZE_MB,
+# дальше SpooledTemporaryFile сбрасывает данные во временный файл на диске.
+# Для больших файлов используйте потоковую загрузку POST /api/v1/files/stream.
+MultiPartParser.spool_max_size = settings.UPLOAD_SPOOL_MAX_SIZE_MB * 1024 * 1024
+
+# Маршруты, принимающие файл целиком в теле запроса
+UPLOAD_PATHS = {f"{settings.API_V1_STR}/files", f"{settings.API_V1_STR}/files/stream"}
+
+# Запас на multipart-границы и поля формы поверх размера самого файла
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+def _reserved_size(token: str) -> Optional[int]:
+    """Size of a valid upload reservation, None if the token is invalid or expired"""
+    db = SessionLocal()
+    try:
+        db_reservation = get_upload_reservation(db, token)
+        return db_reservation.size_bytes if db_reservation else None
+    finally:
+        db.close()
+
+class UploadPreflightMiddleware(BaseHTTPMiddleware):
+    """
+    Rejects uploads that can't succeed before their body is read.
+
+    FastAPI parses multipart forms before any dependency runs, so endpoint
+    checks only happen after the whole file has been received. This middleware
+    validates the X-Upload-Token reservation and the declared Content-Length
+    up front. Since uvicorn only answers `Expect: 100-continue` once the body
+    is read, a rejected client never starts sending the file.
+    """
+    async def dispatch(self, request: Request, call_next):
+        if request.method != "POST" or request.url.path.rstrip("/") not in UPLOAD_PATHS:
+            return await call_next(request)
+
+        limit = settings.MAX_FILE_SIZE_MB * 1024 * 1024
+        token = request.headers.get("x-upload-token")
+        if token:
+            # The query blocks, so it runs in the threadpool like sync endpoints
+            reserved = await run_in_threadpool(_reserved_size, token)
+            if reserved is None:
+                return JSONResponse(status_code=403, content={"detail": "Upload token is invalid or expired"})
+            limit = min(limit, reserved)
+        elif settings.REQUIRE_UPLOAD_RESERVATION:
+            return JSONResponse(
+                status_code=428,
+                content={"detail": "Upload token required, reserve space with POST /api/v1/uploads/reservations first"}
+            )
+
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit + MULTIPART_OVERHEAD_BYTES:
+            return JSONResponse(status_code=413, content={"detail": "Upload exceeds the allowed size"})
+
+        return await call_next(request)
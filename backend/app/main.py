@@ -1,11 +1,19 @@
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 import os
+import asyncio
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from .api import auth, files, folders, users, admin
+from .api import auth, files, folders, users, admin, uploads, versions, public, jobs, search
 from .core.config import settings
-from .core.database import Base, engine
+from .core.database import init_db, SessionLocal
+from .core.storage import StorageFullError
+from .services.user_service import QuotaExceededError
+from .services.storage_migration_service import run_storage_migration
+from .services.replication_service import run_replication_repair
+from .services.job_service import start_job_workers
+from .services.gc_service import run_gc_periodically
+from .services.quota_service import seed_used_bytes, seed_stats, run_quota_reconciliation
+from .services.folder_service import seed_folder_paths
 
 # Настройки для загрузки больших файлов
 from fastapi.middleware.httpsredirect import HTTPSRedirectMiddleware
@@ -30,15 +38,7 @@ from fastapi.openapi.utils import get_openapi
 
 # Настройка для больших файлов
 from starlette.requests import Request
-from starlette.responses import Response
-
-# Увеличиваем лимит на размер загружаемых файлов
-from fastapi import UploadFile as FastAPIUploadFile
-from starlette.datastructures import UploadFile as StarletteUploadFile
-
-# Устанавливаем максимальный размер файла в 100 ГБ
-FastAPIUploadFile.spool_max_size = 107374182400  # 100 ГБ в байтах
-StarletteUploadFile.spool_max_size = 107374182400  # 100 ГБ в байтах
+from starlette.responses import Response, JSONResponse
 
 app = FastAPI(
     title="NIDrive API",
@@ -46,6 +46,10 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Проверка резерваций и размера загрузок до чтения тела запроса
+# (добавляется до CORS, чтобы отказы тоже получали CORS-заголовки)
+app.add_middleware(upload_settings.UploadPreflightMiddleware)
+
 # CORS Configuration
 app.add_middleware(
     CORSMiddleware,
@@ -61,20 +65,62 @@ app.add_middleware(TimeoutMiddleware)
 # Инициализация базы данных
 @app.on_event("startup")
 async def startup_db_client():
-    # Создаем таблицы
-    Base.metadata.create_all(bind=engine)
+    # Создаем таблицы и недостающие столбцы
+    init_db()
     print("Database tables created or already exist")
+    
+    # Переводим учет занятого места пользователей, созданных до учета в байтах
+    db = SessionLocal()
+    try:
+        seed_used_bytes(db)
+        # Пути папок, созданных до хранения материализованного пути
+        seed_folder_paths(db)
+        # Счетчики файлов и размеры папок пересчитываются в фоне, если их еще нет
+        seed_stats(db)
+    finally:
+        db.close()
+    
+    # Переносим старые файлы в шардированное хранилище в фоне, сервис продолжает работать
+    if settings.STORAGE_MIGRATION_ON_STARTUP:
+        app.state.storage_migration = asyncio.create_task(run_storage_migration())
+    
+    # Воркеры очереди фоновых задач; задачи, прерванные перезапуском, выполняются заново
+    await start_job_workers()
+    
+    # Досоздаем недостающие реплики (после включения репликации или добавления тома)
+    app.state.replication_repair = asyncio.create_task(run_replication_repair())
+    
+    # Периодически удаляем старые файлы из корзины и неиспользуемое содержимое
+    app.state.gc = asyncio.create_task(run_gc_periodically())
+    
+    # Постепенно сверяем учет занятого места с файлами пользователей
+    app.state.quota_reconciliation = asyncio.create_task(run_quota_reconciliation())
 
 # Include routers
 app.include_router(auth.router, tags=["authentication"])
 app.include_router(users.router, tags=["users"])
 app.include_router(files.router, tags=["files"])
+app.include_router(uploads.router, tags=["uploads"])
+app.include_router(versions.router, tags=["versions"])
 app.include_router(folders.router, tags=["folders"])
+app.include_router(search.router, tags=["search"])
 app.include_router(admin.router, tags=["admin"])
+app.include_router(jobs.router, tags=["jobs"])
+# Публичные ссылки ищутся в базе, а не в каталоге на диске
+app.include_router(public.router, tags=["public"])
+
+# Все тома хранилища заполнены
+@app.exception_handler(StorageFullError)
+async def storage_full_handler(request: Request, exc: StorageFullError):
+    return JSONResponse(status_code=507, content={"detail": "Storage is full, try again later"})
 
-# Mount static files for public access
-os.makedirs(settings.UPLOAD_DIR + "/public_files", exist_ok=True)
-app.mount("/public", StaticFiles(directory=settings.UPLOAD_DIR + "/public_files"), name="public_files")
+# Квота пользователя исчерпана (проверяется атомарно при резервировании места)
+@app.exception_handler(QuotaExceededError)
+async def quota_exceeded_handler(request: Request, exc: QuotaExceededError):
+    return JSONResponse(
+        status_code=413,
+        content={"detail": f"Insufficient storage space. Available: {exc.available_bytes / (1024 * 1024):.2f} MB"}
+    )
 
 @app.get("/", tags=["root"])
 async def root():
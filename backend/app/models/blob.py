@@ -0,0 +1,38 @@
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey
+from sqlalchemy.sql import func
+from sqlalchemy.orm import relationship
+from ..core.database import Base
+
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    hash = Column(String, primary_key=True, index=True)  # SHA-256 of the content
+    size_bytes = Column(BigInteger, nullable=False)
+    storage_path = Column(String, nullable=False)  # Path in the storage system
+    volume = Column(String, nullable=True)  # Storage volume holding the content, NULL for the default volume
+    encoding = Column(String, nullable=True)  # "zstd" or "gzip" if stored compressed, NULL if stored as-is
+    stored_size_bytes = Column(BigInteger, nullable=True)  # Size on disk if compressed
+    ref_count = Column(Integer, nullable=False, default=0)  # Number of File rows pointing at this blob
+    created_at = Column(DateTime, default=func.now())
+    unreferenced_at = Column(DateTime, nullable=True)  # When ref_count last dropped to zero
+
+    # Relationships
+    replicas = relationship("BlobReplica", cascade="all, delete-orphan")
+
+    def to_dict(self):
+        return {
+            "hash": self.hash,
+            "size_bytes": self.size_bytes,
+            "encoding": self.encoding,
+            "stored_size_bytes": self.stored_size_bytes,
+            "ref_count": self.ref_count,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "unreferenced_at": self.unreferenced_at.isoformat() if self.unreferenced_at else None
+        }
+
+class BlobReplica(Base):
+    __tablename__ = "blob_replicas"
+
+    blob_hash = Column(String, ForeignKey("blobs.hash"), primary_key=True)
+    volume = Column(String, primary_key=True)  # Volume holding this extra copy, under the blob's storage key
+    created_at = Column(DateTime, default=func.now())
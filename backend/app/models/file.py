@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Boolean, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from ..core.database import Base
@@ -9,6 +9,7 @@ class File(Base):
     id = Column(String, primary_key=True, index=True)
     filename = Column(String, nullable=False)
     storage_path = Column(String, nullable=False)  # Path in the storage system
+    blob_hash = Column(String, ForeignKey("blobs.hash"), nullable=True, index=True)  # Content blob, NULL for files stored before deduplication
     owner_id = Column(String, nullable=False, index=True)  # Telegram ID of the owner
     folder_id = Column(Integer, ForeignKey("folders.id"), nullable=True)  # NULL for files in root
     size_mb = Column(Float, nullable=False)  # Size in MB
@@ -16,11 +17,29 @@ class File(Base):
     is_public = Column(Boolean, default=False)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    content_updated_at = Column(DateTime, default=func.now())  # When the content last changed, unlike updated_at not touched by renames or moves
     is_deleted = Column(Boolean, default=False)
-    public_url = Column(String, nullable=True)  # URL for public access if public
+    deleted_at = Column(DateTime, nullable=True)  # When the file was moved to the trash, its bytes are reclaimed later
+    public_url = Column(String, nullable=True, index=True)  # URL for public access if public
+    link_generation = Column(Integer, default=0)  # Signed download URLs of older generations are revoked
+
+    # Queries on live files: directory listings, one index per sort order plus
+    # MIME type filters, and subtree lookups by folder. Partial, so files in
+    # the trash don't take up space in them; queries must filter on
+    # is_deleted == False to use them.
+    __table_args__ = (
+        Index("ix_files_live_name", "owner_id", "folder_id", "filename", "id", sqlite_where=is_deleted == False, postgresql_where=is_deleted == False),
+        Index("ix_files_live_size", "owner_id", "folder_id", "size_mb", "id", sqlite_where=is_deleted == False, postgresql_where=is_deleted == False),
+        Index("ix_files_live_date", "owner_id", "folder_id", "updated_at", "id", sqlite_where=is_deleted == False, postgresql_where=is_deleted == False),
+        Index("ix_files_live_mime", "owner_id", "folder_id", "mime_type", sqlite_where=is_deleted == False, postgresql_where=is_deleted == False),
+        Index("ix_files_live_folder", "folder_id", sqlite_where=is_deleted == False, postgresql_where=is_deleted == False),
+        # Files in the trash, walked in ID order by garbage collection
+        Index("ix_files_trash", "id", sqlite_where=is_deleted == True, postgresql_where=is_deleted == True),
+    )
 
     # Relationships
     folder = relationship("Folder", back_populates="files")
+    blob = relationship("Blob")
 
     def to_dict(self):
         return {
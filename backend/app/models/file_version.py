@@ -0,0 +1,63 @@
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, DateTime, Index, UniqueConstraint
+from sqlalchemy.sql import func
+from sqlalchemy.orm import relationship
+from ..core.database import Base
+
+class Chunk(Base):
+    __tablename__ = "chunks"
+
+    hash = Column(String, primary_key=True, index=True)  # SHA-256 of the chunk content
+    size_bytes = Column(Integer, nullable=False)
+    storage_path = Column(String, nullable=False)  # Path in the storage system
+    volume = Column(String, nullable=True)  # Storage volume holding the content, NULL for the default volume
+    ref_count = Column(Integer, nullable=False, default=0)  # Number of version entries using this chunk
+    created_at = Column(DateTime, default=func.now())
+    unreferenced_at = Column(DateTime, nullable=True)  # When ref_count last dropped to zero
+
+class ChunkOwner(Base):
+    """A user who uploaded a chunk or whose file content contains it. Users can
+    only build versions from chunks they own, so a hash alone grants nothing.
+    """
+    __tablename__ = "chunk_owners"
+
+    chunk_hash = Column(String, ForeignKey("chunks.hash"), primary_key=True)
+    owner_id = Column(String, primary_key=True)  # Telegram ID of the owner
+    reserved_bytes = Column(BigInteger, nullable=False, default=0)  # Quota held until a version uses the upload
+    created_at = Column(DateTime, default=func.now())
+
+    __table_args__ = (
+        # Uploads still holding quota, for the expiry of abandoned ones
+        Index("ix_chunk_owners_pending", "created_at", sqlite_where=reserved_bytes > 0, postgresql_where=reserved_bytes > 0),
+    )
+
+class FileVersion(Base):
+    __tablename__ = "file_versions"
+    __table_args__ = (UniqueConstraint("file_id", "version_number"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    file_id = Column(String, ForeignKey("files.id"), nullable=False, index=True)
+    version_number = Column(Integer, nullable=False)
+    size_bytes = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime, default=func.now())
+
+    # Relationships
+    chunks = relationship("FileVersionChunk", order_by="FileVersionChunk.position")
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "file_id": self.file_id,
+            "version_number": self.version_number,
+            "size_bytes": self.size_bytes,
+            "created_at": self.created_at.isoformat() if self.created_at else None
+        }
+
+class FileVersionChunk(Base):
+    __tablename__ = "file_version_chunks"
+
+    version_id = Column(Integer, ForeignKey("file_versions.id"), primary_key=True)
+    position = Column(Integer, primary_key=True)  # Order of the chunk within the version
+    chunk_hash = Column(String, ForeignKey("chunks.hash"), nullable=False, index=True)
+
+    # Relationships
+    chunk = relationship("Chunk")
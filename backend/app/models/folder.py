@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, DateTime, Boolean, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from ..core.database import Base
@@ -10,10 +10,22 @@ class Folder(Base):
     name = Column(String, nullable=False)
     owner_id = Column(String, nullable=False, index=True)  # Telegram ID of the owner
     parent_id = Column(Integer, ForeignKey("folders.id"), nullable=True)  # NULL for root folders
+    path = Column(String, nullable=True)  # IDs from the root down to this folder, e.g. "/1/5/9/"
+    size_bytes = Column(BigInteger, default=0)  # Charged size of the live files in this folder and all subfolders
+    file_count = Column(Integer, default=0)  # Live files in this folder and all subfolders
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     is_deleted = Column(Boolean, default=False)
 
+    # Directory listings of live folders by name and date; sizes change with
+    # every file below a folder, so sorting folders by size reads them all.
+    # Subtrees are path ranges within an owner's folders.
+    __table_args__ = (
+        Index("ix_folders_live_name", "owner_id", "parent_id", "name", "id", sqlite_where=is_deleted == False, postgresql_where=is_deleted == False),
+        Index("ix_folders_live_date", "owner_id", "parent_id", "updated_at", "id", sqlite_where=is_deleted == False, postgresql_where=is_deleted == False),
+        Index("ix_folders_owner_path", "owner_id", "path"),
+    )
+
     # Relationships
     parent = relationship("Folder", remote_side=[id], back_populates="children")
     children = relationship("Folder", back_populates="parent")
@@ -25,6 +37,9 @@ class Folder(Base):
             "name": self.name,
             "owner_id": self.owner_id,
             "parent_id": self.parent_id,
+            "path": self.path,
+            "size_bytes": self.size_bytes,
+            "file_count": self.file_count,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
             "is_deleted": self.is_deleted
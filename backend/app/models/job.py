@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy.sql import func
+from ..core.database import Base
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(String, primary_key=True, index=True)
+    kind = Column(String, nullable=False)  # Name of the registered handler
+    key = Column(String, nullable=True, unique=True)  # Idempotency key, one pending job per key
+    payload = Column(Text, nullable=True)  # JSON arguments of the handler
+    owner_id = Column(String, nullable=True, index=True)  # Telegram ID of the user who caused the job, NULL for system jobs
+    status = Column(String, nullable=False, default="queued", index=True)  # queued, running, succeeded or failed
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_after = Column(DateTime, nullable=False, default=func.now())  # Not picked up before this time (retry backoff)
+    locked_by = Column(String, nullable=True)  # Worker running the job
+    heartbeat_at = Column(DateTime, nullable=True)  # Running jobs without a recent heartbeat are taken over
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime, nullable=True)
@@ -0,0 +1,43 @@
+import hashlib
+
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, DateTime, Boolean
+from sqlalchemy.sql import func
+from sqlalchemy.orm import relationship
+from ..core.database import Base
+
+class MultipartUpload(Base):
+    __tablename__ = "multipart_uploads"
+
+    id = Column(String, primary_key=True, index=True)
+    owner_id = Column(String, nullable=False, index=True)  # Telegram ID of the owner
+    filename = Column(String, nullable=False)
+    folder_id = Column(Integer, ForeignKey("folders.id"), nullable=True)  # NULL for files in root
+    is_public = Column(Boolean, default=False)
+    mime_type = Column(String, nullable=True)
+    created_at = Column(DateTime, default=func.now())
+    expires_at = Column(DateTime, nullable=False)
+
+    # Relationships
+    parts = relationship("MultipartPart", order_by="MultipartPart.part_number", cascade="all, delete-orphan")
+
+    @property
+    def etag(self):
+        """S3-style ETag of the parts received so far: SHA-256 over the part hashes
+        plus the part count. It depends on how the content was split, so it
+        describes the upload, not the content, and is never used as a blob key.
+        """
+        if not self.parts:
+            return None
+        combined = hashlib.sha256("".join(part.sha256 for part in self.parts).encode()).hexdigest()
+        return f"{combined}-{len(self.parts)}"
+
+class MultipartPart(Base):
+    __tablename__ = "multipart_parts"
+
+    upload_id = Column(String, ForeignKey("multipart_uploads.id"), primary_key=True)
+    part_number = Column(Integer, primary_key=True)
+    size_bytes = Column(BigInteger, nullable=False)
+    sha256 = Column(String, nullable=False)  # Hash of the part content
+    storage_path = Column(String, nullable=False)  # Path in the storage system
+    volume = Column(String, nullable=True)  # Storage volume holding the content, NULL for the default volume
+    created_at = Column(DateTime, default=func.now())
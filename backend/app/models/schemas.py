@@ -63,6 +63,8 @@ class FolderUpdate(BaseModel):
 class FolderResponse(FolderBase):
     id: int
     owner_id: str
+    size_bytes: Optional[int] = None  # Files in the folder and all subfolders
+    file_count: Optional[int] = None
     created_at: datetime
     updated_at: datetime
     is_deleted: bool
@@ -75,8 +77,11 @@ class FolderTree(BaseModel):
     name: str
     owner_id: str
     parent_id: Optional[int] = None
+    size_bytes: Optional[int] = None  # Files in the folder and all subfolders
+    file_count: Optional[int] = None
     children: List['FolderTree'] = []
     files: List['FileResponse'] = []
+    has_children: bool = False  # Subfolders exist, even if not listed beyond the requested depth
 
     class Config:
         orm_mode = True
@@ -108,11 +113,149 @@ class FileResponse(FileBase):
     class Config:
         orm_mode = True
 
+# Directory Listing Schema
+class DirectoryListing(BaseModel):
+    folders: List[FolderResponse] = []  # Subfolders come before the files
+    files: List[FileResponse] = []
+    next_cursor: Optional[str] = None  # None on the last page
+
+class SearchResults(DirectoryListing):
+    pass  # Matching folders and files, each best match first
+
+# Signed Download URL Schemas
+class SignedUrlCreate(BaseModel):
+    expires_in: Optional[int] = Field(None, ge=1, description="Lifetime in seconds")
+    start: Optional[int] = Field(None, ge=0, description="First byte the URL grants access to")
+    end: Optional[int] = Field(None, ge=0, description="Last byte (inclusive) the URL grants access to")
+
+class SignedUrlResponse(BaseModel):
+    url: str
+    expires_at: datetime
+
+class SignedUrlRevoke(BaseModel):
+    file_ids: Optional[List[str]] = None  # All of the user's files when omitted
+
+# Background Job Schemas
+class JobResponse(BaseModel):
+    id: str
+    kind: str
+    status: str
+    attempts: int
+    max_attempts: int
+    last_error: Optional[str] = None
+    run_after: datetime
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+# Upload Session Schemas
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int = Field(..., ge=0, description="Total file size in bytes")
+    folder_id: Optional[int] = None
+    is_public: bool = False
+    mime_type: Optional[str] = None
+
+class UploadSessionResponse(BaseModel):
+    id: str
+    filename: str
+    folder_id: Optional[int] = None
+    is_public: bool
+    mime_type: Optional[str] = None
+    total_size: int
+    offset: int
+    created_at: datetime
+    expires_at: datetime
+
+    class Config:
+        orm_mode = True
+
+# Multipart Upload Schemas
+class MultipartUploadCreate(BaseModel):
+    filename: str
+    folder_id: Optional[int] = None
+    is_public: bool = False
+    mime_type: Optional[str] = None
+
+class MultipartPartResponse(BaseModel):
+    part_number: int
+    size_bytes: int
+    sha256: str
+
+    class Config:
+        orm_mode = True
+
+class MultipartUploadResponse(BaseModel):
+    id: str
+    filename: str
+    folder_id: Optional[int] = None
+    is_public: bool
+    mime_type: Optional[str] = None
+    created_at: datetime
+    expires_at: datetime
+    parts: List[MultipartPartResponse] = []
+    etag: Optional[str] = None  # S3-style ETag of the parts; identifies the part layout, not the content
+
+    class Config:
+        orm_mode = True
+
+class MultipartCompletePart(BaseModel):
+    part_number: int
+    sha256: Optional[str] = None
+
+class MultipartComplete(BaseModel):
+    parts: List[MultipartCompletePart]
+
+# Upload Reservation Schemas
+class UploadReservationCreate(BaseModel):
+    size: int = Field(..., ge=0, description="Declared file size in bytes")
+    folder_id: Optional[int] = None
+    is_public: bool = False
+    filename: Optional[str] = None
+
+class UploadReservationResponse(BaseModel):
+    token: str
+    size_bytes: int
+    folder_id: Optional[int] = None
+    is_public: bool
+    filename: Optional[str] = None
+    expires_at: datetime
+
+    class Config:
+        orm_mode = True
+
+# File Version Schemas
+class ChunkRef(BaseModel):
+    hash: str = Field(..., description="SHA-256 of the chunk content, hex encoded")
+    size: int = Field(..., ge=0, description="Chunk size in bytes")
+
+class ChunkList(BaseModel):
+    chunks: List[ChunkRef]
+
+class MissingChunks(BaseModel):
+    missing: List[str]
+
+class FileVersionResponse(BaseModel):
+    id: int
+    file_id: str
+    version_number: int
+    size_bytes: int
+    created_at: datetime
+
+    class Config:
+        orm_mode = True
+
 # User Stats Schema
 class UserStats(BaseModel):
     total_files: int
     total_folders: int
+    public_files: int
     used_space: float
+    used_bytes: int
+    reserved_bytes: int
     quota: float
     usage_percent: float
     
@@ -122,4 +265,7 @@ class UserQuotaUpdate(BaseModel):
     
 class AdminUserResponse(UserResponse):
     """Extended user response with additional information for admins"""
-    pass
+    used_bytes: Optional[int] = None
+    reserved_bytes: Optional[int] = None
+    file_count: Optional[int] = None
+    folder_count: Optional[int] = None
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, DateTime, Boolean
+from sqlalchemy.sql import func
+from ..core.database import Base
+
+class UploadReservation(Base):
+    __tablename__ = "upload_reservations"
+
+    token = Column(String, primary_key=True, index=True)  # Upload token presented with the data transfer
+    owner_id = Column(String, nullable=False, index=True)  # Telegram ID of the owner
+    size_bytes = Column(BigInteger, nullable=False)  # Reserved space in bytes
+    folder_id = Column(Integer, ForeignKey("folders.id"), nullable=True)  # NULL for files in root
+    is_public = Column(Boolean, default=False)
+    filename = Column(String, nullable=True)
+    created_at = Column(DateTime, default=func.now())
+    expires_at = Column(DateTime, nullable=False)
+
+    def to_dict(self):
+        return {
+            "token": self.token,
+            "owner_id": self.owner_id,
+            "size_bytes": self.size_bytes,
+            "folder_id": self.folder_id,
+            "is_public": self.is_public,
+            "filename": self.filename,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "expires_at": self.expires_at.isoformat() if self.expires_at else None
+        }
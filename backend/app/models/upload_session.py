@@ -0,0 +1,34 @@
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, DateTime, Boolean
+from sqlalchemy.sql import func
+from ..core.database import Base
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+
+    id = Column(String, primary_key=True, index=True)
+    owner_id = Column(String, nullable=False, index=True)  # Telegram ID of the owner
+    filename = Column(String, nullable=False)
+    folder_id = Column(Integer, ForeignKey("folders.id"), nullable=True)  # NULL for files in root
+    is_public = Column(Boolean, default=False)
+    mime_type = Column(String, nullable=True)
+    total_size = Column(BigInteger, nullable=False)  # Declared size in bytes
+    offset = Column(BigInteger, nullable=False, default=0)  # Bytes committed so far
+    temp_path = Column(String, nullable=False)  # Partial file in the storage system
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    expires_at = Column(DateTime, nullable=False)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "owner_id": self.owner_id,
+            "filename": self.filename,
+            "folder_id": self.folder_id,
+            "is_public": self.is_public,
+            "mime_type": self.mime_type,
+            "total_size": self.total_size,
+            "offset": self.offset,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+            "expires_at": self.expires_at.isoformat() if self.expires_at else None
+        }
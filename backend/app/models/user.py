@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, Float, DateTime, Boolean
 from sqlalchemy.sql import func
 from ..core.database import Base
 
@@ -11,8 +11,18 @@ class User(Base):
     first_name = Column(String)
     last_name = Column(String, nullable=True)
     photo_url = Column(String, nullable=True)
-    used_space = Column(Float, default=0.0)  # Space used in MB
+    used_bytes = Column(BigInteger, default=0)  # Space charged for stored files, NULL until seeded from used_space
+    reserved_bytes = Column(BigInteger, default=0)  # Space held by uploads in progress
+    file_count = Column(Integer, default=0)  # Live files, NULL until counted by the stats rebuild
+    public_file_count = Column(Integer, default=0)  # Live public files
+    folder_count = Column(Integer, default=0)  # Live folders
+    legacy_used_space = Column("used_space", Float, default=0.0)  # Space used in MB before byte accounting, no longer updated
     quota = Column(Float, default=1024.0)    # Default quota 1GB (1024 MB)
     created_at = Column(DateTime, default=func.now())
     last_login = Column(DateTime, nullable=True)
     is_active = Column(Boolean, default=True)
+
+    @property
+    def used_space(self) -> float:
+        """Space used in MB"""
+        return (self.used_bytes or 0) / (1024 * 1024)
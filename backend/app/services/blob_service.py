@@ -0,0 +1,249 @@
+import errno
+import hashlib
+import os
+import uuid
+from datetime import datetime
+from typing import AsyncIterator, Iterable
+
+from sqlalchemy import case
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..models.blob import Blob, BlobReplica
+from ..core import storage_io
+from ..core.compression import choose_encoding, compress_file
+from ..core.storage import storage, DEFAULT_VOLUME
+
+BLOBS_DIR = "blobs"
+BLOBS_TMP_DIR = os.path.join(BLOBS_DIR, "tmp")
+HASH_CHUNK_SIZE = 10 * 1024 * 1024  # 10 MB
+
+def blob_key(digest: str) -> str:
+    """Content-addressed storage key of a blob, fanned out by hash prefix"""
+    return os.path.join(BLOBS_DIR, digest[:2], digest[2:4], digest)
+
+async def new_temp_path(size_hint: int = 0, exclude: Iterable[str] = (), volume: str = None) -> str:
+    """Unique temporary path on the given volume, or on one chosen with room for size_hint bytes.
+    It is on the same filesystem as the blobs of that volume, so commits are a rename.
+    """
+    target = storage.volume(volume) if volume else await storage.choose_volume(size_hint, exclude)
+    tmp_dir = target.path(BLOBS_TMP_DIR)
+    await storage_io.makedirs(tmp_dir)
+    return os.path.join(tmp_dir, f"{uuid.uuid4()}.tmp")
+
+def _write_all(buffer, data: bytes):
+    # Unbuffered writes may be partial
+    view = memoryview(data)
+    while view:
+        view = view[buffer.write(view):]
+
+def _hash_and_write(buffer, hasher, chunk: bytes):
+    # hashlib releases the GIL for large buffers, so hashing runs alongside the write
+    hasher.update(chunk)
+    _write_all(buffer, chunk)
+
+def _copy_prefix(source_path: str, target_path: str, length: int):
+    """Copy the first length bytes of a file. Blocking, run it on the I/O pool."""
+    with open(source_path, "rb") as source, open(target_path, "wb") as target:
+        remaining = length
+        while remaining:
+            data = source.read(min(HASH_CHUNK_SIZE, remaining))
+            if not data:
+                break
+            target.write(data)
+            remaining -= len(data)
+
+async def _move_temp_blob(temp_path: str, written: int, full_volumes: set) -> str:
+    """Move the first `written` bytes of a temporary file whose volume filled up
+    to another volume. Raises StorageFullError once every volume is full.
+    """
+    full_volumes.add(storage.volume_of(temp_path).name)
+    while True:
+        new_path = await new_temp_path(written, exclude=full_volumes)
+        try:
+            await storage_io.run_io(_copy_prefix, temp_path, new_path, written)
+        except OSError as e:
+            await storage_io.remove_if_exists(new_path)
+            if e.errno != errno.ENOSPC:
+                raise
+            full_volumes.add(storage.volume_of(new_path).name)
+            continue
+        await storage_io.remove_if_exists(temp_path)
+        return new_path
+
+async def write_temp_blob(chunks: AsyncIterator[bytes], max_bytes: int = None, size_hint: int = 0):
+    """Write a stream to a temporary file while hashing it.
+    Returns a tuple of (temp_path, sha256 hex digest, size in bytes).
+    Raises ValueError as soon as more than max_bytes arrive; the temporary file is removed.
+    If the volume fills up the file continues on another volume instead of failing.
+    """
+    temp_path = await new_temp_path(size_hint)
+    hasher = hashlib.sha256()
+    size = 0
+    full_volumes = set()
+    buffer = None
+    try:
+        buffer = await storage_io.open_file(temp_path, "wb", buffering=0)
+        async for chunk in chunks:
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                raise ValueError("Upload exceeds the allowed size")
+            try:
+                await buffer.run(_hash_and_write, hasher, chunk)
+            except OSError as e:
+                if e.errno != errno.ENOSPC:
+                    raise
+                # The chunk is already hashed, only its bytes have to land somewhere else
+                while True:
+                    await buffer.close()
+                    temp_path = await _move_temp_blob(temp_path, size - len(chunk), full_volumes)
+                    buffer = await storage_io.open_file(temp_path, "ab", buffering=0)
+                    try:
+                        await buffer.run(_write_all, chunk)
+                        break
+                    except OSError as retry_error:
+                        if retry_error.errno != errno.ENOSPC:
+                            raise
+        await buffer.close()
+    except BaseException:
+        if buffer:
+            await buffer.close()
+        await storage_io.remove_if_exists(temp_path)
+        raise
+    return temp_path, hasher.hexdigest(), size
+
+def hash_file(path: str):
+    """Hash an existing file. Returns a tuple of (sha256 hex digest, size in bytes).
+    Blocking, run it on the I/O pool.
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as source:
+        while True:
+            chunk = source.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            size += len(chunk)
+    return hasher.hexdigest(), size
+
+def get_blob(db: Session, digest: str):
+    """Get a blob by its content hash"""
+    return db.query(Blob).filter(Blob.hash == digest).first()
+
+def _hold_existing(db: Session, digest: str) -> bool:
+    """Keep an existing blob from being reclaimed for GC_UNREFERENCED_GRACE_HOURS,
+    so the caller can take its reference later. False if there is no such blob.
+    """
+    held = db.query(Blob).filter(Blob.hash == digest).update({
+        Blob.unreferenced_at: case((Blob.ref_count == 0, datetime.utcnow()), else_=Blob.unreferenced_at)
+    }, synchronize_session=False)
+    db.commit()
+    return held == 1
+
+def _acquire_existing(db: Session, digest: str) -> bool:
+    """Atomically add a reference to an existing blob, without commit"""
+    updated = db.query(Blob).filter(Blob.hash == digest).update({
+        Blob.ref_count: Blob.ref_count + 1,
+        Blob.unreferenced_at: None
+    }, synchronize_session=False)
+    return updated == 1
+
+async def _compress_temp_blob(temp_path: str, size: int, mime_type: str = None):
+    """Compress a temporary blob file if its type and a sample say it pays off.
+    Returns a tuple of (temp_path, encoding or None, stored size).
+    """
+    encoding = await storage_io.run_io(choose_encoding, temp_path, size, mime_type)
+    if not encoding:
+        return temp_path, None, size
+
+    compressed_path = await new_temp_path(volume=storage.volume_of(temp_path).name)
+    try:
+        stored_size = await storage_io.run_io(compress_file, temp_path, compressed_path, encoding)
+    except OSError as e:
+        # Out of space for the compressed copy: keep the content as it is
+        await storage_io.remove_if_exists(compressed_path)
+        if e.errno != errno.ENOSPC:
+            raise
+        return temp_path, None, size
+    if stored_size >= size:
+        await storage_io.remove(compressed_path)
+        return temp_path, None, size
+
+    await storage_io.remove(temp_path)
+    return compressed_path, encoding, stored_size
+
+async def _settle_duplicate(db: Session, digest: str, volume: str, encoding: str, stored_size: int):
+    """Reconcile the file we just stored with a blob row committed concurrently.
+    The content is identical but may be stored with another encoding.
+    """
+    db_blob = get_blob(db, digest)
+    if (db_blob.volume or DEFAULT_VOLUME) == volume:
+        # We renamed over its primary copy: describe the file now on disk
+        db_blob.encoding = encoding
+        db_blob.stored_size_bytes = stored_size if encoding else None
+    else:
+        # A stray copy, or one that replaced a replica whose encoding may differ
+        db.query(BlobReplica).filter(
+            BlobReplica.blob_hash == digest,
+            BlobReplica.volume == volume
+        ).delete(synchronize_session=False)
+        await storage.delete(db_blob.storage_path, volume)
+    db.commit()
+
+async def commit_blob(db: Session, temp_path: str, digest: str, size: int, mime_type: str = None) -> Blob:
+    """Store a fully written temporary file as a blob and take a reference to it.
+    If a blob with the same content already exists the temporary file is dropped.
+    New content is compressed at rest when mime_type and a sample suggest it.
+    The reference is taken without commit: the caller commits it together with
+    the row that holds it, and a rollback drops it again.
+    """
+    if _hold_existing(db, digest):
+        await storage_io.remove(temp_path)
+    else:
+        temp_path, encoding, stored_size = await _compress_temp_blob(temp_path, size, mime_type)
+        key = blob_key(digest)
+        volume = await storage.put(temp_path, key)
+
+        # Committed unreferenced, within the grace period of garbage collection
+        db_blob = Blob(
+            hash=digest,
+            size_bytes=size,
+            storage_path=key,
+            volume=volume,
+            encoding=encoding,
+            stored_size_bytes=stored_size if encoding else None,
+            ref_count=0
+        )
+        db.add(db_blob)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Another upload of the same content committed first
+            db.rollback()
+            await _settle_duplicate(db, digest, volume, encoding, stored_size)
+
+    _acquire_existing(db, digest)
+    return get_blob(db, digest)
+
+async def commit_file_as_blob(db: Session, path: str, mime_type: str = None) -> Blob:
+    """Hash a file that is already on disk and move it into the blob store"""
+    digest, size = await storage_io.run_io(hash_file, path)
+    return await commit_blob(db, path, digest, size, mime_type)
+
+def drop_blob_references(db: Session, digest: str, count: int = 1):
+    """Drop count references to a blob, without commit. Blobs left without
+    references keep their bytes until they are reclaimed, so a re-upload of
+    the same content can reuse them.
+    """
+    db.query(Blob).filter(Blob.hash == digest, Blob.ref_count > 0).update({
+        Blob.ref_count: case((Blob.ref_count < count, 0), else_=Blob.ref_count - count)
+    }, synchronize_session=False)
+    db.query(Blob).filter(Blob.hash == digest, Blob.ref_count == 0).update({
+        Blob.unreferenced_at: datetime.utcnow()
+    }, synchronize_session=False)
+
+def release_blob(db: Session, digest: str):
+    """Drop a reference to a blob"""
+    drop_blob_references(db, digest)
+    db.commit()
@@ -1,12 +1,22 @@
-import os
-import shutil
+from datetime import datetime
+
 from sqlalchemy.orm import Session
-from sqlalchemy import func, or_
+from sqlalchemy import BigInteger, case, cast, func, or_
 
+from ..models.blob import Blob
 from ..models.file import File
 from ..models.schemas import FileCreate, FileUpdate
 from ..core.config import settings
-from .user_service import update_user_space_usage
+from ..core import storage_io
+from ..core.storage import storage
+from .user_service import charge_space
+from .stats_service import count_file, count_files, charge_folders
+from .blob_service import release_blob
+from .replication_service import locate_blob, schedule_replication
+
+def build_public_url(public_url_base: str, file_id: str) -> str:
+    """Public download URL of a file"""
+    return f"{public_url_base}{settings.API_V1_STR}/files/public/{file_id}/download"
 
 def create_file(
     db: Session, 
@@ -16,12 +26,16 @@ def create_file(
     size_mb: float,
     mime_type: str = None,
     public_url: str = None,
-    file_id: str = None
+    file_id: str = None,
+    blob_hash: str = None
 ):
-    """Create a new file record in the database"""
+    """Create a new file record in the database and charge it to the owner
+    in the same transaction
+    """
     db_file = File(
         filename=file.filename,
         storage_path=storage_path,
+        blob_hash=blob_hash,
         owner_id=owner_id,
         folder_id=file.folder_id,
         size_mb=size_mb,
@@ -31,14 +45,42 @@ def create_file(
         id=file_id if file_id else None
     )
     db.add(db_file)
+    db.flush()
+    
+    # Update user's space usage and counters together with the file row
+    size = charged_bytes(db_file)
+    charge_space(db, owner_id, size)
+    count_file(db, owner_id, db_file.folder_id, db_file.is_public, size)
     db.commit()
     db.refresh(db_file)
     
-    # Update user's space usage
-    update_user_space_usage(db, owner_id, size_mb)
+    # Copy the content to other volumes once the file is committed
+    if blob_hash:
+        schedule_replication(db, blob_hash)
     
     return db_file
 
+def charged_bytes(db_file: File) -> int:
+    """Size counted against the owner's quota: the compressed size on disk with
+    QUOTA_SIZE_POLICY=physical, otherwise the original size.
+    Must match charged_bytes_expression.
+    """
+    db_blob = db_file.blob
+    if db_blob:
+        if settings.QUOTA_SIZE_POLICY == "physical" and db_blob.encoding:
+            return db_blob.stored_size_bytes
+        return db_blob.size_bytes
+    # Legacy files only have their size in MB
+    return int(round(db_file.size_mb * 1024 * 1024))
+
+def charged_bytes_expression():
+    """SQL equivalent of charged_bytes, for a query joining files with blobs"""
+    whens = []
+    if settings.QUOTA_SIZE_POLICY == "physical":
+        whens.append((Blob.encoding != None, Blob.stored_size_bytes))
+    whens.append((Blob.hash != None, Blob.size_bytes))
+    return case(*whens, else_=cast(func.round(File.size_mb * 1024 * 1024), BigInteger))
+
 def get_files_by_owner(db: Session, owner_id: str, folder_id: int = None):
     """Get all active files for a user, optionally filtered by folder"""
     query = db.query(File).filter(
@@ -60,7 +102,7 @@ def is_owner_of_file(db: Session, file_id: int, owner_id: str):
     file = get_file_by_id(db, file_id)
     return file and file.owner_id == owner_id
 
-def update_file(db: Session, file_id: int, file_update: FileUpdate, public_url_base: str):
+async def update_file(db: Session, file_id: int, file_update: FileUpdate, public_url_base: str):
     """Update file metadata"""
     db_file = get_file_by_id(db, file_id)
     if not db_file:
@@ -69,38 +111,20 @@ def update_file(db: Session, file_id: int, file_update: FileUpdate, public_url_b
     # Update allowed fields
     update_data = file_update.dict(exclude_unset=True, exclude_none=True)
     
-    # If is_public flag is changing, update the public_url
+    # Storage keys don't depend on visibility, so only the public URL changes
     if 'is_public' in update_data and update_data['is_public'] != db_file.is_public:
-        # Extract filename from storage path
-        filename = os.path.basename(db_file.storage_path)
-        
-        # Update public URL based on visibility
         if update_data['is_public']:
-            # Make the file public
-            if os.path.exists(db_file.storage_path):
-                # Move file to public directory if it's not already there
-                if 'private_files' in db_file.storage_path:
-                    new_path = db_file.storage_path.replace('private_files', 'public_files')
-                    os.makedirs(os.path.dirname(new_path), exist_ok=True)
-                    shutil.copy2(db_file.storage_path, new_path)
-                    os.remove(db_file.storage_path)
-                    db_file.storage_path = new_path
-                
-                # Set public URL
-                db_file.public_url = f"{public_url_base}/public/{filename}"
+            db_file.public_url = build_public_url(public_url_base, db_file.id)
         else:
-            # Make the file private
-            if os.path.exists(db_file.storage_path):
-                # Move file to private directory if it's not already there
-                if 'public_files' in db_file.storage_path:
-                    new_path = db_file.storage_path.replace('public_files', 'private_files')
-                    os.makedirs(os.path.dirname(new_path), exist_ok=True)
-                    shutil.copy2(db_file.storage_path, new_path)
-                    os.remove(db_file.storage_path)
-                    db_file.storage_path = new_path
-            
-            # Remove public URL
             db_file.public_url = None
+        if not db_file.is_deleted:
+            count_files(db, db_file.owner_id, public=1 if update_data['is_public'] else -1)
+    
+    # The size of a moved file goes from the old folders to the new ones
+    if 'folder_id' in update_data and update_data['folder_id'] != db_file.folder_id and not db_file.is_deleted:
+        size = charged_bytes(db_file)
+        charge_folders(db, db_file.folder_id, -size, -1)
+        charge_folders(db, update_data['folder_id'], size, 1)
     
     # Update other fields
     for key, value in update_data.items():
@@ -114,27 +138,66 @@ def delete_file(db: Session, file_id: int, owner_id: str):
     """Mark a file as deleted and update user's space usage"""
     db_file = get_file_by_id(db, file_id)
     if db_file and db_file.owner_id == owner_id and not db_file.is_deleted:
-        # Mark as deleted in database
-        db_file.is_deleted = True
+        # Mark as deleted in database, the bytes are reclaimed after GC_DELETED_FILE_RETENTION_DAYS.
+        # Only one of concurrent deletes may give the space back.
+        deleted = db.query(File).filter(File.id == db_file.id, File.is_deleted == False).update({
+            File.is_deleted: True,
+            File.deleted_at: datetime.utcnow()
+        }, synchronize_session=False)
+        if not deleted:
+            db.rollback()
+            return False
+        # Update user's space usage and counters (subtract the file)
+        size = charged_bytes(db_file)
+        charge_space(db, owner_id, -size)
+        count_file(db, owner_id, db_file.folder_id, db_file.is_public, size, sign=-1)
         db.commit()
+        db.refresh(db_file)
         
-        # Update user's space usage (subtract the file size)
-        update_user_space_usage(db, owner_id, -db_file.size_mb)
-        
-        # Optionally delete the physical file
-        # if os.path.exists(db_file.storage_path):
-        #    os.remove(db_file.storage_path)
+        # Drop this file's reference to its content
+        if db_file.blob_hash:
+            release_blob(db, db_file.blob_hash)
         
         return True
     return False
 
-def get_file_content(file_path: str):
-    """Get file content from the storage path"""
-    if os.path.exists(file_path):
-        return file_path
+def file_etag(db_file: File):
+    """Strong ETag of a file's content: the hash recorded when it was stored.
+    None for legacy files that have no content hash yet.
+    """
+    if db_file.blob_hash:
+        return f'"{db_file.blob_hash}"'
+    return None
+
+def file_download_options(db_file: File) -> dict:
+    """Validators and stored encoding of a file, as file_download_response arguments.
+    Last-Modified is the time of the content, so renames don't invalidate caches or If-Range.
+    """
+    options = {"etag": file_etag(db_file), "last_modified": db_file.content_updated_at or db_file.created_at}
+    if db_file.blob and db_file.blob.encoding:
+        options.update(encoding=db_file.blob.encoding, size=db_file.blob.size_bytes)
+    return options
+
+async def get_file_content(db: Session, db_file: File):
+    """Get the filesystem path of stored file content, from the least busy
+    replica that is present on disk
+    """
+    if db_file.blob:
+        return await locate_blob(db, db_file.blob)
+    path = storage.path(db_file.storage_path)
+    if await storage_io.exists(path):
+        return path
     return None
 
-def toggle_file_visibility(db: Session, file_id: int, is_public: bool, public_url_base: str):
+def get_public_file_by_url(db: Session, public_url: str):
+    """Get a public file by its public URL"""
+    return db.query(File).filter(
+        File.public_url == public_url,
+        File.is_public == True,
+        File.is_deleted == False
+    ).first()
+
+async def toggle_file_visibility(db: Session, file_id: int, is_public: bool, public_url_base: str):
     """Toggle file visibility between public and private"""
     update_data = FileUpdate(is_public=is_public)
-    return update_file(db, file_id, update_data, public_url_base)
+    return await update_file(db, file_id, update_data, public_url_base)
@@ -1,10 +1,20 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func, or_
-from typing import List, Dict, Any
+from datetime import datetime
 
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import String, and_, case, cast, func, literal, or_, select
+from collections import defaultdict
+from typing import List, Dict, Any, Optional, Set
+
+from ..models.blob import Blob
 from ..models.folder import Folder
 from ..models.file import File
-from ..models.schemas import FolderCreate, FolderUpdate, FolderTree
+from ..models.schemas import FolderCreate, FolderUpdate, FolderTree, FileResponse
+from .blob_service import drop_blob_references
+from .file_service import charged_bytes_expression
+from .stats_service import charge_folders, count_files, count_folders
+from .user_service import charge_space
+
+TREE_FILES_BATCH_SIZE = 500
 
 def create_folder(db: Session, folder: FolderCreate, owner_id: str):
     """Create a new folder"""
@@ -14,10 +24,73 @@ def create_folder(db: Session, folder: FolderCreate, owner_id: str):
         owner_id=owner_id
     )
     db.add(db_folder)
+    db.flush()
+    
+    # The path ends with the folder's own ID, known once the row is inserted
+    parent = get_folder_by_id(db, folder.parent_id) if folder.parent_id else None
+    db_folder.path = folder_path(parent, db_folder.id)
+    count_folders(db, owner_id, 1)
     db.commit()
     db.refresh(db_folder)
     return db_folder
 
+def folder_path(parent: Optional[Folder], folder_id: int) -> str:
+    """Materialized path of a folder below parent, or of a root folder"""
+    return f"{parent.path if parent else '/'}{folder_id}/"
+
+def subtree_filter(path: str):
+    """Condition matching the folder with this path and all its descendants.
+    A range instead of LIKE, so the index on Folder.path is used: every path
+    starting with "/1/5/" sorts below "/1/50", as "0" follows "/".
+    """
+    return and_(Folder.path >= path, Folder.path < path[:-1] + "0")
+
+def is_in_subtree(folder: Folder, other: Folder) -> bool:
+    """Whether other is folder itself or one of its descendants"""
+    return other.path.startswith(folder.path)
+
+def subtree_folder_ids(db: Session, db_folder: Folder):
+    """Query of the IDs of a folder and all its descendants, deleted or not"""
+    return db.query(Folder.id).filter(Folder.owner_id == db_folder.owner_id, subtree_filter(db_folder.path))
+
+def get_files_in_subtree(db: Session, db_folder: Folder):
+    """Active files anywhere under a folder, whatever the depth"""
+    return db.query(File).filter(
+        File.folder_id.in_(subtree_folder_ids(db, db_folder)),
+        File.is_deleted == False
+    ).all()
+
+def seed_folder_paths(db: Session) -> int:
+    """Fill in the paths of folders created before materialized paths, one
+    tree level per statement. Folders in a parent cycle, which moves could
+    create before, or below a missing parent become root folders.
+    """
+    parent = aliased(Folder)
+    parent_path = select(parent.path).where(parent.id == Folder.parent_id).scalar_subquery()
+    seeded = 0
+    while True:
+        updated = db.query(Folder).filter(Folder.path == None, Folder.parent_id == None).update({
+            Folder.path: literal("/") + cast(Folder.id, String) + "/"
+        }, synchronize_session=False)
+        while True:
+            level = db.query(Folder).filter(Folder.path == None, parent_path != None).update({
+                Folder.path: parent_path + cast(Folder.id, String) + "/"
+            }, synchronize_session=False)
+            if not level:
+                break
+            updated += level
+        seeded += updated
+        
+        stuck = db.query(func.min(Folder.id)).filter(Folder.path == None).scalar()
+        if stuck is None:
+            break
+        print(f"Folder {stuck} is unreachable from the root, moving it to the root")
+        db.query(Folder).filter(Folder.id == stuck).update({Folder.parent_id: None}, synchronize_session=False)
+    db.commit()
+    if seeded:
+        print(f"Folder paths filled in for {seeded} folders")
+    return seeded
+
 def get_folders_by_owner(db: Session, owner_id: str, parent_id: int = None):
     """Get all active folders for a user, optionally filtered by parent folder"""
     query = db.query(Folder).filter(
@@ -40,101 +113,161 @@ def is_owner_of_folder(db: Session, folder_id: int, owner_id: str):
     return folder and folder.owner_id == owner_id
 
 def update_folder(db: Session, folder_id: int, folder_update: FolderUpdate):
-    """Update folder metadata"""
+    """Update folder metadata. Moving a folder moves its whole subtree with
+    one statement; the caller checks that the new parent isn't inside it.
+    """
     db_folder = get_folder_by_id(db, folder_id)
     if not db_folder:
         return None
         
+    update_data = folder_update.dict(exclude_unset=True, exclude_none=True)
+    if "parent_id" in update_data and update_data["parent_id"] != db_folder.parent_id:
+        parent = get_folder_by_id(db, update_data["parent_id"])
+        old_path = db_folder.path
+        new_path = folder_path(parent, db_folder.id)
+        db.query(Folder).filter(
+            Folder.owner_id == db_folder.owner_id,
+            subtree_filter(old_path)
+        ).update({
+            Folder.path: new_path + func.substr(Folder.path, len(old_path) + 1)
+        }, synchronize_session=False)
+        # The subtree's files now count towards the folders above the new parent
+        if not db_folder.is_deleted:
+            size, count = db_folder.size_bytes or 0, db_folder.file_count or 0
+            charge_folders(db, db_folder.parent_id, -size, -count)
+            charge_folders(db, parent.id, size, count)
+        
     # Update allowed fields
-    for key, value in folder_update.dict(exclude_unset=True, exclude_none=True).items():
+    for key, value in update_data.items():
         setattr(db_folder, key, value)
     
     db.commit()
     db.refresh(db_folder)
     return db_folder
 
-def delete_folder(db: Session, folder_id: int, owner_id: str):
-    """Mark a folder and all its contents as deleted"""
+def delete_folder(db: Session, folder_id: int, owner_id: str) -> bool:
+    """Mark a folder, all its subfolders and their files as deleted in one
+    transaction, releasing the files' space and their blob references.
+    Returns False if the folder can't be deleted.
+    """
     db_folder = get_folder_by_id(db, folder_id)
     if not db_folder or db_folder.owner_id != owner_id or db_folder.is_deleted:
         return False
         
-    # Mark this folder as deleted
-    db_folder.is_deleted = True
-    
-    # Mark all files in this folder as deleted
-    files_in_folder = db.query(File).filter(
-        File.folder_id == folder_id,
-        File.is_deleted == False
-    ).all()
-    
-    for file in files_in_folder:
-        file.is_deleted = True
-    
-    # Recursively delete all subfolders
-    subfolders = db.query(Folder).filter(
-        Folder.parent_id == folder_id,
+    # The whole subtree disappears at once; the update comes first, so the files
+    # are read under the write lock and nothing changes between read and update
+    deleted_folders = db.query(Folder).filter(
+        Folder.owner_id == owner_id,
+        subtree_filter(db_folder.path),
         Folder.is_deleted == False
-    ).all()
-    
-    for subfolder in subfolders:
-        delete_folder(db, subfolder.id, owner_id)
-    
+    ).update({Folder.is_deleted: True, Folder.size_bytes: 0, Folder.file_count: 0}, synchronize_session=False)
+    if not deleted_folders:
+        db.rollback()
+        return False
+    count_folders(db, owner_id, -deleted_folders)
+
+    subtree_ids = db.query(Folder.id).filter(Folder.owner_id == owner_id, subtree_filter(db_folder.path))
+    live_files = and_(File.owner_id == owner_id, File.is_deleted == False, File.folder_id.in_(subtree_ids))
+    size, count, public = db.query(
+        func.coalesce(func.sum(charged_bytes_expression()), 0),
+        func.count(File.id),
+        func.coalesce(func.sum(case((File.is_public == True, 1), else_=0)), 0)
+    ).select_from(File).outerjoin(Blob, Blob.hash == File.blob_hash).filter(live_files).one()
+    references = db.query(File.blob_hash, func.count(File.id)).filter(
+        live_files, File.blob_hash != None
+    ).group_by(File.blob_hash).all()
+
+    db.query(File).filter(live_files).update({
+        File.is_deleted: True,
+        File.deleted_at: datetime.utcnow()
+    }, synchronize_session=False)
+    charge_space(db, owner_id, -int(size))
+    count_files(db, owner_id, -count, -int(public))
+    charge_folders(db, db_folder.parent_id, -int(size), -count)
+    for digest, references_count in references:
+        drop_blob_references(db, digest, references_count)
     db.commit()
     return True
 
-def get_folder_tree(db: Session, owner_id: str) -> List[FolderTree]:
+def get_folder_tree(
+    db: Session,
+    owner_id: str,
+    parent_id: Optional[int] = None,
+    depth: Optional[int] = None
+) -> List[FolderTree]:
     """
-    Build a folder tree structure for a user
-    Returns a list of root folders with their nested children and files
+    Build the folder tree of a user with its files.
+    Returns the root folders, or the subfolders of parent_id to expand one
+    branch lazily. With depth only that many levels are filled in; deeper
+    nodes have no children listed but has_children tells the client that
+    they can be expanded.
+    The folders are read with one query, only those below parent_id when
+    given, and the files of the included folders with another, then grouped
+    in a single pass.
     """
-    # Get all folders for this owner
-    all_folders = db.query(Folder).filter(
+    query = db.query(Folder).filter(
         Folder.owner_id == owner_id,
         Folder.is_deleted == False
-    ).all()
+    )
+    parent = get_folder_by_id(db, parent_id) if parent_id is not None else None
+    if parent and parent.path:
+        query = query.filter(subtree_filter(parent.path))
+    folders = query.all()
     
-    # Create a lookup dict for fast access
-    folder_dict = {folder.id: folder for folder in all_folders}
+    children = defaultdict(list)
+    for folder in folders:
+        children[folder.parent_id].append(folder)
     
-    # Initialize tree structure with root folders (those with parent_id=None)
-    root_folders = [folder for folder in all_folders if folder.parent_id is None]
+    # Walk the levels breadth-first to find the folders to include
+    included = []
+    level = children.get(parent_id, [])
+    current_depth = 1
+    seen = set()
+    while level and (depth is None or current_depth <= depth):
+        level = [folder for folder in level if folder.id not in seen]
+        seen.update(folder.id for folder in level)
+        included.append(level)
+        level = [child for folder in level for child in children.get(folder.id, [])]
+        current_depth += 1
     
-    # Convert to tree structure
-    result = []
-    for root in root_folders:
-        tree_node = build_folder_tree(db, root, folder_dict)
-        result.append(tree_node)
+    files = _files_by_folder(db, owner_id, seen, parent_id is None and depth is None)
     
-    return result
+    # Build the nodes bottom-up, so every child is complete before its parent
+    nodes = {}
+    for level in reversed(included):
+        for folder in level:
+            nodes[folder.id] = FolderTree(
+                id=folder.id,
+                name=folder.name,
+                owner_id=folder.owner_id,
+                parent_id=folder.parent_id,
+                size_bytes=folder.size_bytes,
+                file_count=folder.file_count,
+                children=[nodes[child.id] for child in children.get(folder.id, []) if child.id in nodes],
+                files=files.get(folder.id, []),
+                has_children=folder.id in children
+            )
+    return [nodes[folder.id] for folder in included[0]] if included else []
 
-def build_folder_tree(db: Session, folder: Folder, folder_dict: Dict[int, Folder]) -> FolderTree:
-    """
-    Recursively build a folder tree starting from a given folder
-    """
-    # Get all direct children of this folder
-    children = [f for f in folder_dict.values() if f.parent_id == folder.id]
-    
-    # Get all files in this folder
-    files = db.query(File).filter(
-        File.folder_id == folder.id,
+def _files_by_folder(db: Session, owner_id: str, folder_ids: Set[int], all_folders: bool) -> Dict[int, List[FileResponse]]:
+    """Active files of the given folders grouped by folder"""
+    query = db.query(File).filter(
+        File.owner_id == owner_id,
         File.is_deleted == False
-    ).all()
-    
-    # Build child trees recursively
-    child_trees = []
-    for child in children:
-        child_tree = build_folder_tree(db, child, folder_dict)
-        child_trees.append(child_tree)
-    
-    # Create the tree node for this folder
-    tree_node = FolderTree(
-        id=folder.id,
-        name=folder.name,
-        owner_id=folder.owner_id,
-        parent_id=folder.parent_id,
-        children=child_trees,
-        files=files
     )
+    if all_folders:
+        batches = [query.filter(File.folder_id != None)]
+    else:
+        # Only part of the tree is shown: look up just those folders, in batches
+        # that stay below the bound parameter limit
+        ids = sorted(folder_ids)
+        batches = [
+            query.filter(File.folder_id.in_(ids[start:start + TREE_FILES_BATCH_SIZE]))
+            for start in range(0, len(ids), TREE_FILES_BATCH_SIZE)
+        ]
     
-    return tree_node
+    grouped = defaultdict(list)
+    for batch in batches:
+        for db_file in batch.all():
+            grouped[db_file.folder_id].append(FileResponse.model_validate(db_file, from_attributes=True))
+    return grouped
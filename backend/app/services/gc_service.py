@@ -0,0 +1,235 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..models.blob import Blob, BlobReplica
+from ..models.file import File
+from ..models.file_version import Chunk, ChunkOwner, FileVersion
+from ..core.config import settings
+from ..core.database import SessionLocal
+from ..core.storage import storage
+from ..core import storage_io
+from .job_service import enqueue_job, job_handler
+from .replication_service import blob_volumes
+from .user_service import release_space
+from .version_service import release_versions
+
+# Progress of the reaper in this process
+_status = {
+    "running": False,
+    "files_purged": 0,
+    "blobs_reclaimed": 0,
+    "chunks_reclaimed": 0,
+    "bytes_freed": 0,
+    "started_at": None,
+    "finished_at": None
+}
+
+def _deleted_before():
+    return datetime.utcnow() - timedelta(days=settings.GC_DELETED_FILE_RETENTION_DAYS)
+
+def _unreferenced_before():
+    return datetime.utcnow() - timedelta(hours=settings.GC_UNREFERENCED_GRACE_HOURS)
+
+def _expired_files_query(db: Session):
+    # Files deleted before deleted_at existed only have updated_at
+    return db.query(File).filter(
+        File.is_deleted == True,
+        func.coalesce(File.deleted_at, File.updated_at) < _deleted_before()
+    )
+
+def _reclaimable_blobs_query(db: Session):
+    # Rows of deleted files still name their blob until they are purged
+    return db.query(Blob).filter(
+        Blob.ref_count == 0,
+        func.coalesce(Blob.unreferenced_at, Blob.created_at) < _unreferenced_before(),
+        ~db.query(File.id).filter(File.blob_hash == Blob.hash).exists()
+    )
+
+def _reclaimable_chunks_query(db: Session):
+    # Chunks uploaded for a version that was never committed never had a reference
+    return db.query(Chunk).filter(
+        Chunk.ref_count == 0,
+        func.coalesce(Chunk.unreferenced_at, Chunk.created_at) < _unreferenced_before()
+    )
+
+def _move_aside(path: str) -> Optional[str]:
+    """Rename a file out of its storage key so nothing can read it any more.
+    Returns the new path, or None if the file doesn't exist.
+    """
+    trash_path = f"{path}.{uuid.uuid4()}.gc"
+    try:
+        os.rename(path, trash_path)
+    except FileNotFoundError:
+        return None
+    return trash_path
+
+def _put_back(moved: List[tuple]):
+    for path, trash_path in moved:
+        os.replace(trash_path, path)
+
+def _remove_all(moved: List[tuple]) -> int:
+    freed = 0
+    for _, trash_path in moved:
+        freed += os.path.getsize(trash_path)
+        os.remove(trash_path)
+    return freed
+
+async def _reclaim(db: Session, paths: List[str], delete_rows) -> int:
+    """Remove stored bytes whose rows are deleted by delete_rows(), which must only
+    succeed while the content is still unreferenced. The files are moved aside
+    first, so a concurrent upload taking a new reference finds them back in place.
+    Returns the bytes freed.
+    """
+    moved = []
+    for path in paths:
+        trash_path = await storage_io.run_io(_move_aside, path)
+        if trash_path:
+            moved.append((path, trash_path))
+
+    if not delete_rows():
+        db.rollback()
+        await storage_io.run_io(_put_back, moved)
+        return 0
+    db.commit()
+    return await storage_io.run_io(_remove_all, moved)
+
+async def reclaim_blob(db: Session, db_blob: Blob) -> int:
+    """Delete an unreferenced blob and all its copies. Returns the bytes freed."""
+    digest = db_blob.hash
+    paths = [
+        storage.path(db_blob.storage_path, volume)
+        for volume in blob_volumes(db_blob) if volume in storage.volumes
+    ]
+
+    def delete_rows():
+        # Uploads hold the blob by renewing unreferenced_at before they take their reference
+        deleted = db.query(Blob).filter(
+            Blob.hash == digest,
+            Blob.ref_count == 0,
+            func.coalesce(Blob.unreferenced_at, Blob.created_at) < _unreferenced_before()
+        ).delete(synchronize_session=False)
+        if deleted:
+            db.query(BlobReplica).filter(BlobReplica.blob_hash == digest).delete(synchronize_session=False)
+        return deleted
+
+    freed = await _reclaim(db, paths, delete_rows)
+    db.expire_all()
+    return freed
+
+async def reclaim_chunk(db: Session, db_chunk: Chunk) -> int:
+    """Delete an unreferenced chunk. Returns the bytes freed."""
+    digest = db_chunk.hash
+    paths = [storage.path(db_chunk.storage_path, db_chunk.volume)] if (db_chunk.volume or "default") in storage.volumes else []
+
+    def delete_rows():
+        # Versions hold their chunks by renewing unreferenced_at before they take their references
+        deleted = db.query(Chunk).filter(
+            Chunk.hash == digest,
+            Chunk.ref_count == 0,
+            func.coalesce(Chunk.unreferenced_at, Chunk.created_at) < _unreferenced_before()
+        ).delete(synchronize_session=False)
+        if deleted:
+            # Uploads of the chunk no version used give their quota back
+            for owner in db.query(ChunkOwner).filter(ChunkOwner.chunk_hash == digest).all():
+                release_space(db, owner.owner_id, owner.reserved_bytes)
+            db.query(ChunkOwner).filter(ChunkOwner.chunk_hash == digest).delete(synchronize_session=False)
+        return deleted
+
+    freed = await _reclaim(db, paths, delete_rows)
+    db.expire_all()
+    return freed
+
+def _release_versions(db: Session, file_id: str):
+    """Delete the version history of a file and drop its chunk references"""
+    release_versions(db, [row[0] for row in db.query(FileVersion.id).filter(FileVersion.file_id == file_id).all()])
+
+async def purge_file(db: Session, db_file: File) -> int:
+    """Permanently remove a file that was deleted long enough ago.
+    Its blob reference was already released on deletion; the blob itself is
+    reclaimed once no row names it. Returns the bytes freed.
+    """
+    freed = 0
+    if not db_file.blob_hash:
+        # Legacy files own their bytes
+        path = storage.path(db_file.storage_path)
+        try:
+            freed = await storage_io.run_io(os.path.getsize, path)
+        except OSError:
+            pass
+        await storage_io.remove_if_exists(path)
+
+    _release_versions(db, db_file.id)
+    db.query(File).filter(File.id == db_file.id, File.is_deleted == True).delete(synchronize_session=False)
+    db.commit()
+    return freed
+
+async def _in_batches(db: Session, query_factory, key_column, handle, counter: str):
+    """Process the rows of a query in keyset-ordered batches with a pause between them"""
+    after = ""
+    while True:
+        batch = query_factory(db).filter(key_column > after).order_by(key_column).limit(settings.GC_BATCH_SIZE).all()
+        if not batch:
+            break
+        after = getattr(batch[-1], key_column.key)
+        for row in batch:
+            _status["bytes_freed"] += await handle(db, row)
+            _status[counter] += 1
+        # Leave disk bandwidth to regular requests between batches
+        await asyncio.sleep(settings.GC_PAUSE_SECONDS)
+
+async def run_gc():
+    """Purge files deleted more than GC_DELETED_FILE_RETENTION_DAYS ago, then
+    reclaim blobs and chunks nothing has referenced for GC_UNREFERENCED_GRACE_HOURS
+    """
+    if _status["running"]:
+        return
+    _status.update(
+        running=True, files_purged=0, blobs_reclaimed=0, chunks_reclaimed=0, bytes_freed=0,
+        started_at=datetime.utcnow(), finished_at=None
+    )
+    db = SessionLocal()
+    try:
+        await _in_batches(db, _expired_files_query, File.id, purge_file, "files_purged")
+        await _in_batches(db, _reclaimable_blobs_query, Blob.hash, reclaim_blob, "blobs_reclaimed")
+        await _in_batches(db, _reclaimable_chunks_query, Chunk.hash, reclaim_chunk, "chunks_reclaimed")
+        if _status["bytes_freed"]:
+            print(f"Garbage collection freed {_status['bytes_freed']} bytes")
+    finally:
+        db.close()
+        _status.update(running=False, finished_at=datetime.utcnow())
+
+@job_handler("gc")
+async def _gc_job(db: Session, payload: dict):
+    await run_gc()
+
+def schedule_gc(db: Session, owner_id: str = None):
+    """Queue a garbage collection run, unless one is already pending"""
+    return enqueue_job(db, "gc", key="gc", owner_id=owner_id, max_attempts=1)
+
+async def run_gc_periodically():
+    """Queue a garbage collection run every GC_INTERVAL_HOURS"""
+    if settings.GC_INTERVAL_HOURS <= 0:
+        return
+    while True:
+        db = SessionLocal()
+        try:
+            schedule_gc(db)
+        except Exception as e:
+            print(f"Scheduling garbage collection failed: {e}")
+        finally:
+            db.close()
+        await asyncio.sleep(settings.GC_INTERVAL_HOURS * 3600)
+
+def get_gc_status(db: Session) -> dict:
+    return {
+        **_status,
+        "expired_deleted_files": _expired_files_query(db).count(),
+        "reclaimable_blobs": _reclaimable_blobs_query(db).count(),
+        "reclaimable_chunks": _reclaimable_chunks_query(db).count()
+    }
@@ -0,0 +1,255 @@
+import asyncio
+import json
+import random
+import traceback
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..models.job import Job
+from ..core.config import settings
+from ..core.database import SessionLocal
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+# Registered job handlers: kind -> async handler(db, payload)
+_handlers: Dict[str, Callable[[Session, dict], Awaitable[None]]] = {}
+# Worker tasks of this process and the event that wakes them for new jobs
+_workers = set()
+_wakeup: Optional[asyncio.Event] = None
+# Identifies this process in Job.locked_by
+_process_id = uuid.uuid4().hex[:12]
+_last_cleanup = None
+
+def job_handler(kind: str):
+    """Register an async function(db, payload) as the handler of a job kind.
+    Handlers may run more than once for the same job (retries, takeover after
+    a crash), so they must be idempotent.
+    """
+    def register(handler):
+        _handlers[kind] = handler
+        return handler
+    return register
+
+def enqueue_job(
+    db: Session,
+    kind: str,
+    payload: dict = None,
+    key: str = None,
+    owner_id: str = None,
+    max_attempts: int = None
+) -> Job:
+    """Queue a job and return it. With a key, a job that is still queued or
+    running under that key is returned instead of queueing the work twice; a
+    finished one is queued again.
+    """
+    if key:
+        db_job = get_job_by_key(db, key)
+        if db_job:
+            if db_job.status in (JOB_QUEUED, JOB_RUNNING):
+                return db_job
+            return _requeue(db, db_job, payload)
+
+    db_job = Job(
+        id=str(uuid.uuid4()),
+        kind=kind,
+        key=key,
+        payload=json.dumps(payload or {}),
+        owner_id=owner_id,
+        status=JOB_QUEUED,
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+        run_after=datetime.utcnow()
+    )
+    db.add(db_job)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Queued concurrently under the same key
+        db.rollback()
+        return get_job_by_key(db, key)
+    db.refresh(db_job)
+    _wake_workers()
+    return db_job
+
+def _requeue(db: Session, db_job: Job, payload: dict = None) -> Job:
+    updated = db.query(Job).filter(
+        Job.id == db_job.id,
+        Job.status.in_((JOB_SUCCEEDED, JOB_FAILED))
+    ).update({
+        Job.status: JOB_QUEUED,
+        Job.payload: json.dumps(payload or {}),
+        Job.attempts: 0,
+        Job.run_after: datetime.utcnow(),
+        Job.last_error: None,
+        Job.finished_at: None
+    }, synchronize_session=False)
+    db.commit()
+    db.refresh(db_job)
+    if updated:
+        _wake_workers()
+    return db_job
+
+def get_job(db: Session, job_id: str):
+    return db.query(Job).filter(Job.id == job_id).first()
+
+def get_job_by_key(db: Session, key: str):
+    return db.query(Job).filter(Job.key == key).first()
+
+def _wake_workers():
+    if _wakeup is not None:
+        _wakeup.set()
+
+def _claimable(now: datetime):
+    # Due queued jobs, and running jobs whose worker stopped sending heartbeats
+    return or_(
+        and_(Job.status == JOB_QUEUED, Job.run_after <= now),
+        and_(Job.status == JOB_RUNNING, Job.heartbeat_at < now - timedelta(seconds=settings.JOB_LEASE_SECONDS))
+    )
+
+def claim_job(db: Session, worker_id: str) -> Optional[Job]:
+    """Atomically take the next due job, so concurrent workers (also in other
+    processes) never run the same job at once
+    """
+    now = datetime.utcnow()
+    candidates = db.query(Job.id).filter(_claimable(now)).order_by(Job.run_after).limit(10).all()
+    for (job_id,) in candidates:
+        claimed = db.query(Job).filter(Job.id == job_id, _claimable(now)).update({
+            Job.status: JOB_RUNNING,
+            Job.locked_by: worker_id,
+            Job.heartbeat_at: now,
+            Job.attempts: Job.attempts + 1
+        }, synchronize_session=False)
+        db.commit()
+        if claimed:
+            return get_job(db, job_id)
+    return None
+
+def _finish(db: Session, db_job: Job, worker_id: str, values: dict):
+    # A worker that lost its lease must not overwrite the outcome of the takeover
+    db.query(Job).filter(Job.id == db_job.id, Job.locked_by == worker_id).update(
+        values, synchronize_session=False
+    )
+    db.commit()
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter before attempt number attempts + 1"""
+    delay = min(settings.JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1), settings.JOB_RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+async def _heartbeat(job_id: str, worker_id: str):
+    db = SessionLocal()
+    try:
+        while True:
+            await asyncio.sleep(settings.JOB_LEASE_SECONDS / 3)
+            db.query(Job).filter(Job.id == job_id, Job.locked_by == worker_id).update({
+                Job.heartbeat_at: datetime.utcnow()
+            }, synchronize_session=False)
+            db.commit()
+    finally:
+        db.close()
+
+async def run_job(db: Session, db_job: Job, worker_id: str):
+    """Run a claimed job and record its outcome, scheduling a retry on failure"""
+    handler = _handlers.get(db_job.kind)
+    if handler is None:
+        _finish(db, db_job, worker_id, {
+            Job.status: JOB_FAILED,
+            Job.last_error: f"No handler for job kind {db_job.kind}",
+            Job.finished_at: datetime.utcnow()
+        })
+        return
+
+    heartbeat = asyncio.create_task(_heartbeat(db_job.id, worker_id))
+    try:
+        await handler(db, json.loads(db_job.payload or "{}"))
+    except Exception as e:
+        db.rollback()
+        error = "".join(traceback.format_exception_only(type(e), e)).strip()
+        print(f"Job {db_job.id} ({db_job.kind}) attempt {db_job.attempts} failed: {error}")
+        if db_job.attempts >= db_job.max_attempts:
+            _finish(db, db_job, worker_id, {
+                Job.status: JOB_FAILED,
+                Job.last_error: error,
+                Job.finished_at: datetime.utcnow()
+            })
+        else:
+            _finish(db, db_job, worker_id, {
+                Job.status: JOB_QUEUED,
+                Job.last_error: error,
+                Job.run_after: datetime.utcnow() + timedelta(seconds=retry_delay(db_job.attempts))
+            })
+        return
+    finally:
+        heartbeat.cancel()
+
+    _finish(db, db_job, worker_id, {
+        Job.status: JOB_SUCCEEDED,
+        Job.last_error: None,
+        Job.finished_at: datetime.utcnow()
+    })
+
+def cleanup_finished_jobs(db: Session) -> int:
+    """Delete finished jobs past JOB_RETENTION_HOURS"""
+    cutoff = datetime.utcnow() - timedelta(hours=settings.JOB_RETENTION_HOURS)
+    deleted = db.query(Job).filter(
+        Job.status.in_((JOB_SUCCEEDED, JOB_FAILED)),
+        Job.finished_at < cutoff
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+async def _worker(worker_id: str):
+    while True:
+        db = SessionLocal()
+        try:
+            db_job = claim_job(db, worker_id)
+            if db_job:
+                await run_job(db, db_job, worker_id)
+                continue
+        except Exception as e:
+            print(f"Job worker {worker_id} error: {e}")
+        finally:
+            db.close()
+
+        # Nothing due: prune old finished jobs now and then, then sleep until
+        # a job is queued or a retry may be due
+        _cleanup_now_and_then()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), settings.JOB_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+def _cleanup_now_and_then():
+    global _last_cleanup
+    now = datetime.utcnow()
+    if _last_cleanup and now - _last_cleanup < timedelta(hours=1):
+        return
+    _last_cleanup = now
+    db = SessionLocal()
+    try:
+        cleanup_finished_jobs(db)
+    except Exception as e:
+        print(f"Job cleanup failed: {e}")
+    finally:
+        db.close()
+
+async def start_job_workers():
+    """Start JOB_WORKERS workers in this process. Jobs left running by a process
+    that stopped are taken over once their lease expires, so nothing queued is lost.
+    """
+    global _wakeup
+    if _workers:
+        return
+    _wakeup = asyncio.Event()
+    for number in range(settings.JOB_WORKERS):
+        task = asyncio.create_task(_worker(f"{_process_id}-{number}"))
+        _workers.add(task)
+        task.add_done_callback(_workers.discard)
@@ -0,0 +1,137 @@
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+
+from ..models.file import File
+from ..models.folder import Folder
+
+SORT_FIELDS = ("name", "size", "date")
+
+def _sort_columns(sort: str):
+    """Sort column of folders and of files. Each has a partial index on live
+    rows led by (owner_id, parent), so a page is one index range scan.
+    """
+    if sort == "size":
+        # Subtree size of folders, see stats_service
+        return func.coalesce(Folder.size_bytes, 0), File.size_mb
+    if sort == "date":
+        return Folder.updated_at, File.updated_at
+    return Folder.name, File.filename
+
+def _sort_value(row, sort: str):
+    if sort == "size":
+        return (row.size_bytes or 0) if isinstance(row, Folder) else row.size_mb
+    if sort == "date":
+        return row.updated_at.isoformat()
+    return row.name if isinstance(row, Folder) else row.filename
+
+def encode_cursor(sort: str, descending: bool, section: int, row=None) -> str:
+    """Opaque position after row: the sort it belongs to, the section
+    (0 folders, 1 files) and the row's sort value and ID
+    """
+    position = [sort, descending, section]
+    if row is not None:
+        position += [_sort_value(row, sort), row.id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def decode_cursor(cursor: str, sort: str, descending: bool):
+    """(section, (value, id) or None) of a cursor. Raises ValueError for a cursor
+    that is malformed or was issued for another sort order.
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        cursor_sort, cursor_descending, section = position[:3]
+        after = None
+        if len(position) == 5:
+            value, row_id = position[3:]
+            if sort == "date":
+                value = datetime.fromisoformat(value)
+            after = (value, row_id)
+    except (ValueError, TypeError, KeyError, IndexError):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort or cursor_descending != descending or section not in (0, 1):
+        raise ValueError("Cursor belongs to another sort order")
+    return section, after
+
+def mime_type_filter(mime_types: List[str]):
+    """Files matching any of the MIME types; "image/*" or "image/" match a whole type.
+    Prefixes are ranges rather than LIKE, so they can use an index.
+    """
+    conditions = []
+    for mime_type in mime_types:
+        if mime_type.endswith("/*"):
+            mime_type = mime_type[:-1]
+        if mime_type.endswith("/"):
+            upper = mime_type[:-1] + chr(ord(mime_type[-1]) + 1)
+            conditions.append(and_(File.mime_type >= mime_type, File.mime_type < upper))
+        else:
+            conditions.append(File.mime_type == mime_type)
+    return or_(*conditions)
+
+def _page(query, sort_column, id_column, descending: bool, after, limit: int):
+    """Up to limit rows of query following the (value, id) position after"""
+    if after is not None:
+        value, row_id = after
+        if descending:
+            query = query.filter(or_(sort_column < value, and_(sort_column == value, id_column < row_id)))
+        else:
+            query = query.filter(or_(sort_column > value, and_(sort_column == value, id_column > row_id)))
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column, id_column)
+    return query.limit(limit).all()
+
+def list_directory(
+    db: Session,
+    owner_id: str,
+    folder_id: Optional[int] = None,
+    sort: str = "name",
+    descending: bool = False,
+    mime_types: Optional[List[str]] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None
+) -> dict:
+    """One page of a directory: its subfolders first, then its files, both in
+    the requested order. next_cursor continues after the last entry and is None
+    on the last page. With mime_types only matching files are listed.
+    Raises ValueError for an invalid cursor.
+    """
+    folder_column, file_column = _sort_columns(sort)
+    section, after = decode_cursor(cursor, sort, descending) if cursor else (0, None)
+
+    folders = []
+    if section == 0 and not mime_types:
+        folders = _page(
+            db.query(Folder).filter(
+                Folder.owner_id == owner_id,
+                Folder.parent_id == folder_id,
+                Folder.is_deleted == False
+            ),
+            folder_column, Folder.id, descending, after, limit + 1
+        )
+        if len(folders) > limit:
+            folders = folders[:limit]
+            return {"folders": folders, "files": [], "next_cursor": encode_cursor(sort, descending, 0, folders[-1])}
+        after = None
+
+    remaining = limit - len(folders)
+    query = db.query(File).filter(
+        File.owner_id == owner_id,
+        File.folder_id == folder_id,
+        File.is_deleted == False
+    )
+    if mime_types:
+        query = query.filter(mime_type_filter(mime_types))
+    files = _page(query, file_column, File.id, descending, after, remaining + 1)
+
+    next_cursor = None
+    if len(files) > remaining:
+        files = files[:remaining]
+        # A page filled by folders continues with the first file
+        next_cursor = encode_cursor(sort, descending, 1, files[-1] if files else None)
+    return {"folders": folders, "files": files, "next_cursor": next_cursor}
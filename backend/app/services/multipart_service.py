@@ -0,0 +1,270 @@
+import errno
+import hashlib
+import os
+import shutil
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..models.multipart_upload import MultipartUpload, MultipartPart
+from ..models.schemas import FileCreate, MultipartUploadCreate
+from ..core.config import settings
+from ..core import storage_io
+from ..core.storage import storage
+from .blob_service import write_temp_blob, commit_blob, new_temp_path
+from .file_service import create_file, build_public_url
+from .thumbnail_service import schedule_thumbnails
+from .user_service import require_space, release_space
+
+MULTIPART_DIR = "multipart"
+COPY_BLOCK_SIZE = 64 * 1024 * 1024  # 64 MB per copy_file_range call
+HASH_BLOCK_SIZE = 8 * 1024 * 1024  # 8 MB
+STORE_PART_ATTEMPTS = 3
+
+def part_key(upload_id: str, part_number: int) -> str:
+    """Storage key of one upload of a part. Every upload gets its own file, so
+    concurrent uploads of the same part number never overwrite each other.
+    """
+    return os.path.join(MULTIPART_DIR, upload_id, f"{part_number:05d}.{uuid.uuid4().hex}")
+
+def create_multipart_upload(db: Session, upload_data: MultipartUploadCreate, owner_id: str):
+    """Start a multipart upload whose parts can be sent concurrently"""
+    db_upload = MultipartUpload(
+        id=str(uuid.uuid4()),
+        owner_id=owner_id,
+        filename=upload_data.filename,
+        folder_id=upload_data.folder_id,
+        is_public=upload_data.is_public,
+        mime_type=upload_data.mime_type,
+        expires_at=datetime.utcnow() + timedelta(hours=settings.MULTIPART_UPLOAD_TTL_HOURS)
+    )
+    db.add(db_upload)
+    db.commit()
+    db.refresh(db_upload)
+    return db_upload
+
+def get_multipart_upload(db: Session, upload_id: str):
+    """Get a multipart upload by its ID, ignoring expired uploads"""
+    return db.query(MultipartUpload).filter(
+        MultipartUpload.id == upload_id,
+        MultipartUpload.expires_at > datetime.utcnow()
+    ).first()
+
+def get_part(db: Session, upload_id: str, part_number: int):
+    return db.query(MultipartPart).filter(
+        MultipartPart.upload_id == upload_id,
+        MultipartPart.part_number == part_number
+    ).first()
+
+def get_uploaded_bytes(db: Session, upload_id: str, exclude_part: int = None) -> int:
+    """Total size of the parts received so far for an upload"""
+    query = db.query(func.coalesce(func.sum(MultipartPart.size_bytes), 0)).filter(
+        MultipartPart.upload_id == upload_id
+    )
+    if exclude_part is not None:
+        query = query.filter(MultipartPart.part_number != exclude_part)
+    return int(query.scalar())
+
+def _record_part(db: Session, db_upload: MultipartUpload, part_number: int, size: int,
+                 digest: str, key: str, volume: str) -> Optional[MultipartPart]:
+    """Make a stored part file the current upload of its part number, holding
+    its space net of the part it replaces. One transaction: the reservation
+    and the row commit together or not at all. Returns the replaced part's
+    row as it was, or None. Raises QuotaExceededError if the space isn't
+    available.
+    """
+    for attempt in range(STORE_PART_ATTEMPTS):
+        db_part = get_part(db, db_upload.id, part_number)
+        replaced = None
+        if db_part:
+            replaced = MultipartPart(storage_path=db_part.storage_path, volume=db_part.volume, size_bytes=db_part.size_bytes)
+        delta = size - (replaced.size_bytes if replaced else 0)
+        require_space(db, db_upload.owner_id, delta)
+        if delta < 0:
+            release_space(db, db_upload.owner_id, -delta)
+
+        values = {"size_bytes": size, "sha256": digest, "storage_path": key, "volume": volume, "created_at": datetime.utcnow()}
+        try:
+            if replaced:
+                # Only replaces the part that was read, a concurrent upload of it retries
+                updated = db.query(MultipartPart).filter(
+                    MultipartPart.upload_id == db_upload.id,
+                    MultipartPart.part_number == part_number,
+                    MultipartPart.storage_path == replaced.storage_path
+                ).update(values, synchronize_session=False)
+                if not updated:
+                    db.rollback()
+                    continue
+            else:
+                db.add(MultipartPart(upload_id=db_upload.id, part_number=part_number, **values))
+            db.commit()
+            return replaced
+        except IntegrityError:
+            # The same part number was inserted concurrently; the rollback gives the space back
+            db.rollback()
+    raise ValueError(f"Part {part_number} is being uploaded concurrently")
+
+async def store_part(
+    db: Session,
+    db_upload: MultipartUpload,
+    part_number: int,
+    chunks: AsyncIterator[bytes],
+    max_bytes: int
+) -> MultipartPart:
+    """Receive one part. Uploading the same part number again replaces it.
+    Received parts hold their space against the owner's quota until the upload
+    completes or is aborted. Raises ValueError as soon as more than max_bytes
+    arrive and QuotaExceededError if the part doesn't fit into the quota.
+    """
+    temp_path, digest, size = await write_temp_blob(chunks, max_bytes)
+    key = part_key(db_upload.id, part_number)
+    volume = await storage.put(temp_path, key)
+
+    # The space is held once the part is stored, since no transaction may stay
+    # open while waiting for the disk
+    try:
+        replaced = _record_part(db, db_upload, part_number, size, digest, key, volume)
+    except BaseException:
+        await storage.delete(key, volume)
+        raise
+    if replaced:
+        await storage.delete(replaced.storage_path, replaced.volume)
+
+    db.expire_all()
+    return get_part(db, db_upload.id, part_number)
+
+def _hash_part(source, hasher, length: int):
+    """Feed the next length bytes of source to hasher"""
+    while length > 0:
+        data = source.read(min(HASH_BLOCK_SIZE, length))
+        if not data:
+            break
+        hasher.update(data)
+        length -= len(data)
+
+def _concatenate(part_paths: List[str], target_path: str) -> str:
+    """Append the parts to the target file inside the kernel where possible.
+    Returns the SHA-256 of the assembled content: each part is hashed right
+    after it was copied, while it is still in the page cache.
+    Blocking, run it on the I/O pool.
+    """
+    hasher = hashlib.sha256()
+    with open(target_path, "wb") as target:
+        for path in part_paths:
+            with open(path, "rb") as source:
+                size = os.fstat(source.fileno()).st_size
+                # copy_file_range writes at the descriptor offset, behind the buffer of earlier fallbacks
+                target.flush()
+                copied = 0
+                if hasattr(os, "copy_file_range"):
+                    try:
+                        while copied < size:
+                            n = os.copy_file_range(source.fileno(), target.fileno(), min(COPY_BLOCK_SIZE, size - copied))
+                            if n == 0:
+                                break
+                            copied += n
+                    except OSError as e:
+                        # Parts on another volume or a filesystem without copy_file_range support
+                        if e.errno not in (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                            raise
+                source.seek(0)
+                _hash_part(source, hasher, copied)
+                # The rest goes through Python, hashed on the way
+                while True:
+                    data = source.read(HASH_BLOCK_SIZE)
+                    if not data:
+                        break
+                    hasher.update(data)
+                    target.write(data)
+    return hasher.hexdigest()
+
+async def complete_multipart_upload(
+    db: Session,
+    db_upload: MultipartUpload,
+    parts: List[MultipartPart],
+    public_url_base: str
+):
+    """Assemble the listed parts into one blob and register the file"""
+    size = sum(part.size_bytes for part in parts)
+    temp_path = await new_temp_path(size)
+    try:
+        digest = await storage_io.run_io(_concatenate, [storage.path(part.storage_path, part.volume) for part in parts], temp_path)
+    except BaseException:
+        await storage_io.remove_if_exists(temp_path)
+        raise
+
+    # Stored under the content hash, so it deduplicates however the parts were split
+    db_blob = await commit_blob(db, temp_path, digest, size, db_upload.mime_type)
+
+    file_id = str(uuid.uuid4())
+    public_url = None
+    if db_upload.is_public:
+        public_url = build_public_url(public_url_base, file_id)
+
+    file_data = FileCreate(
+        filename=db_upload.filename,
+        folder_id=db_upload.folder_id,
+        is_public=db_upload.is_public
+    )
+    owner_id = db_upload.owner_id
+    mime_type = db_upload.mime_type
+    upload_id = db_upload.id
+
+    # The space held by the parts becomes the file's in one transaction
+    if not _discard_multipart_upload(db, db_upload):
+        db.rollback()
+        raise ValueError("Multipart upload was completed or aborted concurrently")
+
+    db_file = create_file(
+        db=db,
+        file=file_data,
+        owner_id=owner_id,
+        storage_path=db_blob.storage_path,
+        size_mb=size / (1024 * 1024),
+        mime_type=mime_type,
+        public_url=public_url,
+        file_id=file_id,
+        blob_hash=db_blob.hash
+    )
+    await _remove_parts(upload_id)
+    schedule_thumbnails(db, db_file)
+    return db_file
+
+def _discard_multipart_upload(db: Session, db_upload: MultipartUpload) -> bool:
+    """Delete an upload with its parts and release their space, without commit.
+    False if a concurrent complete or abort got there first.
+    """
+    held = get_uploaded_bytes(db, db_upload.id)
+    db.query(MultipartPart).filter(MultipartPart.upload_id == db_upload.id).delete(synchronize_session=False)
+    deleted = db.query(MultipartUpload).filter(MultipartUpload.id == db_upload.id).delete(synchronize_session=False)
+    if deleted:
+        release_space(db, db_upload.owner_id, held)
+    return deleted == 1
+
+async def _remove_parts(upload_id: str):
+    # Parts may be spread over several volumes
+    for volume in storage.volumes.values():
+        await storage_io.run_io(
+            shutil.rmtree, volume.path(os.path.join(MULTIPART_DIR, upload_id)), ignore_errors=True
+        )
+
+async def abort_multipart_upload(db: Session, db_upload: MultipartUpload):
+    """Discard a multipart upload and all its parts"""
+    upload_id = db_upload.id
+    _discard_multipart_upload(db, db_upload)
+    db.commit()
+    await _remove_parts(upload_id)
+    return True
+
+async def cleanup_expired_multipart_uploads(db: Session):
+    """Remove expired multipart uploads and their parts"""
+    expired = db.query(MultipartUpload).filter(
+        MultipartUpload.expires_at <= datetime.utcnow()
+    ).all()
+    for db_upload in expired:
+        await abort_multipart_upload(db, db_upload)
+    return len(expired)
@@ -0,0 +1,211 @@
+"""
+Reconciliation of the quota ledger.
+
+User.used_bytes and User.reserved_bytes are kept up to date by atomic
+increments (see user_service). This module seeds them for users created
+before byte accounting and repairs drift, such as from operations
+interrupted between the file and the ledger update, a few users at a time:
+every run checks the next QUOTA_RECONCILE_BATCH_SIZE users, so the whole
+table is never scanned at once.
+
+The file and folder counters of users and the subtree sizes of folders
+(see stats_service) are recounted by the rebuild_stats job, queued at
+startup while counters are missing and by administrators.
+"""
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import BigInteger, and_, cast, func, select
+from sqlalchemy.orm import Session
+
+from ..models.blob import Blob
+from ..models.file import File
+from ..models.file_version import ChunkOwner
+from ..models.folder import Folder
+from ..models.multipart_upload import MultipartUpload, MultipartPart
+from ..models.upload_reservation import UploadReservation
+from ..models.upload_session import UploadSession
+from ..models.user import User
+from ..core.config import settings
+from ..core.database import SessionLocal
+from .file_service import charged_bytes_expression
+from .job_service import enqueue_job, job_handler
+from .stats_service import ancestor_ids
+from .upload_service import cleanup_expired_reservations, cleanup_expired_sessions
+from .multipart_service import cleanup_expired_multipart_uploads
+from .version_service import cleanup_expired_chunk_uploads
+
+# Position and results of reconciliation in this process
+_status = {"after_id": 0, "users_checked": 0, "users_fixed": 0, "last_run_at": None}
+
+def seed_used_bytes(db: Session) -> int:
+    """Initialize the ledger of users from the MB figure kept before byte accounting"""
+    seeded = db.query(User).filter(User.used_bytes == None).update({
+        User.used_bytes: cast(func.round(func.coalesce(User.legacy_used_space, 0) * 1024 * 1024), BigInteger),
+        User.reserved_bytes: 0
+    }, synchronize_session=False)
+    db.query(User).filter(User.reserved_bytes == None).update({
+        User.reserved_bytes: 0
+    }, synchronize_session=False)
+    db.commit()
+    return seeded
+
+def _actual_used(owner_id):
+    return select(func.coalesce(func.sum(charged_bytes_expression()), 0)).select_from(File).outerjoin(
+        Blob, Blob.hash == File.blob_hash
+    ).where(
+        File.owner_id == owner_id,
+        File.is_deleted == False
+    ).scalar_subquery()
+
+def _actual_reserved(owner_id):
+    # Every row that still exists holds its space, expired or not, until it is cleaned up
+    reservations = select(func.coalesce(func.sum(UploadReservation.size_bytes), 0)).where(
+        UploadReservation.owner_id == owner_id
+    ).scalar_subquery()
+    sessions = select(func.coalesce(func.sum(UploadSession.total_size), 0)).where(
+        UploadSession.owner_id == owner_id
+    ).scalar_subquery()
+    parts = select(func.coalesce(func.sum(MultipartPart.size_bytes), 0)).join(
+        MultipartUpload, MultipartUpload.id == MultipartPart.upload_id
+    ).where(
+        MultipartUpload.owner_id == owner_id
+    ).scalar_subquery()
+    chunks = select(func.coalesce(func.sum(ChunkOwner.reserved_bytes), 0)).where(
+        ChunkOwner.owner_id == owner_id
+    ).scalar_subquery()
+    return reservations + sessions + parts + chunks
+
+def reconcile_users(db: Session, after_id: int = 0, limit: int = None) -> int:
+    """Correct the ledger of the next `limit` users with an id above after_id.
+    Returns the last id checked, or 0 when the end of the table was reached.
+    """
+    limit = limit or settings.QUOTA_RECONCILE_BATCH_SIZE
+    # Recorded and actual figures come from one statement, so they describe the same moment
+    rows = db.query(
+        User.id,
+        User.telegram_id,
+        User.used_bytes,
+        User.reserved_bytes,
+        _actual_used(User.telegram_id),
+        _actual_reserved(User.telegram_id)
+    ).filter(User.id > after_id).order_by(User.id).limit(limit).all()
+
+    for user_id, telegram_id, used, reserved, actual_used, actual_reserved in rows:
+        _status["users_checked"] += 1
+        used_drift = int(actual_used) - (used or 0)
+        reserved_drift = int(actual_reserved) - (reserved or 0)
+        if not used_drift and not reserved_drift:
+            continue
+        print(f"Quota of user {telegram_id} drifted by {used_drift} used and {reserved_drift} reserved bytes")
+        # Apply the difference rather than the total, so changes committed since the read are kept
+        db.query(User).filter(User.id == user_id).update({
+            User.used_bytes: func.coalesce(User.used_bytes, 0) + used_drift,
+            User.reserved_bytes: func.coalesce(User.reserved_bytes, 0) + reserved_drift
+        }, synchronize_session=False)
+        _status["users_fixed"] += 1
+    db.commit()
+
+    _status["last_run_at"] = datetime.utcnow()
+    if len(rows) < limit:
+        return 0
+    return rows[-1][0]
+
+@job_handler("reconcile_quota")
+async def _reconcile_job(db: Session, payload: dict):
+    # Abandoned uploads give their space back first, so it isn't held until the next upload
+    cleanup_expired_reservations(db)
+    await cleanup_expired_sessions(db)
+    await cleanup_expired_multipart_uploads(db)
+    cleanup_expired_chunk_uploads(db)
+    _status["after_id"] = reconcile_users(db, payload.get("after_id", 0))
+
+def rebuild_stats(db: Session, owner_id: str):
+    """Recount the file and folder counters of a user and the sizes of their folders"""
+    live_files = and_(File.owner_id == owner_id, File.is_deleted == False)
+    db.query(User).filter(User.telegram_id == owner_id).update({
+        User.file_count: select(func.count(File.id)).where(live_files).scalar_subquery(),
+        User.public_file_count: select(func.count(File.id)).where(live_files, File.is_public == True).scalar_subquery(),
+        User.folder_count: select(func.count(Folder.id)).where(
+            Folder.owner_id == owner_id,
+            Folder.is_deleted == False
+        ).scalar_subquery()
+    }, synchronize_session=False)
+
+    # Sum the files of each folder into the folder and all folders above it
+    actual = {}
+    folders = db.query(Folder.id, Folder.path, Folder.size_bytes, Folder.file_count).filter(
+        Folder.owner_id == owner_id
+    ).all()
+    paths = {folder_id: path for folder_id, path, _, _ in folders}
+    direct = db.query(File.folder_id, func.count(File.id), func.sum(charged_bytes_expression())).outerjoin(
+        Blob, Blob.hash == File.blob_hash
+    ).filter(live_files, File.folder_id != None).group_by(File.folder_id).all()
+    for folder_id, count, size in direct:
+        if not paths.get(folder_id):
+            continue
+        for ancestor_id in ancestor_ids(paths[folder_id]):
+            totals = actual.setdefault(ancestor_id, [0, 0])
+            totals[0] += int(size or 0)
+            totals[1] += count
+
+    fixed = 0
+    for folder_id, _, size, count in folders:
+        actual_size, actual_count = actual.get(folder_id, (0, 0))
+        size_drift = actual_size - (size or 0)
+        count_drift = actual_count - (count or 0)
+        if size is not None and count is not None and not size_drift and not count_drift:
+            continue
+        # Apply the difference, so increments committed since the read are kept
+        db.query(Folder).filter(Folder.id == folder_id).update({
+            Folder.size_bytes: func.coalesce(Folder.size_bytes, 0) + size_drift,
+            Folder.file_count: func.coalesce(Folder.file_count, 0) + count_drift
+        }, synchronize_session=False)
+        fixed += 1
+    db.commit()
+    return fixed
+
+@job_handler("rebuild_stats")
+async def _rebuild_stats_job(db: Session, payload: dict):
+    owner_id = payload.get("owner_id")
+    if owner_id:
+        owner_ids = [owner_id]
+    else:
+        owner_ids = [row[0] for row in db.query(User.telegram_id).order_by(User.id).all()]
+    fixed = 0
+    for owner_id in owner_ids:
+        fixed += rebuild_stats(db, owner_id)
+        # Let requests use the database between users
+        await asyncio.sleep(0)
+    print(f"Stats rebuilt for {len(owner_ids)} users, {fixed} folders corrected")
+
+def schedule_stats_rebuild(db: Session, owner_id: str = None, requested_by: str = None):
+    """Queue a rebuild of the counters of one user, or of all users"""
+    return enqueue_job(
+        db, "rebuild_stats", {"owner_id": owner_id},
+        key=f"rebuild_stats:{owner_id or '*'}", owner_id=requested_by, max_attempts=1
+    )
+
+def seed_stats(db: Session):
+    """Queue a rebuild of all counters while some were never counted"""
+    missing_users = db.query(User.id).filter(User.file_count == None).first()
+    missing_folders = db.query(Folder.id).filter(Folder.size_bytes == None).first()
+    if missing_users or missing_folders:
+        schedule_stats_rebuild(db)
+
+async def run_quota_reconciliation():
+    """Queue the reconciliation of the next batch of users every QUOTA_RECONCILE_INTERVAL_MINUTES"""
+    if settings.QUOTA_RECONCILE_INTERVAL_MINUTES <= 0:
+        return
+    while True:
+        db = SessionLocal()
+        try:
+            enqueue_job(db, "reconcile_quota", {"after_id": _status["after_id"]}, key="reconcile_quota", max_attempts=1)
+        except Exception as e:
+            print(f"Scheduling quota reconciliation failed: {e}")
+        finally:
+            db.close()
+        await asyncio.sleep(settings.QUOTA_RECONCILE_INTERVAL_MINUTES * 60)
+
+def get_quota_status() -> dict:
+    return dict(_status)
@@ -0,0 +1,144 @@
+import random
+from typing import List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..models.blob import Blob, BlobReplica
+from ..core.config import settings
+from ..core.database import SessionLocal
+from ..core.storage import storage, DEFAULT_VOLUME, StorageFullError
+from ..core import storage_io
+from .blob_service import get_blob, new_temp_path
+from .job_service import enqueue_job, job_handler
+
+def blob_volumes(db_blob: Blob) -> List[str]:
+    """Volumes holding a copy of a blob, the primary copy first"""
+    return [db_blob.volume or DEFAULT_VOLUME] + [replica.volume for replica in db_blob.replicas]
+
+def _volume_load(volumes: List[str]) -> dict:
+    # Volumes removed from the configuration can't be read at all
+    return {
+        name: storage.volumes[name].inflight() if name in storage.volumes else None
+        for name in volumes
+    }
+
+async def locate_blob(db: Session, db_blob: Blob) -> Optional[str]:
+    """Filesystem path of the least busy copy of a blob that is present on disk.
+    Copies found missing are dropped and replaced in the background.
+    """
+    volumes = blob_volumes(db_blob)
+    # Shuffle first so equally busy disks share the reads
+    random.shuffle(volumes)
+    load = await storage_io.run_io(_volume_load, volumes)
+    healthy = sorted((name for name in volumes if load[name] is not None), key=load.get)
+
+    missing = [name for name in volumes if load[name] is None]
+    for name in healthy:
+        path = storage.path(db_blob.storage_path, name)
+        if await storage_io.exists(path):
+            if missing:
+                _drop_lost_copies(db, db_blob, missing, name)
+            return path
+        missing.append(name)
+    return None
+
+def _drop_lost_copies(db: Session, db_blob: Blob, missing: List[str], present: str):
+    """Forget copies that are gone from disk and restore the replication factor"""
+    print(f"Blob {db_blob.hash}: copies missing on {', '.join(missing)}")
+    if (db_blob.volume or DEFAULT_VOLUME) in missing:
+        # Promote a surviving replica to be the primary copy
+        db_blob.volume = present
+        missing = missing + [present]
+    db.query(BlobReplica).filter(
+        BlobReplica.blob_hash == db_blob.hash,
+        BlobReplica.volume.in_(missing)
+    ).delete(synchronize_session=False)
+    db.commit()
+    db.refresh(db_blob)
+    schedule_replication(db, db_blob.hash)
+
+async def replicate_blob(db: Session, digest: str) -> int:
+    """Copy a blob to other volumes until it has STORAGE_REPLICATION_FACTOR copies.
+    Returns the number of copies made; stops early if no other volume has room.
+    """
+    db_blob = get_blob(db, digest)
+    if not db_blob:
+        return 0
+
+    made = 0
+    while len(blob_volumes(db_blob)) < settings.STORAGE_REPLICATION_FACTOR:
+        source = await locate_blob(db, db_blob)
+        if not source:
+            print(f"Blob {digest}: no copy left to replicate from")
+            break
+        try:
+            temp_path = await new_temp_path(db_blob.size_bytes, exclude=blob_volumes(db_blob))
+        except StorageFullError:
+            break
+        try:
+            await storage_io.copy(source, temp_path)
+        except OSError as e:
+            await storage_io.remove_if_exists(temp_path)
+            print(f"Blob {digest}: replication failed: {e}")
+            break
+        volume = await storage.put(temp_path, db_blob.storage_path)
+
+        db.add(BlobReplica(blob_hash=digest, volume=volume))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Replicated concurrently to the same volume, the bytes are identical
+            db.rollback()
+        db.refresh(db_blob)
+        made += 1
+    return made
+
+@job_handler("replicate_blob")
+async def _replicate_job(db: Session, payload: dict):
+    await replicate_blob(db, payload["hash"])
+
+def schedule_replication(db: Session, digest: str):
+    """Queue the replication of a blob so it doesn't delay the current request.
+    Does nothing without replication.
+    """
+    if settings.STORAGE_REPLICATION_FACTOR <= 1 or len(storage.volumes) <= 1:
+        return
+    enqueue_job(db, "replicate_blob", {"hash": digest}, key=f"replicate_blob:{digest}")
+
+def get_under_replicated_blobs(db: Session, limit: int = 100, after_hash: str = ""):
+    """Referenced blobs with fewer copies than the replication factor, in hash order"""
+    copies = func.count(BlobReplica.volume) + 1
+    return db.query(Blob.hash).outerjoin(
+        BlobReplica, BlobReplica.blob_hash == Blob.hash
+    ).filter(
+        Blob.ref_count > 0,
+        Blob.hash > after_hash
+    ).group_by(Blob.hash).having(
+        copies < settings.STORAGE_REPLICATION_FACTOR
+    ).order_by(Blob.hash).limit(limit).all()
+
+async def run_replication_repair():
+    """Background pass bringing every blob up to the replication factor,
+    e.g. after replication was enabled, a volume was added or a restart
+    interrupted pending copies.
+    """
+    if settings.STORAGE_REPLICATION_FACTOR <= 1 or len(storage.volumes) <= 1:
+        return
+    db = SessionLocal()
+    try:
+        after_hash, repaired = "", 0
+        while True:
+            batch = get_under_replicated_blobs(db, after_hash=after_hash)
+            if not batch:
+                break
+            for (digest,) in batch:
+                repaired += await replicate_blob(db, digest)
+            after_hash = batch[-1][0]
+        if repaired:
+            print(f"Replication repair finished: {repaired} copies made")
+    except Exception as e:
+        print(f"Replication repair stopped: {e}")
+    finally:
+        db.close()
@@ -0,0 +1,172 @@
+"""
+Search of file and folder names.
+
+The names are indexed by the FTS5 tables files_fts and folders_fts, which
+schema migration 3 creates together with triggers that update them when
+entries are created, renamed or removed from the database, so the index is
+always in the transaction of the change. Entries in the trash stay indexed
+until they are purged and are left out by the join with their table.
+
+files_fts refers to the implicit rowid of files, which VACUUM may renumber;
+rebuild the index afterwards with the rebuild_search_index job.
+"""
+import base64
+import json
+import re
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import and_, column, func, literal_column, or_, table, text
+from sqlalchemy.orm import Session
+
+from ..models.file import File
+from ..models.folder import Folder
+from .job_service import enqueue_job, job_handler
+from .listing_service import mime_type_filter
+
+files_fts = table("files_fts", column("rowid"))
+folders_fts = table("folders_fts", column("rowid"))
+
+MB = 1024 * 1024
+
+def match_expression(query: str, name_column: str, owner_id: str, prefix: bool = True) -> Optional[str]:
+    """FTS5 query for entries of owner_id whose name contains every word of
+    query, as a word or, with prefix, as the start of one. None if query has
+    no words. Words are quoted, so FTS5 syntax in query is searched literally.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    owner = owner_id.replace('"', '""')
+    terms = [f'{name_column} : "{word}"{"*" if prefix else ""}' for word in words]
+    return " AND ".join([f'owner_id : "{owner}"'] + terms)
+
+def _rank(index_name: str):
+    # bm25 weighted by the name alone: the owner column matches every entry
+    return func.bm25(literal_column(index_name), 1.0, 0.0)
+
+def encode_cursor(query: str, section: int, score: float = None, row_id=None) -> str:
+    """Opaque position after an entry: the query it belongs to, the section
+    (0 folders, 1 files) and the entry's rank and ID
+    """
+    position = [query, section]
+    if row_id is not None:
+        position += [score, row_id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def decode_cursor(cursor: str, query: str):
+    """(section, (score, id) or None) of a cursor. Raises ValueError for a cursor
+    that is malformed or was issued for another query.
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        cursor_query, section = position[:2]
+        after = tuple(position[2:4]) if len(position) == 4 else None
+    except (ValueError, TypeError, KeyError, IndexError):
+        raise ValueError("Invalid cursor")
+    if cursor_query != query or section not in (0, 1):
+        raise ValueError("Cursor belongs to another query")
+    return section, after
+
+def _page(query, rank, id_column, after, limit: int):
+    """Up to limit (entry, score) rows of query, best match first, following
+    the (score, id) position after. bm25 scores are lower for better matches.
+    """
+    if after is not None:
+        score, row_id = after
+        query = query.filter(or_(rank > score, and_(rank == score, id_column > row_id)))
+    return query.order_by(rank, id_column).limit(limit).all()
+
+def search(
+    db: Session,
+    owner_id: str,
+    query: str,
+    prefix: bool = True,
+    mime_types: Optional[List[str]] = None,
+    min_size: Optional[int] = None,
+    max_size: Optional[int] = None,
+    modified_after: Optional[datetime] = None,
+    modified_before: Optional[datetime] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None
+) -> dict:
+    """One page of the folders and files of owner_id whose names match query,
+    folders first, each ranked by relevance. Sizes are in bytes and dates
+    compare with the time of the last change. The filters apply to files;
+    with any of them folders are left out. next_cursor continues after the
+    last entry and is None on the last page. Raises ValueError for a query
+    without words or an invalid cursor.
+    """
+    if not re.search(r"\w", query):
+        raise ValueError("Search query must contain a letter or digit")
+    section, after = decode_cursor(cursor, query) if cursor else (0, None)
+    filtered = mime_types or min_size is not None or max_size is not None \
+        or modified_after is not None or modified_before is not None
+
+    folders = []
+    if section == 0 and not filtered:
+        rank = _rank("folders_fts")
+        rows = _page(
+            db.query(Folder, rank)
+            .select_from(folders_fts)
+            .join(Folder, Folder.id == folders_fts.c.rowid)
+            .filter(text("folders_fts MATCH :folders_match"), Folder.is_deleted == False)
+            .params(folders_match=match_expression(query, "name", owner_id, prefix)),
+            rank, Folder.id, after, limit + 1
+        )
+        if len(rows) > limit:
+            rows = rows[:limit]
+            folder, score = rows[-1]
+            return {
+                "folders": [row[0] for row in rows], "files": [],
+                "next_cursor": encode_cursor(query, 0, score, folder.id)
+            }
+        folders = [row[0] for row in rows]
+        after = None
+
+    remaining = limit - len(folders)
+    rank = _rank("files_fts")
+    files_query = db.query(File, rank) \
+        .select_from(files_fts) \
+        .join(File, literal_column("files.rowid") == files_fts.c.rowid) \
+        .filter(text("files_fts MATCH :files_match"), File.is_deleted == False) \
+        .params(files_match=match_expression(query, "filename", owner_id, prefix))
+    if mime_types:
+        files_query = files_query.filter(mime_type_filter(mime_types))
+    if min_size is not None:
+        files_query = files_query.filter(File.size_mb >= min_size / MB)
+    if max_size is not None:
+        files_query = files_query.filter(File.size_mb <= max_size / MB)
+    if modified_after is not None:
+        files_query = files_query.filter(File.updated_at >= modified_after)
+    if modified_before is not None:
+        files_query = files_query.filter(File.updated_at < modified_before)
+    rows = _page(files_query, rank, File.id, after, remaining + 1)
+
+    next_cursor = None
+    if len(rows) > remaining:
+        rows = rows[:remaining]
+        if rows:
+            file, score = rows[-1]
+            next_cursor = encode_cursor(query, 1, score, file.id)
+        else:
+            # A page filled by folders continues with the best file
+            next_cursor = encode_cursor(query, 1)
+    return {"folders": folders, "files": [row[0] for row in rows], "next_cursor": next_cursor}
+
+def rebuild_search_index(db: Session):
+    """Re-read all names into the search index"""
+    for index_name in ("files_fts", "folders_fts"):
+        db.execute(text(f"INSERT INTO {index_name} ({index_name}) VALUES ('rebuild')"))
+    db.commit()
+
+@job_handler("rebuild_search_index")
+async def _rebuild_search_index_job(db: Session, payload: dict):
+    rebuild_search_index(db)
+    print("Search index rebuilt")
+
+def schedule_search_index_rebuild(db: Session, requested_by: str = None):
+    """Queue a rebuild of the search index"""
+    return enqueue_job(
+        db, "rebuild_search_index", {}, key="rebuild_search_index", owner_id=requested_by, max_attempts=1
+    )
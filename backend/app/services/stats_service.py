@@ -0,0 +1,54 @@
+"""
+Incrementally maintained counters.
+
+Users count their live files, public files and folders; folders carry the
+charged size and number of the live files in their whole subtree. The
+helpers here are atomic increments without commit, so they land in the
+caller's transaction together with the change they account for, like
+user_service.charge_space. quota_service rebuilds them from scratch.
+"""
+from typing import List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..models.folder import Folder
+from ..models.user import User
+
+def ancestor_ids(path: str) -> List[int]:
+    """IDs in a folder's materialized path, from the root down to the folder itself"""
+    return [int(part) for part in path.strip("/").split("/") if part]
+
+def count_files(db: Session, telegram_id: str, files: int = 0, public: int = 0):
+    """Add to a user's live and public file counters"""
+    if files or public:
+        db.query(User).filter(User.telegram_id == telegram_id).update({
+            User.file_count: func.coalesce(User.file_count, 0) + files,
+            User.public_file_count: func.coalesce(User.public_file_count, 0) + public
+        }, synchronize_session=False)
+
+def count_folders(db: Session, telegram_id: str, delta: int):
+    """Add to a user's live folder counter"""
+    if delta:
+        db.query(User).filter(User.telegram_id == telegram_id).update({
+            User.folder_count: func.coalesce(User.folder_count, 0) + delta
+        }, synchronize_session=False)
+
+def charge_folders(db: Session, folder_id: Optional[int], size_delta: int, count_delta: int = 0):
+    """Add to the size and file count of a folder and every folder above it.
+    Files in the root belong to no folder.
+    """
+    if folder_id is None or not (size_delta or count_delta):
+        return
+    path = db.query(Folder.path).filter(Folder.id == folder_id).scalar()
+    if not path:
+        return
+    db.query(Folder).filter(Folder.id.in_(ancestor_ids(path))).update({
+        Folder.size_bytes: func.coalesce(Folder.size_bytes, 0) + size_delta,
+        Folder.file_count: func.coalesce(Folder.file_count, 0) + count_delta
+    }, synchronize_session=False)
+
+def count_file(db: Session, owner_id: str, folder_id: Optional[int], is_public: bool, size: int, sign: int = 1):
+    """Count a file that was created (sign 1) or deleted (sign -1) in all counters"""
+    count_files(db, owner_id, sign, sign if is_public else 0)
+    charge_folders(db, folder_id, sign * size, sign)
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import shutil
+
+from sqlalchemy.orm import Session
+
+from ..models.file import File
+from ..core.config import settings
+from ..core.database import SessionLocal
+from ..core.storage import storage
+from ..core import storage_io
+from .blob_service import hash_file, new_temp_path, commit_blob, drop_blob_references
+from .file_service import charged_bytes
+from .replication_service import schedule_replication
+from .stats_service import charge_folders
+from .user_service import charge_space
+
+# State of the background migration in this process
+_status = {"running": False, "migrated": 0, "missing": 0}
+
+def _link_or_copy(source: str, target: str):
+    """Hard link a legacy file to a temporary path; the original stays in place
+    until the database points at the blob, so an interrupted migration loses nothing.
+    """
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+def count_legacy_files(db: Session) -> int:
+    """Files still stored in the flat private_files/public_files directories"""
+    return db.query(File).filter(File.blob_hash == None).count()
+
+async def migrate_file(db: Session, db_file: File) -> bool:
+    """Move one legacy file into the sharded blob store and repoint its row.
+    Returns False if the file is missing on disk or was migrated concurrently.
+    """
+    old_path = db_file.storage_path
+    source = storage.path(old_path)
+    if not await storage_io.exists(source):
+        return False
+
+    digest, size = await storage_io.run_io(hash_file, source)
+    # Link within the source's volume; legacy paths outside every volume are copied
+    try:
+        volume = storage.volume_of(source).name
+    except ValueError:
+        volume = None
+    temp_path = await new_temp_path(size, volume=volume)
+    await storage_io.run_io(_link_or_copy, source, temp_path)
+    db_blob = await commit_blob(db, temp_path, digest, size, db_file.mime_type)
+
+    # Only switch rows nobody else has migrated or changed in the meantime
+    old_charged = charged_bytes(db_file)
+    updated = db.query(File).filter(
+        File.id == db_file.id,
+        File.blob_hash == None,
+        File.storage_path == old_path
+    ).update({
+        File.blob_hash: db_blob.hash,
+        File.storage_path: db_blob.storage_path
+    }, synchronize_session=False)
+    if not updated:
+        db.rollback()
+        db.refresh(db_file)
+        return False
+
+    db.refresh(db_file)
+    if db_file.is_deleted:
+        # Deleted files keep their bytes until unreferenced blobs are reclaimed
+        drop_blob_references(db, db_blob.hash)
+    else:
+        # The exact size in bytes replaces the MB figure in the ledger, in the same transaction
+        delta = charged_bytes(db_file) - old_charged
+        charge_space(db, db_file.owner_id, delta)
+        charge_folders(db, db_file.folder_id, delta)
+    db.commit()
+
+    await storage_io.remove_if_exists(source)
+    schedule_replication(db, db_blob.hash)
+    return True
+
+async def migrate_batch(db: Session, after_id: str = "", batch_size: int = 100):
+    """Migrate the next batch of legacy files in id order.
+    Returns a tuple of (last processed id or None when done, migrated count, missing count).
+    """
+    batch = db.query(File).filter(
+        File.blob_hash == None,
+        File.id > after_id
+    ).order_by(File.id).limit(batch_size).all()
+    if not batch:
+        return None, 0, 0
+
+    migrated = missing = 0
+    for db_file in batch:
+        if await migrate_file(db, db_file):
+            migrated += 1
+        elif db_file.blob_hash is None:
+            missing += 1
+    return batch[-1].id, migrated, missing
+
+async def run_storage_migration():
+    """Background task moving legacy files into the blob store batch by batch.
+    Progress lives in the database (files with no blob_hash are left to do), so
+    the task simply starts over after a restart and never redoes finished work.
+    """
+    if _status["running"]:
+        return
+    _status.update(running=True, migrated=0, missing=0)
+    db = SessionLocal()
+    try:
+        after_id = ""
+        while True:
+            after_id, migrated, missing = await migrate_batch(db, after_id, settings.STORAGE_MIGRATION_BATCH_SIZE)
+            if after_id is None:
+                break
+            _status["migrated"] += migrated
+            _status["missing"] += missing
+            # Leave disk bandwidth to regular requests between batches
+            await asyncio.sleep(settings.STORAGE_MIGRATION_PAUSE_SECONDS)
+        if _status["migrated"] or _status["missing"]:
+            print(f"Storage migration finished: {_status['migrated']} files moved, {_status['missing']} missing on disk")
+    except Exception as e:
+        print(f"Storage migration stopped: {e}")
+    finally:
+        db.close()
+        _status["running"] = False
+
+def get_migration_status(db: Session) -> dict:
+    return {
+        "running": _status["running"],
+        "migrated": _status["migrated"],
+        "missing": _status["missing"],
+        "remaining": count_legacy_files(db)
+    }
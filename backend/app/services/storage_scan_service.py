@@ -0,0 +1,216 @@
+"""
+Reconciliation of the storage volumes with the database.
+
+The scan lists the content directories of every volume in parallel and
+compares what is on disk with what the database references:
+- orphans are files no row points at (left by crashes or interrupted
+  writes); they are only counted once older than GC_ORPHAN_MIN_AGE_HOURS,
+  since younger ones may belong to writes in progress;
+- missing files are rows whose bytes are gone from disk.
+With cleanup, orphans are deleted and lost blob copies are dropped and
+replicated again from a surviving copy; anything else is only reported.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from sqlalchemy.orm import Session
+
+from ..models.blob import Blob, BlobReplica
+from ..models.file import File
+from ..models.file_version import Chunk
+from ..core.config import settings
+from ..core.database import SessionLocal
+from ..core.storage import storage, DEFAULT_VOLUME
+from ..core import storage_io
+from .blob_service import BLOBS_DIR, get_blob
+from .version_service import CHUNKS_DIR
+from .job_service import enqueue_job, job_handler
+from .replication_service import locate_blob
+
+# Directories holding stored content; thumbnails and upload state live elsewhere
+LEGACY_DIRS = ("private_files", "public_files")
+SAMPLE_LIMIT = 20
+
+# Progress of the last scan in this process
+_status = {
+    "running": False,
+    "cleanup": False,
+    "directories_total": 0,
+    "directories_scanned": 0,
+    "files_scanned": 0,
+    "bytes_scanned": 0,
+    "orphan_files": 0,
+    "orphan_bytes": 0,
+    "orphans_removed": 0,
+    "missing_blob_copies": 0,
+    "missing_chunks": 0,
+    "missing_files": 0,
+    "blobs_repaired": 0,
+    "orphan_samples": [],
+    "missing_samples": [],
+    "started_at": None,
+    "finished_at": None
+}
+
+def _known_paths(db: Session) -> Dict[str, Tuple[str, str]]:
+    """Every path the database references: path -> (kind, id)"""
+    known = {}
+
+    def add(key, volume, kind, ident):
+        volume = volume or DEFAULT_VOLUME
+        # Content on volumes that are no longer configured can't be checked
+        if os.path.isabs(key) or volume in storage.volumes:
+            known[os.path.abspath(storage.path(key, volume))] = (kind, ident)
+
+    blob_keys = {}
+    for digest, key, volume in db.query(Blob.hash, Blob.storage_path, Blob.volume).yield_per(1000):
+        blob_keys[digest] = key
+        add(key, volume, "blob", digest)
+    for digest, volume in db.query(BlobReplica.blob_hash, BlobReplica.volume).yield_per(1000):
+        if digest in blob_keys:
+            add(blob_keys[digest], volume, "blob", digest)
+    for digest, key, volume in db.query(Chunk.hash, Chunk.storage_path, Chunk.volume).yield_per(1000):
+        add(key, volume, "chunk", digest)
+    # Legacy files own their bytes until they are purged, deleted or not
+    for file_id, key in db.query(File.id, File.storage_path).filter(File.blob_hash == None).yield_per(1000):
+        add(key, None, "file", file_id)
+    return known
+
+def _scan_roots() -> List[Tuple[str, bool]]:
+    """(directory, recursive) pairs to scan, one per shard so they can run in parallel"""
+    roots = []
+    for volume in storage.volumes.values():
+        for top in (BLOBS_DIR, CHUNKS_DIR):
+            path = volume.path(top)
+            if not os.path.isdir(path):
+                continue
+            # Loose files such as interrupted temporary writes of the top level
+            roots.append((path, False))
+            roots.extend((entry.path, True) for entry in os.scandir(path) if entry.is_dir())
+    default = storage.volume(DEFAULT_VOLUME)
+    for top in LEGACY_DIRS:
+        path = default.path(top)
+        if os.path.isdir(path):
+            roots.append((path, True))
+    return roots
+
+def _scan_directory(path: str, recursive: bool) -> List[Tuple[str, int, float]]:
+    """(path, size, last change time) of the files in a directory. Blocking."""
+    found = []
+    pending = [path]
+    while pending:
+        try:
+            entries = list(os.scandir(pending.pop()))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        pending.append(entry.path)
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            found.append((os.path.abspath(entry.path), stat.st_size, max(stat.st_mtime, stat.st_ctime)))
+    return found
+
+def _sample(name: str, value: str):
+    if len(_status[name]) < SAMPLE_LIMIT:
+        _status[name].append(value)
+
+async def _scan_files() -> List[Tuple[str, int, float]]:
+    """List every stored file, GC_SCAN_WORKERS directories at a time"""
+    roots = await storage_io.run_io(_scan_roots)
+    _status["directories_total"] = len(roots)
+    loop = asyncio.get_running_loop()
+    found = []
+    with ThreadPoolExecutor(max_workers=settings.GC_SCAN_WORKERS, thread_name_prefix="storage-scan") as executor:
+        tasks = [loop.run_in_executor(executor, _scan_directory, path, recursive) for path, recursive in roots]
+        for task in asyncio.as_completed(tasks):
+            files = await task
+            found.extend(files)
+            _status["directories_scanned"] += 1
+            _status["files_scanned"] += len(files)
+            _status["bytes_scanned"] += sum(size for _, size, _ in files)
+    return found
+
+async def _remove_orphans(db: Session, orphans: List[str]):
+    # Look again: rows may have been committed for these paths since the scan started
+    known = _known_paths(db)
+    for path in orphans:
+        if path not in known and await storage_io.remove_if_exists(path):
+            _status["orphans_removed"] += 1
+
+async def _repair_blob(db: Session, digest: str):
+    # Finding the surviving copy drops the lost ones and queues new replicas
+    db_blob = get_blob(db, digest)
+    if db_blob and await locate_blob(db, db_blob):
+        _status["blobs_repaired"] += 1
+
+async def scan_storage(cleanup: bool = False):
+    """Compare the volumes with the database, optionally cleaning up what is found"""
+    if _status["running"]:
+        return
+    _status.update(
+        running=True, cleanup=cleanup, directories_total=0, directories_scanned=0,
+        files_scanned=0, bytes_scanned=0, orphan_files=0, orphan_bytes=0, orphans_removed=0,
+        missing_blob_copies=0, missing_chunks=0, missing_files=0, blobs_repaired=0,
+        orphan_samples=[], missing_samples=[], started_at=datetime.utcnow(), finished_at=None
+    )
+    db = SessionLocal()
+    try:
+        known = _known_paths(db)
+        found = await _scan_files()
+
+        min_changed = time.time() - settings.GC_ORPHAN_MIN_AGE_HOURS * 3600
+        orphans = []
+        for path, size, changed in found:
+            if path not in known and changed < min_changed:
+                orphans.append(path)
+                _status["orphan_files"] += 1
+                _status["orphan_bytes"] += size
+                _sample("orphan_samples", path)
+
+        # Files written during the scan were not listed, so check before reporting
+        found_paths = {path for path, _, _ in found}
+        missing_blobs = set()
+        for path, (kind, ident) in known.items():
+            if path in found_paths or await storage_io.exists(path):
+                continue
+            if kind == "blob":
+                _status["missing_blob_copies"] += 1
+                missing_blobs.add(ident)
+            elif kind == "chunk":
+                _status["missing_chunks"] += 1
+            else:
+                _status["missing_files"] += 1
+            _sample("missing_samples", f"{kind} {ident}: {path}")
+
+        if cleanup:
+            await _remove_orphans(db, orphans)
+            for digest in sorted(missing_blobs):
+                await _repair_blob(db, digest)
+
+        print(
+            f"Storage scan: {_status['files_scanned']} files, {_status['orphan_files']} orphans, "
+            f"{len(missing_blobs)} blobs and {_status['missing_chunks'] + _status['missing_files']} other rows missing bytes"
+        )
+    finally:
+        db.close()
+        _status.update(running=False, finished_at=datetime.utcnow())
+
+@job_handler("storage_scan")
+async def _storage_scan_job(db: Session, payload: dict):
+    await scan_storage(payload.get("cleanup", False))
+
+def schedule_storage_scan(db: Session, cleanup: bool = False, owner_id: str = None):
+    """Queue a storage scan, unless one is already pending"""
+    return enqueue_job(db, "storage_scan", {"cleanup": cleanup}, key="storage_scan", owner_id=owner_id, max_attempts=1)
+
+def get_scan_status() -> dict:
+    return dict(_status)
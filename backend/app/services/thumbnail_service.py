@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import io
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import List, Optional
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional, without it there are no thumbnails
+    Image = None
+
+from sqlalchemy.orm import Session
+
+from ..models.file import File
+from ..core.config import settings
+from ..core.compression import open_decoded
+from ..core import storage_io
+from .file_service import get_file_content
+from .job_service import enqueue_job, job_handler
+
+THUMBNAIL_MEDIA_TYPE = "image/webp"
+THUMBNAIL_TYPES = {
+    "image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp", "image/tiff"
+}
+
+# Decoding and resizing is CPU-bound, so it gets its own small pool
+_executor = ThreadPoolExecutor(max_workers=settings.THUMBNAIL_WORKERS, thread_name_prefix="thumbnails")
+# Approximate size of the cache directory, None until it's first scanned
+_cache_bytes = None
+
+def thumbnail_sizes() -> List[int]:
+    return sorted(int(size) for size in settings.THUMBNAIL_SIZES.split(",") if size.strip())
+
+def cache_dir() -> str:
+    return settings.THUMBNAIL_CACHE_DIR or os.path.join(settings.UPLOAD_DIR, "thumbnails")
+
+def supports_thumbnails(mime_type: Optional[str]) -> bool:
+    return Image is not None and (mime_type or "").split(";")[0].strip().lower() in THUMBNAIL_TYPES
+
+def thumbnail_key(db_file: File) -> str:
+    """Cache key of a file's thumbnails: its content hash, so identical images
+    share thumbnails and new content never hits stale ones
+    """
+    if db_file.blob_hash:
+        return db_file.blob_hash
+    # Legacy files without a content hash are keyed by location and modification time
+    stamp = db_file.updated_at.isoformat() if db_file.updated_at else ""
+    return "legacy-" + hashlib.sha256(f"{db_file.storage_path}:{stamp}".encode()).hexdigest()
+
+def thumbnail_path(key: str, size: int) -> str:
+    return os.path.join(cache_dir(), key[-2:], f"{key}-{size}.webp")
+
+def _render_thumbnails(source_path: str, encoding: Optional[str], key: str) -> int:
+    """Decode an image once and write a thumbnail for every configured size.
+    Blocking, run it on the thumbnail pool. Returns the bytes written.
+    """
+    if encoding:
+        with closing(open_decoded(source_path, encoding)) as source:
+            image = Image.open(io.BytesIO(source.read()))
+    else:
+        image = Image.open(source_path)
+
+    written = 0
+    with image:
+        sizes = thumbnail_sizes()
+        # Let JPEG decode at a reduced scale, much faster for large photos
+        image.draft("RGB", (sizes[-1], sizes[-1]))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+        for size in reversed(sizes):
+            image.thumbnail((size, size))
+            target = thumbnail_path(key, size)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temp_path = f"{target}.{uuid.uuid4()}.tmp"
+            image.save(temp_path, "WEBP", quality=80, method=4)
+            os.replace(temp_path, target)
+            written += os.path.getsize(target)
+    return written
+
+def _scan_cache() -> List[os.DirEntry]:
+    entries = []
+    if not os.path.isdir(cache_dir()):
+        return entries
+    for shard in os.scandir(cache_dir()):
+        if shard.is_dir():
+            entries.extend(entry for entry in os.scandir(shard.path) if entry.is_file())
+    return entries
+
+def _evict(limit: int) -> int:
+    """Delete least recently used thumbnails until the cache is below 90% of limit.
+    Blocking, run it on the thumbnail pool. Returns the cache size afterwards.
+    """
+    entries = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in _scan_cache()]
+    total = sum(size for _, size, _ in entries)
+    if total <= limit:
+        return total
+    for _, size, path in sorted(entries):
+        if total <= limit * 0.9:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            pass
+    return total
+
+async def _run(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
+
+async def _account(written: int):
+    """Track the cache size and evict once it outgrows THUMBNAIL_CACHE_MAX_MB"""
+    global _cache_bytes
+    limit = settings.THUMBNAIL_CACHE_MAX_MB * 1024 * 1024
+    if _cache_bytes is None:
+        _cache_bytes = await _run(_evict, limit)
+        return
+    _cache_bytes += written
+    if _cache_bytes > limit:
+        _cache_bytes = await _run(_evict, limit)
+
+async def generate_thumbnails(db: Session, db_file: File) -> bool:
+    """Render the thumbnails of an image file into the cache.
+    Returns False if the file isn't a supported image or can't be decoded.
+    """
+    if not supports_thumbnails(db_file.mime_type):
+        return False
+    if db_file.size_mb > settings.THUMBNAIL_MAX_SOURCE_MB:
+        return False
+    path = await get_file_content(db, db_file)
+    if not path:
+        return False
+    encoding = db_file.blob.encoding if db_file.blob else None
+    try:
+        written = await _run(_render_thumbnails, path, encoding, thumbnail_key(db_file))
+    except Exception as e:
+        print(f"Thumbnails of file {db_file.id} failed: {e}")
+        return False
+    await _account(written)
+    return True
+
+def _touch(path: str) -> bool:
+    # The modification time doubles as the last access time for LRU eviction
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+async def get_thumbnail(db: Session, db_file: File, size: int) -> Optional[str]:
+    """Path of a cached thumbnail, rendered on demand for files uploaded before
+    thumbnails existed or evicted since. None if the file has no thumbnail.
+    """
+    path = thumbnail_path(thumbnail_key(db_file), size)
+    if await storage_io.run_io(_touch, path):
+        return path
+    if not await generate_thumbnails(db, db_file):
+        return None
+    return path if await storage_io.exists(path) else None
+
+@job_handler("thumbnails")
+async def _thumbnails_job(db: Session, payload: dict):
+    db_file = db.query(File).filter(File.id == payload["file_id"]).first()
+    if db_file and not os.path.exists(thumbnail_path(thumbnail_key(db_file), thumbnail_sizes()[0])):
+        await generate_thumbnails(db, db_file)
+
+def schedule_thumbnails(db: Session, db_file: File):
+    """Queue thumbnail rendering for a new image so it doesn't delay the current
+    request. Does nothing for other file types.
+    """
+    if not supports_thumbnails(db_file.mime_type):
+        return
+    enqueue_job(
+        db, "thumbnails", {"file_id": db_file.id},
+        key=f"thumbnails:{db_file.id}", owner_id=db_file.owner_id
+    )
@@ -0,0 +1,308 @@
+import os
+import secrets
+import uuid
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+
+from sqlalchemy.orm import Session
+from starlette.requests import ClientDisconnect
+
+from ..models.upload_session import UploadSession
+from ..models.upload_reservation import UploadReservation
+from ..models.schemas import FileCreate, UploadSessionCreate, UploadReservationCreate
+from ..core.config import settings
+from ..core import storage_io
+from ..core.storage import storage
+from .file_service import create_file, build_public_url
+from .blob_service import write_temp_blob, commit_blob, commit_file_as_blob
+from .thumbnail_service import schedule_thumbnails
+from .user_service import QuotaExceededError, require_space, release_space
+
+SESSIONS_DIR = "upload_sessions"
+RESERVE_STEP = 8 * 1024 * 1024  # Uploads of unknown size reserve space 8 MB ahead of the data
+
+def create_upload_reservation(db: Session, reservation_data: UploadReservationCreate, owner_id: str):
+    """Reserve space for an upcoming upload and issue the token that the upload must present.
+    Raises QuotaExceededError if the space isn't available.
+    """
+    require_space(db, owner_id, reservation_data.size)
+    db_reservation = UploadReservation(
+        token=secrets.token_urlsafe(32),
+        owner_id=owner_id,
+        size_bytes=reservation_data.size,
+        folder_id=reservation_data.folder_id,
+        is_public=reservation_data.is_public,
+        filename=reservation_data.filename,
+        expires_at=datetime.utcnow() + timedelta(minutes=settings.UPLOAD_RESERVATION_TTL_MINUTES)
+    )
+    db.add(db_reservation)
+    db.commit()
+    db.refresh(db_reservation)
+    return db_reservation
+
+def get_upload_reservation(db: Session, token: str):
+    """Get an active (not expired) upload reservation by its token"""
+    return db.query(UploadReservation).filter(
+        UploadReservation.token == token,
+        UploadReservation.expires_at > datetime.utcnow()
+    ).first()
+
+def _drop_reservation(db: Session, db_reservation: UploadReservation) -> bool:
+    # Releasing twice would give back space another upload holds
+    deleted = db.query(UploadReservation).filter(
+        UploadReservation.token == db_reservation.token
+    ).delete(synchronize_session=False)
+    if deleted:
+        release_space(db, db_reservation.owner_id, db_reservation.size_bytes)
+    return deleted == 1
+
+def release_upload_reservation(db: Session, db_reservation: UploadReservation):
+    """Release a reservation once its upload has been stored or abandoned"""
+    _drop_reservation(db, db_reservation)
+    db.commit()
+    return True
+
+def cleanup_expired_reservations(db: Session):
+    """Remove expired upload reservations"""
+    expired = db.query(UploadReservation).filter(
+        UploadReservation.expires_at <= datetime.utcnow()
+    ).all()
+    deleted = sum(_drop_reservation(db, db_reservation) for db_reservation in expired)
+    db.commit()
+    return deleted
+
+async def create_upload_session(
+    db: Session,
+    session_data: UploadSessionCreate,
+    owner_id: str,
+    db_reservation: UploadReservation = None
+):
+    """Create a new resumable upload session with an empty partial file.
+    The session holds space for its declared size until it completes, taken
+    over from db_reservation if given. Raises QuotaExceededError if the space
+    isn't available.
+    """
+    session_id = str(uuid.uuid4())
+    # The partial file stays where it is until completion, so it needs room for the whole upload
+    volume = await storage.choose_volume(session_data.size)
+    sessions_dir = volume.path(SESSIONS_DIR)
+    await storage_io.makedirs(sessions_dir)
+    temp_path = os.path.join(sessions_dir, f"{session_id}.part")
+
+    # Create the partial file up front so every chunk can be written in place
+    await storage_io.touch(temp_path)
+
+    if db_reservation:
+        _drop_reservation(db, db_reservation)
+    try:
+        require_space(db, owner_id, session_data.size)
+    except QuotaExceededError:
+        await storage_io.remove_if_exists(temp_path)
+        raise
+
+    db_session = UploadSession(
+        id=session_id,
+        owner_id=owner_id,
+        filename=session_data.filename,
+        folder_id=session_data.folder_id,
+        is_public=session_data.is_public,
+        mime_type=session_data.mime_type,
+        total_size=session_data.size,
+        offset=0,
+        temp_path=temp_path,
+        expires_at=datetime.utcnow() + timedelta(hours=settings.UPLOAD_SESSION_TTL_HOURS)
+    )
+    db.add(db_session)
+    db.commit()
+    db.refresh(db_session)
+    return db_session
+
+def get_upload_session(db: Session, session_id: str):
+    """Get an upload session by its ID, ignoring expired sessions"""
+    return db.query(UploadSession).filter(
+        UploadSession.id == session_id,
+        UploadSession.expires_at > datetime.utcnow()
+    ).first()
+
+def _commit_offset(db: Session, db_session: UploadSession, old_offset: int, new_offset: int) -> bool:
+    """Advance the committed offset only if no other writer has moved it in the meantime"""
+    updated = db.query(UploadSession).filter(
+        UploadSession.id == db_session.id,
+        UploadSession.offset == old_offset
+    ).update({
+        UploadSession.offset: new_offset,
+        UploadSession.updated_at: datetime.utcnow()
+    }, synchronize_session=False)
+    db.commit()
+    db.refresh(db_session)
+    return updated == 1
+
+async def write_upload_chunk(db: Session, db_session: UploadSession, offset: int, chunks: AsyncIterator[bytes]):
+    """Write a byte range starting at offset into the session's partial file.
+    Returns the number of bytes written, or None if the session offset was moved
+    by a concurrent writer. Bytes received before a client disconnect are kept
+    so the upload can be resumed from there.
+    """
+    written = 0
+    try:
+        async with await storage_io.open_file(db_session.temp_path, "r+b") as buffer:
+            await buffer.seek(offset)
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                if offset + written + len(chunk) > db_session.total_size:
+                    raise ValueError("Chunk exceeds the declared upload size")
+                await buffer.write(chunk)
+                written += len(chunk)
+    except ClientDisconnect:
+        _commit_offset(db, db_session, offset, offset + written)
+        raise
+
+    if not _commit_offset(db, db_session, offset, offset + written):
+        return None
+    return written
+
+async def complete_upload_session(db: Session, db_session: UploadSession, public_url_base: str):
+    """Move a fully received upload into the blob store and register the file"""
+    db_blob = await commit_file_as_blob(db, db_session.temp_path, db_session.mime_type)
+
+    file_id = str(uuid.uuid4())
+    public_url = None
+    if db_session.is_public:
+        public_url = build_public_url(public_url_base, file_id)
+
+    file_data = FileCreate(
+        filename=db_session.filename,
+        folder_id=db_session.folder_id,
+        is_public=db_session.is_public
+    )
+    size_mb = db_blob.size_bytes / (1024 * 1024)
+    owner_id = db_session.owner_id
+    mime_type = db_session.mime_type
+
+    # The session's space becomes the file's in one transaction
+    if not _drop_session(db, db_session):
+        db.rollback()
+        raise ValueError("Upload session was completed or aborted concurrently")
+
+    db_file = create_file(
+        db=db,
+        file=file_data,
+        owner_id=owner_id,
+        storage_path=db_blob.storage_path,
+        size_mb=size_mb,
+        mime_type=mime_type,
+        public_url=public_url,
+        file_id=file_id,
+        blob_hash=db_blob.hash
+    )
+    schedule_thumbnails(db, db_file)
+    return db_file
+
+async def _reserve_as_received(db: Session, chunks: AsyncIterator[bytes], db_reservation: UploadReservation, max_bytes: int):
+    """Pass an upload through, growing its reservation before more bytes arrive
+    than it holds, so concurrent uploads of unknown size can't overcommit the
+    quota. Raises QuotaExceededError once the space runs out.
+    """
+    token, owner_id = db_reservation.token, db_reservation.owner_id
+    held = db_reservation.size_bytes
+    received = 0
+    async for chunk in chunks:
+        received += len(chunk)
+        # Beyond max_bytes write_temp_blob rejects the upload
+        if held < received <= max_bytes:
+            step = max(received - held, min(RESERVE_STEP, max_bytes - held))
+            require_space(db, owner_id, step)
+            # Growing also keeps the reservation of a long upload from expiring
+            grown = db.query(UploadReservation).filter(UploadReservation.token == token).update({
+                UploadReservation.size_bytes: UploadReservation.size_bytes + step,
+                UploadReservation.expires_at: datetime.utcnow() + timedelta(minutes=settings.UPLOAD_RESERVATION_TTL_MINUTES)
+            }, synchronize_session=False)
+            if not grown:
+                db.rollback()
+                raise ValueError("Upload reservation expired")
+            db.commit()
+            held += step
+        yield chunk
+
+async def store_upload_stream(
+    db: Session,
+    chunks: AsyncIterator[bytes],
+    file: FileCreate,
+    owner_id: str,
+    max_bytes: int,
+    public_url_base: str,
+    mime_type: str = None,
+    size_hint: int = 0,
+    reserved_bytes: Optional[int] = 0
+):
+    """Stream an upload into the blob store, hashing it on the way.
+    Only one chunk is held in memory and every byte is written to disk once;
+    content that is already stored only adds a reference to the existing blob.
+    Raises ValueError as soon as more than max_bytes arrive.
+    reserved_bytes, usually the announced size, are held against the quota by
+    an internal reservation while the upload is in progress, and the
+    reservation grows if more arrive (QuotaExceededError if they aren't
+    available). None for uploads whose space is held by the caller.
+    """
+    db_reservation = None
+    if reserved_bytes is not None:
+        db_reservation = create_upload_reservation(db, UploadReservationCreate(
+            size=reserved_bytes, folder_id=file.folder_id, is_public=file.is_public, filename=file.filename
+        ), owner_id)
+        chunks = _reserve_as_received(db, chunks, db_reservation, max_bytes)
+    try:
+        temp_path, digest, size = await write_temp_blob(chunks, max_bytes, size_hint)
+        db_blob = await commit_blob(db, temp_path, digest, size, mime_type)
+    except BaseException:
+        if db_reservation:
+            db.rollback()
+            release_upload_reservation(db, db_reservation)
+        raise
+    if db_reservation:
+        # Released in the transaction that charges the file
+        _drop_reservation(db, db_reservation)
+
+    file_id = str(uuid.uuid4())
+    public_url = None
+    if file.is_public:
+        public_url = build_public_url(public_url_base, file_id)
+
+    db_file = create_file(
+        db=db,
+        file=file,
+        owner_id=owner_id,
+        storage_path=db_blob.storage_path,
+        size_mb=size / (1024 * 1024),
+        mime_type=mime_type,
+        public_url=public_url,
+        file_id=file_id,
+        blob_hash=db_blob.hash
+    )
+    schedule_thumbnails(db, db_file)
+    return db_file
+
+def _drop_session(db: Session, db_session: UploadSession) -> bool:
+    # Like reservations, only the first of concurrent completes and aborts releases the space
+    deleted = db.query(UploadSession).filter(
+        UploadSession.id == db_session.id
+    ).delete(synchronize_session=False)
+    if deleted:
+        release_space(db, db_session.owner_id, db_session.total_size)
+    return deleted == 1
+
+async def abort_upload_session(db: Session, db_session: UploadSession):
+    """Discard an upload session and its partial file"""
+    await storage_io.remove_if_exists(db_session.temp_path)
+    _drop_session(db, db_session)
+    db.commit()
+    return True
+
+async def cleanup_expired_sessions(db: Session):
+    """Remove expired upload sessions and their partial files"""
+    expired = db.query(UploadSession).filter(
+        UploadSession.expires_at <= datetime.utcnow()
+    ).all()
+    for db_session in expired:
+        await abort_upload_session(db, db_session)
+    return len(expired)
@@ -3,7 +3,7 @@ from ..models.user import User
 from ..models.schemas import UserCreate, UserUpdate, UserStats
 from ..models.file import File
 from ..models.folder import Folder
-from sqlalchemy import func, or_
+from sqlalchemy import case, func, or_
 
 def get_user_by_telegram_id(db: Session, telegram_id: str):
     """Get user by Telegram ID"""
@@ -39,16 +39,21 @@ def update_user(db: Session, user: User, user_update: UserUpdate):
 
 def get_user_stats(db: Session, user: User):
     """Get statistics about user's storage usage"""
-    # Count active files and folders (not deleted)
-    total_files = db.query(func.count(File.id)).filter(
-        File.owner_id == user.telegram_id,
-        File.is_deleted == False
-    ).scalar()
+    # Counters are kept up to date with every change; they are only counted
+    # here for users the stats rebuild hasn't reached yet
+    total_files = user.file_count
+    if total_files is None:
+        total_files = db.query(func.count(File.id)).filter(
+            File.owner_id == user.telegram_id,
+            File.is_deleted == False
+        ).scalar()
     
-    total_folders = db.query(func.count(Folder.id)).filter(
-        Folder.owner_id == user.telegram_id,
-        Folder.is_deleted == False
-    ).scalar()
+    total_folders = user.folder_count
+    if total_folders is None:
+        total_folders = db.query(func.count(Folder.id)).filter(
+            Folder.owner_id == user.telegram_id,
+            Folder.is_deleted == False
+        ).scalar()
     
     # Calculate used space and usage percentage
     used_space = user.used_space
@@ -58,31 +63,66 @@ def get_user_stats(db: Session, user: User):
     return UserStats(
         total_files=total_files,
         total_folders=total_folders,
+        public_files=user.public_file_count or 0,
         used_space=used_space,
+        used_bytes=user.used_bytes or 0,
+        reserved_bytes=user.reserved_bytes or 0,
         quota=quota,
         usage_percent=usage_percent
     )
 
-def update_user_space_usage(db: Session, telegram_id: str, size_change: float):
-    """Update the user's space usage.
-    Use positive value for size_change when adding files.
-    Use negative value for size_change when removing files.
+class QuotaExceededError(Exception):
+    def __init__(self, available_bytes: int):
+        super().__init__("Insufficient storage space")
+        self.available_bytes = max(available_bytes, 0)
+
+def _quota_bytes():
+    return User.quota * (1024 * 1024)
+
+def available_bytes(user: User) -> int:
+    """Space a user can still fill: the quota minus stored files and uploads in progress"""
+    return int(user.quota * 1024 * 1024) - (user.used_bytes or 0) - (user.reserved_bytes or 0)
+
+def _clamped(column, delta: int):
+    return case((column + delta < 0, 0), else_=column + delta)
+
+def charge_space(db: Session, telegram_id: str, delta: int):
+    """Add delta bytes (negative when files are removed) to a user's usage.
+    An atomic increment without commit, so it lands in the caller's transaction
+    together with the file row it accounts for.
     """
-    user = get_user_by_telegram_id(db, telegram_id)
-    if not user:
-        return None
-    
-    # Update used space
-    user.used_space += size_change
-    
-    # Ensure used_space doesn't go below 0
-    if user.used_space < 0:
-        user.used_space = 0
-    
-    db.commit()
-    db.refresh(user)
-    return user
+    if delta:
+        db.query(User).filter(User.telegram_id == telegram_id).update({
+            User.used_bytes: _clamped(User.used_bytes, delta)
+        }, synchronize_session=False)
+
+def reserve_space(db: Session, telegram_id: str, size: int) -> bool:
+    """Hold size bytes for an upload in progress if they fit into the quota.
+    Checked and incremented in one statement, so concurrent uploads can't
+    overcommit. Part of the caller's transaction, like charge_space.
+    """
+    if size <= 0:
+        return True
+    return db.query(User).filter(
+        User.telegram_id == telegram_id,
+        User.used_bytes + User.reserved_bytes + size <= _quota_bytes()
+    ).update({
+        User.reserved_bytes: User.reserved_bytes + size
+    }, synchronize_session=False) == 1
+
+def release_space(db: Session, telegram_id: str, size: int):
+    """Give back space held by reserve_space"""
+    if size > 0:
+        db.query(User).filter(User.telegram_id == telegram_id).update({
+            User.reserved_bytes: _clamped(User.reserved_bytes, -size)
+        }, synchronize_session=False)
 
+def require_space(db: Session, telegram_id: str, size: int):
+    """reserve_space that raises QuotaExceededError when the space isn't available"""
+    if not reserve_space(db, telegram_id, size):
+        db.rollback()
+        user = get_user_by_telegram_id(db, telegram_id)
+        raise QuotaExceededError(available_bytes(user) if user else 0)
 
 def get_all_users(db: Session, skip: int = 0, limit: int = 100):
     """Get all users with pagination"""
@@ -0,0 +1,340 @@
+import hashlib
+import os
+import uuid
+from collections import Counter
+from contextlib import closing
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, Iterable, List, Tuple
+
+from sqlalchemy import case, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..models.file import File
+from ..models.file_version import Chunk, ChunkOwner, FileVersion, FileVersionChunk
+from ..models.schemas import ChunkRef
+from ..core.config import settings
+from ..core.chunking import MAX_CHUNK_SIZE, iter_chunks
+from ..core.compression import open_decoded
+from ..core import storage_io
+from ..core.storage import storage, Volume
+from .blob_service import write_temp_blob, commit_blob, release_blob
+from .user_service import charge_space, require_space, release_space
+from .stats_service import charge_folders
+from .file_service import get_file_content, charged_bytes
+from .replication_service import schedule_replication
+from .thumbnail_service import schedule_thumbnails
+
+CHUNKS_DIR = "chunks"
+READ_CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+def chunk_key(digest: str) -> str:
+    """Content-addressed storage key of a chunk, fanned out by hash prefix"""
+    return os.path.join(CHUNKS_DIR, digest[:2], digest[2:4], digest)
+
+def get_chunk(db: Session, digest: str):
+    """Get a stored chunk by its content hash"""
+    return db.query(Chunk).filter(Chunk.hash == digest).first()
+
+def _in_batches(values: List[str], size: int = 500):
+    # Stay well below the bound parameter limit of SQLite
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+def get_owned_chunks(db: Session, owner_id: str, hashes: Iterable[str]) -> Dict[str, Chunk]:
+    """The stored chunks among hashes that the user uploaded or whose file content contains them"""
+    owned = {}
+    for batch in _in_batches(list(set(hashes))):
+        owned.update((chunk.hash, chunk) for chunk in db.query(Chunk).join(
+            ChunkOwner, ChunkOwner.chunk_hash == Chunk.hash
+        ).filter(
+            ChunkOwner.owner_id == owner_id,
+            ChunkOwner.chunk_hash.in_(batch)
+        ).all())
+    return owned
+
+def get_missing_chunks(db: Session, owner_id: str, hashes: List[str]) -> List[str]:
+    """Return the hashes (in request order, without duplicates) the user has to upload.
+    Chunks stored for other users count as missing, so hashes reveal nothing
+    about their content.
+    """
+    wanted = list(dict.fromkeys(hashes))
+    owned = get_owned_chunks(db, owner_id, wanted)
+    return [digest for digest in wanted if digest not in owned]
+
+def _hold_chunks(db: Session, hashes: Iterable[str]) -> int:
+    """Keep existing chunks from being reclaimed for GC_UNREFERENCED_GRACE_HOURS,
+    so the caller can rely on their files until it takes its references.
+    Returns the number of chunks found.
+    """
+    held = 0
+    for batch in _in_batches(list(set(hashes))):
+        held += db.query(Chunk).filter(Chunk.hash.in_(batch)).update({
+            Chunk.unreferenced_at: case((Chunk.ref_count == 0, datetime.utcnow()), else_=Chunk.unreferenced_at)
+        }, synchronize_session=False)
+    db.commit()
+    return held
+
+def _register_chunk(db: Session, digest: str, size: int, volume: str) -> Chunk:
+    """Add the row for a chunk whose file is already in the chunk store"""
+    if not get_chunk(db, digest):
+        db.add(Chunk(hash=digest, size_bytes=size, storage_path=chunk_key(digest), volume=volume, ref_count=0))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Stored concurrently with identical content
+            db.rollback()
+    return get_chunk(db, digest)
+
+async def _save_chunk(db: Session, temp_path: str, digest: str, size: int) -> Chunk:
+    """Move a verified temporary file into the chunk store unless it is already there"""
+    if _hold_chunks(db, [digest]):
+        await storage_io.remove(temp_path)
+        return get_chunk(db, digest)
+
+    volume = await storage.put(temp_path, chunk_key(digest))
+    return _register_chunk(db, digest, size, volume)
+
+def _claim_chunk(db: Session, owner_id: str, db_chunk: Chunk, reserved: int = 0):
+    """Record the user as an owner of a chunk, holding reserved bytes of their
+    quota until a version uses it. Raises QuotaExceededError if they don't fit.
+    """
+    if db.query(ChunkOwner).filter(ChunkOwner.chunk_hash == db_chunk.hash, ChunkOwner.owner_id == owner_id).first():
+        return
+    require_space(db, owner_id, reserved)
+    db.add(ChunkOwner(chunk_hash=db_chunk.hash, owner_id=owner_id, reserved_bytes=reserved))
+    try:
+        db.commit()
+    except IntegrityError:
+        # Claimed concurrently, the rollback gives the reservation back
+        db.rollback()
+
+async def store_chunk(db: Session, owner_id: str, digest: str, chunks: AsyncIterator[bytes]) -> Chunk:
+    """Store an uploaded chunk after checking that its content matches the hash.
+    Its size is held against the user's quota until a version uses it or the
+    upload expires. Raises ValueError if the chunk is too large or the hash
+    doesn't match, QuotaExceededError if its size doesn't fit into the quota.
+    """
+    temp_path, actual_digest, size = await write_temp_blob(chunks, MAX_CHUNK_SIZE)
+    if actual_digest != digest.lower():
+        await storage_io.remove(temp_path)
+        raise ValueError("Chunk content does not match its hash")
+    db_chunk = await _save_chunk(db, temp_path, actual_digest, size)
+    # A chunk nobody claims keeps no reference and is reclaimed by the GC
+    _claim_chunk(db, owner_id, db_chunk, size)
+    return db_chunk
+
+def _use_chunk_uploads(db: Session, owner_id: str, hashes: Iterable[str]):
+    """Give back the quota held by the user's uploads of chunks that a version now references"""
+    for batch in _in_batches(list(set(hashes))):
+        uploads = db.query(ChunkOwner).filter(
+            ChunkOwner.owner_id == owner_id,
+            ChunkOwner.chunk_hash.in_(batch),
+            ChunkOwner.reserved_bytes > 0
+        )
+        release_space(db, owner_id, sum(upload.reserved_bytes for upload in uploads.all()))
+        uploads.update({ChunkOwner.reserved_bytes: 0}, synchronize_session=False)
+
+def pending_chunk_bytes(db: Session, owner_id: str, hashes: Iterable[str]) -> int:
+    """Quota held by the user's uploads of the given chunks"""
+    held = 0
+    for batch in _in_batches(list(set(hashes))):
+        held += db.query(func.coalesce(func.sum(ChunkOwner.reserved_bytes), 0)).filter(
+            ChunkOwner.owner_id == owner_id,
+            ChunkOwner.chunk_hash.in_(batch)
+        ).scalar()
+    return held
+
+def cleanup_expired_chunk_uploads(db: Session) -> int:
+    """Give back the quota of chunk uploads no version used in time.
+    The user keeps owning the chunks while they are stored.
+    """
+    cutoff = datetime.utcnow() - timedelta(hours=settings.VERSION_CHUNK_TTL_HOURS)
+    expired = db.query(ChunkOwner).filter(ChunkOwner.reserved_bytes > 0, ChunkOwner.created_at < cutoff).all()
+    for upload in expired:
+        release_space(db, upload.owner_id, upload.reserved_bytes)
+        upload.reserved_bytes = 0
+    db.commit()
+    return len(expired)
+
+def get_file_versions(db: Session, file_id: str):
+    """Get all versions of a file, oldest first"""
+    return db.query(FileVersion).filter(
+        FileVersion.file_id == file_id
+    ).order_by(FileVersion.version_number).all()
+
+def get_file_version(db: Session, file_id: str, version_number: int):
+    """Get a single version of a file"""
+    return db.query(FileVersion).filter(
+        FileVersion.file_id == file_id,
+        FileVersion.version_number == version_number
+    ).first()
+
+def _add_version(db: Session, file_id: str, chunk_hashes: List[str], size: int) -> FileVersion:
+    """Record a version made of already stored chunks and reference them.
+    Part of the caller's transaction.
+    """
+    last_number = db.query(func.max(FileVersion.version_number)).filter(
+        FileVersion.file_id == file_id
+    ).scalar() or 0
+
+    db_version = FileVersion(file_id=file_id, version_number=last_number + 1, size_bytes=size)
+    db.add(db_version)
+    db.flush()
+
+    for position, digest in enumerate(chunk_hashes):
+        db.add(FileVersionChunk(version_id=db_version.id, position=position, chunk_hash=digest))
+
+    for digest, count in Counter(chunk_hashes).items():
+        db.query(Chunk).filter(Chunk.hash == digest).update({
+            Chunk.ref_count: Chunk.ref_count + count
+        }, synchronize_session=False)
+    return db_version
+
+def release_versions(db: Session, version_ids: List[int]):
+    """Delete versions and drop their chunk references, without commit"""
+    if not version_ids:
+        return
+    entries = db.query(FileVersionChunk.chunk_hash).filter(FileVersionChunk.version_id.in_(version_ids)).all()
+    for digest, count in Counter(digest for (digest,) in entries).items():
+        db.query(Chunk).filter(Chunk.hash == digest).update({
+            Chunk.ref_count: Chunk.ref_count - count
+        }, synchronize_session=False)
+        db.query(Chunk).filter(Chunk.hash == digest, Chunk.ref_count <= 0).update({
+            Chunk.ref_count: 0,
+            Chunk.unreferenced_at: datetime.utcnow()
+        }, synchronize_session=False)
+    db.query(FileVersionChunk).filter(FileVersionChunk.version_id.in_(version_ids)).delete(synchronize_session=False)
+    db.query(FileVersion).filter(FileVersion.id.in_(version_ids)).delete(synchronize_session=False)
+
+def prune_versions(db: Session, file_id: str):
+    """Delete the oldest versions of a file beyond FILE_VERSION_RETENTION.
+    Chunks no version uses any more are reclaimed by the GC.
+    """
+    keep = max(settings.FILE_VERSION_RETENTION, 1)
+    expired = db.query(FileVersion.id).filter(
+        FileVersion.file_id == file_id
+    ).order_by(FileVersion.version_number.desc()).offset(keep).all()
+    release_versions(db, [row[0] for row in expired])
+    db.commit()
+
+def _chunk_into_store(path: str, volume: Volume, encoding: str = None):
+    """Split a file into chunks and write the ones missing from the chunk store of a volume.
+    Compressed files are chunked by their original bytes.
+    Blocking, run it on the I/O pool. Returns a list of (hash, size) in file order.
+    """
+    entries = []
+    with closing(open_decoded(path, encoding)) as source:
+        for data in iter_chunks(source):
+            digest = hashlib.sha256(data).hexdigest()
+            target = volume.path(chunk_key(digest))
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                temp_path = f"{target}.{uuid.uuid4()}.tmp"
+                with open(temp_path, "wb") as buffer:
+                    buffer.write(data)
+                os.replace(temp_path, target)
+            entries.append((digest, len(data)))
+    return entries
+
+async def ensure_base_version(db: Session, db_file: File):
+    """Chunk the current content of a file into version 1 if it has no versions yet,
+    so later versions only need to upload the chunks that changed.
+    """
+    versions = get_file_versions(db, db_file.id)
+    if versions:
+        return versions[0]
+
+    path = await get_file_content(db, db_file)
+    if not path:
+        raise ValueError("File content is missing on the server")
+    volume = await storage.choose_volume(int(db_file.size_mb * 1024 * 1024))
+    encoding = db_file.blob.encoding if db_file.blob else None
+    entries = await storage_io.run_io(_chunk_into_store, path, volume, encoding)
+    # Chunks that were already stored may be unreferenced: hold them before relying on their files
+    _hold_chunks(db, dict(entries))
+    stored = {digest: _register_chunk(db, digest, size, volume.name) for digest, size in dict(entries).items()}
+    for digest, db_chunk in stored.items():
+        if not await storage_io.exists(storage.path(db_chunk.storage_path, db_chunk.volume)):
+            # Reclaimed before it was held: write the missing chunks again
+            await storage_io.run_io(_chunk_into_store, path, volume, encoding)
+            break
+    for db_chunk in stored.values():
+        # The chunks are the user's own content, so they hold no extra quota
+        _claim_chunk(db, db_file.owner_id, db_chunk)
+
+    db_version = _add_version(db, db_file.id, [digest for digest, _ in entries], sum(size for _, size in entries))
+    _use_chunk_uploads(db, db_file.owner_id, dict(entries))
+    db.commit()
+    db.refresh(db_version)
+    return db_version
+
+async def _iter_objects(locations: List[Tuple[str, str]]):
+    for key, volume in locations:
+        async for data in storage.iter(key, volume, READ_CHUNK_SIZE):
+            yield data
+
+def iter_version_content(db_version: FileVersion):
+    """Reassemble the content of a version from its chunks as an async stream.
+    Chunk locations are resolved up front so the stream doesn't need the DB session.
+    """
+    locations = [(entry.chunk.storage_path, entry.chunk.volume) for entry in db_version.chunks]
+    return _iter_objects(locations)
+
+async def commit_file_version(db: Session, db_file: File, chunk_refs: List[ChunkRef]) -> FileVersion:
+    """Create a new version of a file from stored chunks and make it the current content.
+    Raises ValueError if a chunk is missing, isn't the user's or its declared size is wrong.
+    """
+    # The current content becomes version 1 first, so it stays restorable
+    await ensure_base_version(db, db_file)
+
+    chunk_hashes = [ref.hash.lower() for ref in chunk_refs]
+    # Held first, so the GC can't reclaim a chunk between the check and the version's reference
+    _hold_chunks(db, chunk_hashes)
+    stored = get_owned_chunks(db, db_file.owner_id, chunk_hashes)
+    for ref in chunk_refs:
+        db_chunk = stored.get(ref.hash.lower())
+        if not db_chunk:
+            raise ValueError(f"Chunk {ref.hash} has not been uploaded")
+        if db_chunk.size_bytes != ref.size:
+            raise ValueError(f"Chunk {ref.hash} has a different size")
+
+    # Materialize the new content as a blob so regular downloads stay a plain file read.
+    # It is stored before the version exists, so a failure leaves no half-made version.
+    size = sum(ref.size for ref in chunk_refs)
+    locations = [(stored[digest].storage_path, stored[digest].volume) for digest in chunk_hashes]
+    temp_path, digest, written = await write_temp_blob(_iter_objects(locations), size_hint=size)
+    db_blob = await commit_blob(db, temp_path, digest, written, db_file.mime_type)
+
+    old_blob_hash = db_file.blob_hash
+    try:
+        # The version, its chunk references and the switch of the file commit together
+        db_version = _add_version(db, db_file.id, chunk_hashes, size)
+        _use_chunk_uploads(db, db_file.owner_id, chunk_hashes)
+
+        old_charged = charged_bytes(db_file)
+        db_file.storage_path = db_blob.storage_path
+        db_file.blob_hash = db_blob.hash
+        db_file.size_mb = written / (1024 * 1024)
+        db_file.content_updated_at = datetime.utcnow()
+        db.flush()
+        db.expire(db_file, ["blob"])
+        delta = charged_bytes(db_file) - old_charged
+        charge_space(db, db_file.owner_id, delta)
+        if not db_file.is_deleted:
+            charge_folders(db, db_file.folder_id, delta)
+        db.commit()
+    except Exception:
+        # Also drops the reference commit_blob took
+        db.rollback()
+        raise
+
+    if old_blob_hash:
+        release_blob(db, old_blob_hash)
+    prune_versions(db, db_file.id)
+    schedule_replication(db, db_blob.hash)
+    db.refresh(db_file)
+    db.refresh(db_version)
+    schedule_thumbnails(db, db_file)
+
+    return db_version
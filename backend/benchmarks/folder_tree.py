@@ -0,0 +1,129 @@
+"""
+Benchmark: building the folder tree of a user with many folders and files.
+
+Creates --folders folders (a random tree) and --files files for one user,
+then times get_folder_tree, the full GET /api/v1/folders/tree request and
+a depth-limited request.
+
+    python benchmarks/folder_tree.py --folders 10000 --files 100000
+    python benchmarks/folder_tree.py --folders 2000 --files 20000 --legacy   # also time the old per-folder queries
+
+The old builder runs one query per folder and scans every folder for the
+children of each node, so --legacy is only practical on smaller trees.
+Runs against a throwaway UPLOAD_DIR and SQLite database in a temp directory.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+WORK_DIR = tempfile.mkdtemp(prefix="nidrive-bench-")
+os.environ["UPLOAD_DIR"] = os.path.join(WORK_DIR, "uploads")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORK_DIR, 'bench.db')}"
+os.environ["DATABASE_PATH"] = os.path.join(WORK_DIR, "bench.db")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.main import app  # noqa: E402
+from app.core.auth import create_access_token  # noqa: E402
+from app.core.database import SessionLocal, init_db  # noqa: E402
+from app.models.file import File  # noqa: E402
+from app.models.folder import Folder  # noqa: E402
+from app.models.schemas import FileResponse, FolderTree  # noqa: E402
+from app.models.user import User  # noqa: E402
+from app.services.folder_service import get_folder_tree  # noqa: E402
+
+OWNER = "bench"
+
+def prepare(folder_count: int, file_count: int) -> str:
+    init_db()
+    db = SessionLocal()
+    db.add(User(telegram_id=OWNER, first_name="Bench"))
+    # Each folder goes below a random earlier one, about 5% are roots
+    rows = []
+    for folder_id in range(1, folder_count + 1):
+        parent_id = None if folder_id == 1 or random.random() < 0.05 else random.randint(1, folder_id - 1)
+        rows.append({"id": folder_id, "name": f"folder-{folder_id}", "owner_id": OWNER, "parent_id": parent_id, "is_deleted": False})
+    db.bulk_insert_mappings(Folder, rows)
+    db.bulk_insert_mappings(File, [
+        {
+            "id": str(uuid.uuid4()),
+            "filename": f"file-{number}.txt",
+            "storage_path": f"private_files/{number}",
+            "owner_id": OWNER,
+            "folder_id": random.randint(1, folder_count),
+            "size_mb": 0.01,
+            "is_public": False,
+            "is_deleted": False
+        }
+        for number in range(file_count)
+    ])
+    db.commit()
+    db.close()
+    return create_access_token({"sub": OWNER})
+
+def legacy_folder_tree(db, owner_id):
+    """The builder before the single-query rewrite, for comparison. Files are
+    converted explicitly, as pydantic 2 doesn't read ORM rows into nested models.
+    """
+    folders = db.query(Folder).filter(Folder.owner_id == owner_id, Folder.is_deleted == False).all()
+    folder_dict = {folder.id: folder for folder in folders}
+
+    def build(folder):
+        children = [f for f in folder_dict.values() if f.parent_id == folder.id]
+        files = [
+            FileResponse.model_validate(db_file, from_attributes=True)
+            for db_file in db.query(File).filter(File.folder_id == folder.id, File.is_deleted == False).all()
+        ]
+        return FolderTree(
+            id=folder.id, name=folder.name, owner_id=folder.owner_id, parent_id=folder.parent_id,
+            children=[build(child) for child in children], files=files
+        )
+
+    return [build(folder) for folder in folders if folder.parent_id is None]
+
+def timed(label: str, func):
+    started = time.perf_counter()
+    result = func()
+    print(f"{label:<28}{time.perf_counter() - started:8.2f} s")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folders", type=int, default=10000, help="number of folders")
+    parser.add_argument("--files", type=int, default=100000, help="number of files")
+    parser.add_argument("--depth", type=int, default=2, help="levels of the depth-limited request")
+    parser.add_argument("--legacy", action="store_true", help="also time the old per-folder builder")
+    args = parser.parse_args()
+
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), args.folders + 100))
+    random.seed(1)
+    token = prepare(args.folders, args.files)
+    headers = {"Authorization": f"Bearer {token}"}
+    print(f"tree:                       {args.folders} folders, {args.files} files")
+
+    db = SessionLocal()
+    timed("get_folder_tree", lambda: get_folder_tree(db, OWNER))
+    if args.legacy:
+        timed("legacy builder", lambda: legacy_folder_tree(db, OWNER))
+    db.close()
+
+    client = TestClient(app)
+    response = timed("GET /folders/tree", lambda: client.get("/api/v1/folders/tree", headers=headers))
+    response.raise_for_status()
+    print(f"response size:              {len(response.content) / (1024 * 1024):.1f} MB")
+    response = timed(
+        f"GET /folders/tree?depth={args.depth}",
+        lambda: client.get(f"/api/v1/folders/tree?depth={args.depth}", headers=headers)
+    )
+    response.raise_for_status()
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
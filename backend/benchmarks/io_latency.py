@@ -0,0 +1,106 @@
+"""
+Benchmark: latency of concurrent requests while a large file is being written.
+
+Uploads --size-mb through POST /api/v1/files/stream (written to disk and
+hashed into the blob store) and keeps pinging GET / from the same event loop
+meanwhile.
+
+    python benchmarks/io_latency.py --size-mb 1024
+    python benchmarks/io_latency.py --size-mb 1024 --blocking   # old behaviour, I/O on the event loop
+
+Runs against a throwaway UPLOAD_DIR and SQLite database in a temp directory.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+WORK_DIR = tempfile.mkdtemp(prefix="nidrive-bench-")
+os.environ["UPLOAD_DIR"] = os.path.join(WORK_DIR, "uploads")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORK_DIR, 'bench.db')}"
+os.environ["DATABASE_PATH"] = os.path.join(WORK_DIR, "bench.db")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+from app.main import app  # noqa: E402
+from app.core import storage_io  # noqa: E402
+from app.core.auth import create_access_token  # noqa: E402
+from app.core.database import SessionLocal, init_db  # noqa: E402
+from app.models.user import User  # noqa: E402
+
+def prepare(size_mb: int) -> str:
+    init_db()
+    db = SessionLocal()
+    db.add(User(telegram_id="bench", first_name="Bench", quota=size_mb * 4.0))
+    db.commit()
+    db.close()
+    return create_access_token({"sub": "bench"})
+
+async def run(token: str, size_mb: int, interval: float):
+    headers = {"Authorization": f"Bearer {token}"}
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def probe(done: asyncio.Event):
+            # Latency is measured from when the request should have been sent,
+            # so time spent waiting for a blocked event loop is included
+            scheduled = time.perf_counter()
+            while not done.is_set():
+                await client.get("/")
+                latencies.append((time.perf_counter() - scheduled) * 1000)
+                scheduled = time.perf_counter() + interval
+                await asyncio.sleep(interval)
+
+        done = asyncio.Event()
+        probe_task = asyncio.create_task(probe(done))
+        await asyncio.sleep(0.1)
+
+        block = os.urandom(1024 * 1024)
+
+        async def body():
+            for _ in range(size_mb):
+                yield block
+
+        started = time.perf_counter()
+        response = await client.post("/api/v1/files/stream?filename=large.bin", content=body(), headers=headers)
+        copy_seconds = time.perf_counter() - started
+        response.raise_for_status()
+
+        done.set()
+        await probe_task
+    return copy_seconds, latencies
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=512, help="size of the file to upload")
+    parser.add_argument("--interval", type=float, default=0.005, help="pause between probe requests, seconds")
+    parser.add_argument("--blocking", action="store_true", help="run storage I/O inline on the event loop")
+    args = parser.parse_args()
+
+    if args.blocking:
+        async def run_inline(func, *func_args, **kwargs):
+            return func(*func_args, **kwargs)
+        storage_io.run_io = run_inline
+
+    token = prepare(args.size_mb)
+    copy_seconds, latencies = asyncio.run(run(token, args.size_mb, args.interval))
+
+    latencies.sort()
+    mode = "blocking (event loop)" if args.blocking else f"I/O pool ({os.getenv('STORAGE_IO_WORKERS', 8)} workers)"
+    print(f"mode:            {mode}")
+    print(f"upload:          {args.size_mb} MB in {copy_seconds:.2f} s")
+    print(f"probe requests:  {len(latencies)}")
+    if latencies:
+        print(f"latency p50:     {statistics.median(latencies):.1f} ms")
+        print(f"latency p99:     {latencies[int(len(latencies) * 0.99) - 1 if len(latencies) > 1 else 0]:.1f} ms")
+        print(f"latency max:     {latencies[-1]:.1f} ms")
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Check: the hot queries of the file, folder, listing, search and user services, and
+the garbage collector's look-up of expired files, are index lookups, not full
+table scans.
+
+Runs the service functions against a throwaway SQLite database, records
+every SELECT, UPDATE and DELETE they issue and runs EXPLAIN QUERY PLAN on
+each. Exits with status 1 if any plan scans a whole table, so it can guard
+index changes in CI.
+
+    python benchmarks/query_plans.py
+    python benchmarks/query_plans.py --verbose   # print every plan
+
+Runs against a throwaway UPLOAD_DIR and SQLite database in a temp directory.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+
+WORK_DIR = tempfile.mkdtemp(prefix="nidrive-bench-")
+os.environ["UPLOAD_DIR"] = os.path.join(WORK_DIR, "uploads")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(WORK_DIR, 'bench.db')}"
+os.environ["DATABASE_PATH"] = os.path.join(WORK_DIR, "bench.db")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+
+from app.core.database import SessionLocal, engine, init_db  # noqa: E402
+from app.models import user, folder, file, blob, file_version, upload_session, upload_reservation, multipart_upload, job  # noqa: E402,F401  register all tables
+from app.models.schemas import FileCreate, FileUpdate, FolderCreate, FolderUpdate  # noqa: E402
+from app.models.user import User  # noqa: E402
+from app.services import file_service, folder_service, gc_service, listing_service, search_service, user_service  # noqa: E402
+
+OWNER = "bench"
+
+# Plan rows that read a whole table or index
+SCAN_PREFIXES = ("SCAN ",)
+# Scans that are fine: one-row constant subqueries and the temp b-trees of ORDER BY
+ALLOWED_SCANS = ("SCAN CONSTANT ROW",)
+# Full-text MATCH constraints (":M") are lookups in the FTS5 index
+FTS_LOOKUP = "VIRTUAL TABLE INDEX 0:M"
+
+class Recorder:
+    """Collects the statements run while a label is set"""
+
+    def __init__(self):
+        self.label = None
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        verb = statement.lstrip().split(None, 1)[0].upper()
+        if self.label and verb in ("SELECT", "UPDATE", "DELETE") and not executemany:
+            self.statements.append((self.label, statement, parameters))
+
+def prepare(db):
+    db.add(User(telegram_id=OWNER, first_name="Bench", quota=1024.0))
+    db.commit()
+    root = folder_service.create_folder(db, FolderCreate(name="root"), OWNER)
+    child = folder_service.create_folder(db, FolderCreate(name="child", parent_id=root.id), OWNER)
+    other = folder_service.create_folder(db, FolderCreate(name="other"), OWNER)
+    files = [
+        file_service.create_file(
+            db, FileCreate(filename=f"file-{number}.txt", folder_id=child.id if number % 2 else root.id),
+            OWNER, f"private_files/{number}", 0.5, mime_type="text/plain", file_id=str(uuid.uuid4())
+        )
+        for number in range(6)
+    ]
+    return root, child, other, files
+
+def run_hot_paths(db, recorder: Recorder, root, child, other, files):
+    def record(label, func, *args, **kwargs):
+        recorder.label = label
+        try:
+            return func(*args, **kwargs)
+        finally:
+            recorder.label = None
+
+    # file_service
+    record("create_file", file_service.create_file, db, FileCreate(filename="new.txt", folder_id=child.id), OWNER, "private_files/new", 0.5, file_id=str(uuid.uuid4()))
+    record("get_files_by_owner", file_service.get_files_by_owner, db, OWNER)
+    record("get_files_by_owner(folder)", file_service.get_files_by_owner, db, OWNER, root.id)
+    record("get_file_by_id", file_service.get_file_by_id, db, files[0].id)
+    record("get_public_file_by_url", file_service.get_public_file_by_url, db, "https://example.org/x")
+    record("update_file(move)", asyncio.run, file_service.update_file(db, files[1].id, FileUpdate(folder_id=other.id), ""))
+    record("delete_file", file_service.delete_file, db, files[2].id, OWNER)
+
+    # folder_service
+    record("create_folder", folder_service.create_folder, db, FolderCreate(name="sub", parent_id=child.id), OWNER)
+    record("get_folders_by_owner", folder_service.get_folders_by_owner, db, OWNER)
+    record("get_folders_by_owner(parent)", folder_service.get_folders_by_owner, db, OWNER, root.id)
+    record("get_folder_tree", folder_service.get_folder_tree, db, OWNER)
+    record("get_folder_tree(parent, depth)", folder_service.get_folder_tree, db, OWNER, root.id, 1)
+    record("get_files_in_subtree", folder_service.get_files_in_subtree, db, root)
+    record("update_folder(move)", folder_service.update_folder, db, child.id, FolderUpdate(parent_id=other.id))
+    record("delete_folder", folder_service.delete_folder, db, other.id, OWNER)
+
+    # listing_service
+    for sort in listing_service.SORT_FIELDS:
+        page = record(f"list_directory({sort})", listing_service.list_directory, db, OWNER, root.id, sort, False, None, 1)
+        record(f"list_directory({sort}, cursor)", listing_service.list_directory, db, OWNER, root.id, sort, False, None, 1, page["next_cursor"])
+    record("list_directory(mime)", listing_service.list_directory, db, OWNER, root.id, "name", True, ["text/*"], 10)
+
+    # search_service
+    page = record("search", search_service.search, db, OWNER, "fi", limit=1)
+    record("search(cursor)", search_service.search, db, OWNER, "fi", limit=1, cursor=page["next_cursor"])
+    record("search(filters)", search_service.search, db, OWNER, "file", mime_types=["text/*"], min_size=1024)
+
+    # user_service
+    owner = record("get_user_by_telegram_id", user_service.get_user_by_telegram_id, db, OWNER)
+    record("get_user_stats", user_service.get_user_stats, db, owner)
+    record("reserve_space", user_service.reserve_space, db, OWNER, 10)
+    record("release_space", user_service.release_space, db, OWNER, 10)
+    db.commit()
+
+    # gc_service, a batch as _in_batches reads it
+    record("expired deleted files", lambda: gc_service._expired_files_query(db).filter(file.File.id > "").order_by(file.File.id).limit(10).all())
+
+def full_scans(plan):
+    return [
+        detail for detail in plan
+        if detail.startswith(SCAN_PREFIXES) and not detail.startswith(ALLOWED_SCANS) and FTS_LOOKUP not in detail
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--verbose", action="store_true", help="print the plan of every statement")
+    args = parser.parse_args()
+
+    init_db()
+    recorder = Recorder()
+    event.listen(engine, "before_cursor_execute", recorder)
+    db = SessionLocal()
+    try:
+        run_hot_paths(db, recorder, *prepare(db))
+    finally:
+        db.close()
+        event.remove(engine, "before_cursor_execute", recorder)
+
+    failures = 0
+    seen = set()
+    with engine.connect() as conn:
+        for label, statement, parameters in recorder.statements:
+            if (label, statement) in seen:
+                continue
+            seen.add((label, statement))
+            plan = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+            scans = full_scans(plan)
+            if scans:
+                failures += 1
+            if scans or args.verbose:
+                print(f"{'FULL SCAN' if scans else 'ok':<10}{label}")
+                print(f"          {' '.join(statement.split())}")
+                for detail in plan:
+                    print(f"            {detail}")
+
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+    print(f"{len(seen)} statements checked, {failures} with full table scans")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""
+Apply the pending schema migrations, which the service also does on startup.
+
+Usage (from the backend directory):
+    python migrations/migrate.py            # upgrade the database
+    python migrations/migrate.py --status   # list applied and pending migrations
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.database import Base, engine
+from app.core.migrations import MIGRATIONS, applied_versions, apply_migrations
+from app.models import user, folder, file, blob, file_version, upload_session, upload_reservation, multipart_upload, job  # register all tables
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upgrade the database schema")
+    parser.add_argument("--status", action="store_true", help="only list the migrations and whether they are applied")
+    args = parser.parse_args()
+
+    if args.status:
+        applied = set(applied_versions(engine))
+        for version, description, _ in sorted(MIGRATIONS, key=lambda entry: entry[0]):
+            print(f"{version:>4} {'applied' if version in applied else 'pending':<8} {description}")
+    else:
+        versions = apply_migrations(engine, Base.metadata)
+        print(f"{len(versions)} migrations applied" if versions else "Schema is up to date")
@@ -0,0 +1,54 @@
+"""
+Move files stored in the old flat private_files/public_files directories into
+the content-addressed blob store, which is sharded as blobs/ab/cd/<sha256>.
+
+Before this migration the on-disk location of a file depended on its
+visibility, and changing visibility copied the whole file between the two
+directories. Files in the blob store are addressed by their content hash only,
+so visibility is a database attribute.
+
+The service runs the same migration in the background on startup (see
+STORAGE_MIGRATION_ON_STARTUP); this script does it offline. Both can be
+stopped and started again at any time: each file is committed on its own and
+files that are already in the blob store are skipped.
+
+Usage (from the backend directory):
+    python migrations/migrate_storage_layout.py [--dry-run] [--batch-size N]
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.database import SessionLocal, init_db
+from app.models import user, folder, blob, file_version, upload_session, upload_reservation, multipart_upload, job  # register all tables
+from app.services.storage_migration_service import count_legacy_files, migrate_batch
+
+async def migrate(dry_run: bool, batch_size: int):
+    init_db()
+    db = SessionLocal()
+    try:
+        print(f"{count_legacy_files(db)} files to migrate")
+        if dry_run:
+            return
+
+        after_id, total_migrated, total_missing = "", 0, 0
+        while True:
+            after_id, migrated, missing = await migrate_batch(db, after_id, batch_size)
+            if after_id is None:
+                break
+            total_migrated += migrated
+            total_missing += missing
+            print(f"  {total_migrated} migrated, {total_missing} missing on disk")
+        print(f"Migrated {total_migrated} files, {count_legacy_files(db)} left")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move legacy files into the blob store")
+    parser.add_argument("--dry-run", action="store_true", help="only count the files to migrate")
+    parser.add_argument("--batch-size", type=int, default=100, help="files per batch")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.dry_run, args.batch_size))